@@ -1,80 +1,81 @@
-import os
 import cv2
-import numpy as np
+import heapq
 import shutil
 from pathlib import Path
-from sklearn.cluster import DBSCAN
-from core.processor import FaceProcessor
+from core.cluster import CaptureStore, OnlineClusterer, graph_cluster
+from core.processor import FaceProcessor, DetSizePolicy
 from core.identity import IdentityManager
-from core.utils import get_face_quality, correct_frame_rotation
+from core.utils import get_faces_quality, correct_frame_rotation
+from core.video import FrameSampler
 from core.config import Config
 
 # ================= 全局配置 =================
 EMPTY_POOL_COUNT = 50  # 预生成的空学生文件夹数量
-PROCESSED_VIDEOS = 2  # 处理前 N 个视频进行抓取
+PROCESSED_VIDEOS = 0  # 处理前 N 个视频进行抓取，0 表示全部
+CLUSTER_MODE = "online"  # "online" 边抓拍边聚类 / "graph" 全部抓完后近邻图聚类
 CLUSTER_EPS = 0.4  # 聚类阈值（越小越严格）
+CLUSTER_MIN_SAMPLES = 3  # 成为聚类核心所需的相似抓拍数
+CLUSTER_NEIGHBORS = 16  # 近邻图中每张抓拍保留的近邻数
+TOP_K = 5  # 每个聚类保留的照片数
+KEEP_CAPTURES = False  # 是否保留全部抓拍 (temp_faces/_captures)
+MAINTAIN_EVERY = 100  # 在线聚类每隔多少个有抓拍的采样帧合并/拆分一次并刷新文件夹
+QUALITY_POSE = False  # 质量分是否乘以由关键点估计的正脸程度
+EARLY_STOP = 2000  # 连续多少张抓拍没有新身份且各类照片已攒满时提前结束，0 表示不提前
+SAMPLE_FPS = Config.CROP_SAMPLE_FPS  # 采样率：每秒抓取的帧数
 # ============================================
 
 
-def run_auto_crop():
-    processor = FaceProcessor()
-    video_files = sorted(list(Path("videos").glob("*.mp4")))[:PROCESSED_VIDEOS]
-    output_path = Path("temp_faces")
-
-    # 1. 重置 temp_faces 目录
-    if output_path.exists():
-        shutil.rmtree(output_path)
-    output_path.mkdir(parents=True)
-
-    # 2. 初始化已占用的 ID 池
-    forbidden_ids = IdentityManager.get_existing_ids()
-
-    # 3. 执行功能：预生成 50 个空 ID 文件夹
-    IdentityManager.create_empty_pool(output_path, EMPTY_POOL_COUNT, forbidden_ids)
-
-    # 4. 特征提取
-    extracted_data = []
+def iter_captures(processor, video_files):
+    """逐个视频采样检测，产出 (视频, 帧号, 人脸序号, 特征, 质量分, 裁剪图)"""
     for v_p in video_files:
         print(f"[EXTRACT] {v_p.name}")
-        cap = cv2.VideoCapture(str(v_p))
-        fps, w, h = (
-            cap.get(cv2.CAP_PROP_FPS),
-            cap.get(cv2.CAP_PROP_FRAME_WIDTH),
-            cap.get(cv2.CAP_PROP_FRAME_HEIGHT),
-        )
-
-        f_idx = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            # 采样率：每秒抓取 5 帧
-            if f_idx % max(1, int(fps / 5)) == 0:
-                frame = correct_frame_rotation(frame, w, h)
-                for face in processor.get_faces(frame):
-                    q = get_face_quality(face, frame)
+        det_policy = DetSizePolicy()
+        with FrameSampler(v_p, SAMPLE_FPS) as sampler:
+            for f_idx, frame in sampler:
+                frame = correct_frame_rotation(frame, sampler.width, sampler.height)
+                faces = processor.get_faces(frame, det_policy)
+                # 整帧只计算一次灰度与 Laplacian
+                qualities = get_faces_quality(faces, frame, pose=QUALITY_POSE)
+                for i, (face, q) in enumerate(zip(faces, qualities)):
                     if q > 12:  # 质量过滤
                         b = face.bbox.astype(int)
                         # 扩边裁剪
                         crop = frame[
                             max(0, b[1] - 40) : b[3] + 40, max(0, b[0] - 40) : b[2] + 40
-                        ].copy()
-                        extracted_data.append(
-                            {"emb": face.normed_embedding, "img": crop, "q": q}
-                        )
-            f_idx += 1
-        cap.release()
-
-    # 5. 聚类并为聚类结果分配 ID
-    if extracted_data:
-        print(f"[INFO] Clustering {len(extracted_data)} face captures...")
-        embs = np.array([d["emb"] for d in extracted_data])
-        labels = (
-            DBSCAN(eps=CLUSTER_EPS, min_samples=3, metric="cosine").fit(embs).labels_
+                        ]
+                        yield v_p, f_idx, i, face.normed_embedding, q, crop
+
+
+def cluster_offline(processor, video_files, output_path, forbidden_ids):
+    """裁剪图抓到即落盘，全部抓完后做近邻图聚类，返回聚类数"""
+    store = CaptureStore(output_path / "_captures")
+    last_video = None
+    for v_p, f_idx, i, emb, q, crop in iter_captures(processor, video_files):
+        if v_p != last_video:
+            store.flush()
+            last_video = v_p
+        store.add(f"{v_p.stem}/{f_idx:07d}_{i}", crop, emb, q)
+
+    paths, quality, embs = store.load()
+    best = {}
+    if paths:
+        print(f"[INFO] Clustering {len(paths)} face captures...")
+        labels = graph_cluster(
+            embs, CLUSTER_EPS, CLUSTER_MIN_SAMPLES, k=CLUSTER_NEIGHBORS
         )
 
-        unique_labels = [l for l in set(labels) if l != -1]
-        for label in unique_labels:
+        # 每个聚类只保留质量最高的 TOP_K 张 (小顶堆)
+        for idx, label in enumerate(labels):
+            if label < 0:
+                continue
+            heap = best.setdefault(label, [])
+            item = (quality[idx], idx)
+            if len(heap) < TOP_K:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+
+        for label in sorted(best):
             # 为聚类结果生成新 ID
             new_id = IdentityManager.generate_unique_id(forbidden_ids)
             forbidden_ids.add(new_id)
@@ -82,17 +83,101 @@ def run_auto_crop():
             cluster_dir = output_path / f"cluster_student_{label:02d}"
             IdentityManager.save_id(cluster_dir, new_id)
 
-            # 存入该聚类中质量最好的前 5 张照片
-            idxs = [i for i, l in enumerate(labels) if l == label]
-            idxs = sorted(idxs, key=lambda i: extracted_data[i]["q"], reverse=True)
-            for rank, idx in enumerate(idxs[:5]):
-                cv2.imwrite(
-                    str(cluster_dir / f"rank{rank}.jpg"), extracted_data[idx]["img"]
-                )
+            # 存入该聚类中质量最好的前 TOP_K 张照片
+            ranked = sorted(best[label], reverse=True)
+            for rank, (_, idx) in enumerate(ranked):
+                shutil.copyfile(paths[idx], cluster_dir / f"rank{rank}.jpg")
 
-        print(
-            f"[SUCCESS] Generated {len(unique_labels)} clusters and {EMPTY_POOL_COUNT} empty ID folders."
-        )
+    if not KEEP_CAPTURES:
+        shutil.rmtree(store.root)
+    return len(best)
+
+
+def export_clusters(clusterer, output_path, exported, forbidden_ids):
+    """把成熟的类写成 cluster_student_XX 文件夹，被合并或清理的类删除其文件夹
+
+    exported: {uid: (学生 ID, 已写出的照片序号)}，照片没有变化的类不重复写盘。
+    """
+    mature = {c.uid: c for c in clusterer.mature()}
+    for uid in [uid for uid in exported if uid not in mature]:
+        shutil.rmtree(output_path / f"cluster_student_{uid:02d}", ignore_errors=True)
+        del exported[uid]
+
+    for uid, cluster in mature.items():
+        cluster_dir = output_path / f"cluster_student_{uid:02d}"
+        version = tuple(sorted(seq for _, seq, _, _ in cluster.best))
+        if uid in exported:
+            student_id, written = exported[uid]
+            if written == version:
+                continue
+        else:
+            # 为新出现的类生成新 ID
+            student_id = IdentityManager.generate_unique_id(forbidden_ids)
+            forbidden_ids.add(student_id)
+            IdentityManager.save_id(cluster_dir, student_id)
+        for old in cluster_dir.glob("rank*.jpg"):
+            old.unlink()
+        for rank, (_, crop) in enumerate(cluster.crops):
+            cv2.imwrite(str(cluster_dir / f"rank{rank}.jpg"), crop)
+        exported[uid] = (student_id, version)
+
+
+def cluster_online(processor, video_files, output_path, forbidden_ids):
+    """边抓拍边聚类，定期刷新文件夹；身份稳定后可提前结束，返回聚类数"""
+    clusterer = OnlineClusterer(CLUSTER_EPS, CLUSTER_MIN_SAMPLES, TOP_K)
+    exported = {}
+    last_frame = None
+    n_frames = 0
+    for v_p, f_idx, _, emb, q, crop in iter_captures(processor, video_files):
+        # 裁剪图会在内存中保留，复制一份以免引用整帧
+        clusterer.add(emb, q, crop.copy())
+        if (v_p, f_idx) == last_frame:
+            continue
+        last_frame = (v_p, f_idx)
+        n_frames += 1
+        if n_frames % MAINTAIN_EVERY == 0:
+            clusterer.maintain()
+            export_clusters(clusterer, output_path, exported, forbidden_ids)
+            print(
+                f"[CLUSTER] {clusterer.seq} captures | "
+                f"{len(clusterer.mature())} identities"
+            )
+            if EARLY_STOP and clusterer.settled(EARLY_STOP):
+                print("[INFO] Identities settled, stopping early.")
+                break
+
+    clusterer.maintain()
+    export_clusters(clusterer, output_path, exported, forbidden_ids)
+    return len(exported)
+
+
+def run_auto_crop():
+    processor = FaceProcessor()
+    video_files = sorted(Path("videos").glob("*.mp4"))
+    if PROCESSED_VIDEOS:
+        video_files = video_files[:PROCESSED_VIDEOS]
+    output_path = Path("temp_faces")
+
+    # 1. 重置 temp_faces 目录
+    if output_path.exists():
+        shutil.rmtree(output_path)
+    output_path.mkdir(parents=True)
+
+    # 2. 初始化已占用的 ID 池
+    forbidden_ids = IdentityManager.get_existing_ids()
+
+    # 3. 执行功能：预生成 50 个空 ID 文件夹
+    IdentityManager.create_empty_pool(output_path, EMPTY_POOL_COUNT, forbidden_ids)
+
+    # 4. 特征提取与聚类，并为聚类结果分配 ID
+    if CLUSTER_MODE == "online":
+        n_clusters = cluster_online(processor, video_files, output_path, forbidden_ids)
+    else:
+        n_clusters = cluster_offline(processor, video_files, output_path, forbidden_ids)
+
+    print(
+        f"[SUCCESS] Generated {n_clusters} clusters and {EMPTY_POOL_COUNT} empty ID folders."
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,88 @@
+import sys
+import time
+import numpy as np
+import polars as pl
+from core.index import FlatIndex, IVFIndex
+
+# ================= 全局配置 =================
+GALLERY_SIZES = [1000, 5000, 20000, 50000]
+NPROBES = [1, 4, 8, 16, 32]
+N_QUERIES = 200  # 模拟查询的人脸数量
+BATCH = 40  # 每帧人脸数 (一次 search 的查询批量)
+DIM = 512
+# ============================================
+
+
+def make_gallery(n, rng):
+    """生成带簇结构的单位向量底库，模拟真实人脸特征的分布"""
+    n_groups = max(1, n // 50)
+    centers = rng.normal(size=(n_groups, DIM)).astype(np.float32)
+    gallery = centers[rng.integers(0, n_groups, n)] + rng.normal(
+        scale=1.5, size=(n, DIM)
+    ).astype(np.float32)
+    return gallery / np.linalg.norm(gallery, axis=1, keepdims=True)
+
+
+def make_queries(gallery, rng):
+    """从底库中抽样并加噪，模拟同一个人在课堂视频中的特征"""
+    truth = rng.choice(len(gallery), N_QUERIES, replace=False)
+    q = gallery[truth] + rng.normal(scale=0.05, size=(N_QUERIES, DIM)).astype(
+        np.float32
+    )
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def time_search(index, queries):
+    """返回每帧 (BATCH 张脸) 的平均检索耗时 (ms) 和 top-1 结果"""
+    results = []
+    start = time.perf_counter()
+    for i in range(0, len(queries), BATCH):
+        idx, _ = index.search(queries[i : i + BATCH], k=1)
+        results.append(idx[:, 0])
+    elapsed = time.perf_counter() - start
+    n_batches = -(-len(queries) // BATCH)
+    return elapsed / n_batches * 1000, np.concatenate(results)
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or GALLERY_SIZES
+    rng = np.random.default_rng(0)
+    rows = []
+
+    for n in sizes:
+        gallery = make_gallery(n, rng)
+        queries = make_queries(gallery, rng)
+
+        flat_ms, exact = time_search(FlatIndex(gallery), queries)
+        rows.append(
+            {"N": n, "index": "flat", "nprobe": 0, "ms/frame": flat_ms, "recall@1": 1.0}
+        )
+
+        start = time.perf_counter()
+        ivf = IVFIndex(gallery).build()
+        print(
+            f"[BUILD] N={n:<7} nlist={ivf.nlist:<5} {time.perf_counter() - start:.2f}s"
+        )
+        for nprobe in NPROBES:
+            ivf.nprobe = nprobe
+            ivf_ms, approx = time_search(ivf, queries)
+            rows.append(
+                {
+                    "N": n,
+                    "index": "ivf",
+                    "nprobe": nprobe,
+                    "ms/frame": ivf_ms,
+                    "recall@1": float(np.mean(approx == exact)),
+                }
+            )
+
+    df = pl.DataFrame(rows).with_columns(pl.col("ms/frame").round(3))
+    print("\n" + "=" * 60)
+    with pl.Config(tbl_rows=-1):
+        print(df)
+    print("=" * 60)
+    print("当 ivf 在召回 >= 0.99 时仍明显快于 flat，即可调低 Config.IVF_MIN_SIZE")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import polars as pl
+
+# ================= 全局配置 =================
+REPEAT = 3  # 每个场景重复的次数 (取中位数)
+# ============================================
+
+# 每个场景在全新的子进程中运行，打印 {阶段: 秒}；{cache_dir} 为 ORT 优化图缓存目录
+SCENARIOS = {
+    "import onnxruntime": """
+t = time.perf_counter(); import onnxruntime
+out["import"] = time.perf_counter() - t
+""",
+    "import cv2": """
+t = time.perf_counter(); import cv2
+out["import"] = time.perf_counter() - t
+""",
+    "import polars": """
+t = time.perf_counter(); import polars
+out["import"] = time.perf_counter() - t
+""",
+    "import insightface": """
+t = time.perf_counter(); import insightface.app
+out["import"] = time.perf_counter() - t
+""",
+    "sync names / report": """
+t = time.perf_counter()
+from core.engine import AttendanceEngine
+from core.events import attendance_report
+out["import"] = time.perf_counter() - t
+t = time.perf_counter()
+engine = AttendanceEngine({db!r})
+engine.sync_names()
+out["load db"] = time.perf_counter() - t
+t = time.perf_counter()
+attendance_report(engine.db)
+out["report"] = time.perf_counter() - t
+out["models loaded"] = "insightface" in sys.modules or "onnxruntime" in sys.modules
+""",
+    "FaceAnalysis (all models)": """
+t = time.perf_counter()
+from insightface.app import FaceAnalysis
+from core.config import Config
+from core.utils import silence_stdout
+out["import"] = time.perf_counter() - t
+t = time.perf_counter()
+with silence_stdout():
+    app = FaceAnalysis(name=Config.NAME, providers=Config.get_providers())
+    app.prepare(ctx_id=0, det_size=Config.DET_SIZES[0])
+out["models"] = time.perf_counter() - t
+""",
+    "FaceProcessor (cold ORT cache)": """
+from core.config import Config
+Config.CACHE_DIR = tempfile.mkdtemp()
+t = time.perf_counter()
+from core.processor import FaceProcessor
+out["import"] = time.perf_counter() - t
+t = time.perf_counter()
+FaceProcessor()
+out["models"] = time.perf_counter() - t
+""",
+    "FaceProcessor (warm ORT cache)": """
+from core.config import Config
+Config.CACHE_DIR = {cache_dir!r}
+t = time.perf_counter()
+from core.processor import FaceProcessor
+out["import"] = time.perf_counter() - t
+t = time.perf_counter()
+FaceProcessor()
+out["models"] = time.perf_counter() - t
+""",
+}
+
+PRELUDE = """
+import sys, time, json, tempfile
+out = {}
+"""
+EPILOGUE = """
+print(json.dumps(out))
+"""
+
+
+def run_scenario(code):
+    """在新的解释器中运行一个场景，返回各阶段耗时，total 为含解释器启动的进程总耗时"""
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-c", PRELUDE + code + EPILOGUE],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    out = json.loads(proc.stdout.strip().splitlines()[-1])
+    out["total"] = time.perf_counter() - start
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="测量各入口的启动耗时")
+    parser.add_argument("--db", default="student_db.ipc", help="底库路径")
+    parser.add_argument("--repeat", type=int, default=REPEAT, help="每个场景的重复次数")
+    parser.add_argument(
+        "--only", action="append", help="只运行名称包含该字符串的场景，可重复指定"
+    )
+    args = parser.parse_args()
+
+    cache_dir = tempfile.mkdtemp()
+    rows = []
+    for name, code in SCENARIOS.items():
+        if args.only and not any(s in name for s in args.only):
+            continue
+        code = code.format(db=args.db, cache_dir=cache_dir)
+        try:
+            if "warm" in name:
+                run_scenario(code)  # 先运行一次，生成优化图缓存
+            runs = [run_scenario(code) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"[SKIP] {name}: {e}")
+            continue
+        row = {"scenario": name}
+        for key in runs[0]:
+            values = [r[key] for r in runs]
+            if isinstance(values[0], bool):
+                row[key] = str(values[0])
+            else:
+                row[f"{key} (s)"] = sorted(values)[len(values) // 2]
+        rows.append(row)
+        print(f"[INFO] {name}: {row.get('total (s)', 0):.3f}s")
+
+    if rows:
+        with pl.Config(tbl_rows=-1, tbl_cols=-1, float_precision=3):
+            print(pl.DataFrame(rows, infer_schema_length=None))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,76 +1,283 @@
-import insightface
-from insightface.app import FaceAnalysis
+import sys
+import json
 import time
-import numpy as np
+import argparse
+import platform
+import tempfile
 import cv2
-import onnxruntime as ort
+import numpy as np
+import polars as pl
+from pathlib import Path
+from core.config import Config
+from core.database import FaceDatabase
+from core.engine import AttendanceEngine
+from core.pipeline import FramePipeline
+from core.processor import FaceProcessor, DetSizePolicy
+from core.utils import silence_stdout
+
+# ================= 全局配置 =================
+FACE_COUNTS = [0, 1, 10, 40]  # 每帧合成的人脸数
+DET_SIZES = [(320, 320), (640, 640)]
+GALLERY_SIZES = [100, 1000, 10000]
+THREADS = [1, 2, 4]  # 流水线推理线程数
+ITERATIONS = 20
+WARMUP = 3
+FRAME_SHAPE = (1080, 1920)  # 合成帧尺寸 (1080P)
+# ============================================
+
+
+def load_fixtures(fixture_dir):
+    """读取夹具人脸图片 (默认 faces/ 下的注册照片)"""
+    paths = []
+    for ext in ["*.jpg", "*.jpeg", "*.png"]:
+        paths.extend(Path(fixture_dir).rglob(ext))
+    images = [
+        img for img in (cv2.imread(str(p)) for p in sorted(paths)) if img is not None
+    ]
+    if not images:
+        sys.exit(f"[ERROR] No fixture images found in {fixture_dir}/, use --fixtures.")
+    return images
+
+
+def compose_frame(fixtures, n_faces):
+    """把 n_faces 张夹具人脸按网格贴到一张 1080P 画布上，人数完全可控"""
+    h, w = FRAME_SHAPE
+    frame = np.full((h, w, 3), 96, dtype=np.uint8)
+    if n_faces == 0:
+        return frame
+    cols = int(np.ceil(np.sqrt(n_faces * w / h)))
+    rows = int(np.ceil(n_faces / cols))
+    cell = min(h // rows, w // cols)
+    for i in range(n_faces):
+        img = fixtures[i % len(fixtures)]
+        scale = cell * 0.9 / max(img.shape[:2])
+        img = cv2.resize(img, None, fx=scale, fy=scale)
+        y, x = (i // cols) * cell, (i % cols) * cell
+        frame[y : y + img.shape[0], x : x + img.shape[1]] = img
+    return frame
+
+
+def make_engine(tmp_dir, gallery_size, dim, real_embs):
+    """构造指定规模的底库：前几行是夹具人脸的真实特征，其余为随机单位向量"""
+    rng = np.random.default_rng(0)
+    embs = rng.normal(size=(gallery_size, dim)).astype(np.float32)
+    embs /= np.linalg.norm(embs, axis=1, keepdims=True)
+    n_real = min(len(real_embs), gallery_size)
+    embs[:n_real] = real_embs[:n_real]
+    db_path = Path(tmp_dir) / f"gallery_{gallery_size}.ipc"
+    ids = [f"BENCH_{i:06d}" for i in range(gallery_size)]
+    FaceDatabase(db_path).save({"id": ids, "name": ids, "embedding": embs})
+    return AttendanceEngine(db_path, load_processor=False)
+
+
+def summarize(name, samples, **params):
+    ms = np.asarray(samples) * 1000
+    return {
+        "name": name,
+        **params,
+        "n": len(ms),
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p90_ms": float(np.percentile(ms, 90)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+def timed(fn, iterations):
+    samples = []
+    for i in range(WARMUP + iterations):
+        start = time.perf_counter()
+        result = fn()
+        if i >= WARMUP:
+            samples.append(time.perf_counter() - start)
+    return samples, result
+
+
+def bench_frame_stages(processor, engine, frames, det_sizes, iterations):
+    """逐阶段计时：decode / detect / align / embed / match / update"""
+    records = []
+    for det_size in det_sizes:
+        # 单档策略：固定检测输入尺寸，不做自适应放大
+        policy = DetSizePolicy([det_size])
+        tag = f"{det_size[0]}x{det_size[1]}"
+        for n_faces, frame in frames.items():
+            prefix = f"frame/det={tag}/faces={n_faces}"
+            params = {"suite": "frame", "det_size": tag, "faces": n_faces}
+            jpeg = cv2.imencode(".jpg", frame)[1]
 
+            samples, frame = timed(
+                lambda: cv2.imdecode(jpeg, cv2.IMREAD_COLOR), iterations
+            )
+            records.append(
+                summarize(f"{prefix}/decode", samples, stage="decode", **params)
+            )
+            samples, faces = timed(lambda: processor.detect(frame, policy), iterations)
+            records.append(
+                summarize(f"{prefix}/detect", samples, stage="detect", **params)
+            )
+            params["detected"] = len(faces)
+            if not faces:
+                continue
 
-def get_optimal_providers():
-    """
-    根据当前硬件环境，自动排列算力提供商的优先级
-    """
-    available = ort.get_available_providers()
-    print(f"系统可用的 Providers: {available}")
+            samples, crops = timed(lambda: processor.align(frame, faces), iterations)
+            records.append(
+                summarize(f"{prefix}/align", samples, stage="align", **params)
+            )
+            samples, _ = timed(lambda: processor.rec_model.get_feat(crops), iterations)
+            records.append(
+                summarize(f"{prefix}/embed", samples, stage="embed", **params)
+            )
+            processor.embed(frame, faces)
+            embs = np.stack([f.normed_embedding for f in faces])
+            samples, (sids, _) = timed(lambda: engine.identify_faces(embs), iterations)
+            records.append(
+                summarize(f"{prefix}/match", samples, stage="match", **params)
+            )
 
-    # 优先级定义：CUDA (Nvidia) > CoreML (Mac) > CPU
-    priority_order = [
-        "CUDAExecutionProvider",
-        "CoreMLExecutionProvider",
-        "CPUExecutionProvider",
+            def update():
+                engine.update_student_features(
+                    [(sid, emb) for sid, emb in zip(sids, embs) if sid]
+                )
+
+            samples, _ = timed(update, iterations)
+            records.append(
+                summarize(f"{prefix}/update", samples, stage="update", **params)
+            )
+    return records
+
+
+def bench_gallery(tmp_dir, embs, gallery_sizes, iterations):
+    """不同底库规模下一帧人脸的匹配与特征进化耗时"""
+    records = []
+    for size in gallery_sizes:
+        engine = make_engine(tmp_dir, size, embs.shape[1], embs)
+        params = {"suite": "gallery", "gallery": size, "faces": len(embs)}
+        prefix = f"gallery/size={size}/faces={len(embs)}"
+        samples, (sids, _) = timed(lambda: engine.identify_faces(embs), iterations)
+        records.append(summarize(f"{prefix}/match", samples, stage="match", **params))
+
+        def update():
+            engine.update_student_features(
+                [(sid, emb) for sid, emb in zip(sids, embs) if sid]
+            )
+
+        samples, _ = timed(update, iterations)
+        records.append(summarize(f"{prefix}/update", samples, stage="update", **params))
+    return records
+
+
+def bench_threads(processors, frame, threads, iterations):
+    """流水线吞吐：不同推理线程数下每帧的平均耗时"""
+    records = []
+    n_frames = max(iterations, 8)
+    for n in threads:
+        pipeline = FramePipeline(processors[:n])
+        samples = []
+        for _ in range(3):
+            start = time.perf_counter()
+            for _ in pipeline.run((i, frame) for i in range(n_frames)):
+                pass
+            samples.append((time.perf_counter() - start) / n_frames)
+        rec = summarize(
+            f"threads/n={n}", samples, suite="threads", stage="pipeline", threads=n
+        )
+        rec["fps"] = 1000 / rec["p50_ms"]
+        records.append(rec)
+    return records
+
+
+def compare(records, baseline_path, tolerance):
+    """与基线 JSON 对比 p50，超出容忍度的条目视为性能回退"""
+    baseline = {
+        r["name"]: r for r in json.loads(Path(baseline_path).read_text())["results"]
+    }
+    rows = [
+        {
+            "name": r["name"],
+            "base_p50_ms": baseline[r["name"]]["p50_ms"],
+            "p50_ms": r["p50_ms"],
+            "ratio": r["p50_ms"] / max(baseline[r["name"]]["p50_ms"], 1e-9),
+        }
+        for r in records
+        if r["name"] in baseline
     ]
+    if not rows:
+        return False
+    df = pl.DataFrame(rows).with_columns(
+        (pl.col("ratio") > 1 + tolerance).alias("regressed")
+    )
+    with pl.Config(tbl_rows=-1, fmt_str_lengths=80):
+        print(df)
+    return bool(df["regressed"].any())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="考勤流水线性能基准")
+    parser.add_argument("--fixtures", default="faces", help="夹具人脸图片目录")
+    parser.add_argument("--output", default="bench_results.json", help="JSON 结果路径")
+    parser.add_argument("--baseline", help="用于对比的历史 JSON 结果")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.15, help="允许的 p50 退化比例"
+    )
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--faces", type=int, nargs="+", default=FACE_COUNTS)
+    parser.add_argument(
+        "--det-sizes", type=int, nargs="+", default=[s[0] for s in DET_SIZES]
+    )
+    parser.add_argument("--galleries", type=int, nargs="+", default=GALLERY_SIZES)
+    parser.add_argument("--threads", type=int, nargs="+", default=THREADS)
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures)
+    frames = {n: compose_frame(fixtures, n) for n in args.faces}
+    with silence_stdout():
+        processors = [FaceProcessor() for _ in range(max(args.threads))]
+    processor = processors[0]
+
+    busiest = frames[max(args.faces)]
+    faces = processor.get_faces(busiest)
+    if not faces:
+        sys.exit("[ERROR] No face detected on the synthetic frame, check fixtures.")
+    embs = np.stack([f.normed_embedding for f in faces])
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        engine = make_engine(tmp_dir, max(args.galleries), embs.shape[1], embs)
+        det_sizes = [(s, s) for s in args.det_sizes]
+        print("[BENCH] per-stage latency...")
+        results += bench_frame_stages(
+            processor, engine, frames, det_sizes, args.iterations
+        )
+        print("[BENCH] gallery sizes...")
+        results += bench_gallery(tmp_dir, embs, args.galleries, args.iterations)
+    print("[BENCH] pipeline threads...")
+    results += bench_threads(processors, busiest, args.threads, args.iterations)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "platform": platform.platform(),
+            "processor": platform.processor(),
+            "python": platform.python_version(),
+            "providers": processor.det_model.session.get_providers(),
+            "model": Config.NAME,
+            "fixtures": len(fixtures),
+        },
+        "results": results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+
+    print("\n" + "=" * 70)
+    df = pl.DataFrame(results).select(["name", "n", "p50_ms", "p90_ms", "p99_ms"])
+    with pl.Config(tbl_rows=-1, fmt_str_lengths=80):
+        print(df)
+    print("=" * 70)
+    print(f"[INFO] Results written to {args.output}")
 
-    # 过滤出当前系统支持的，并按优先级排序
-    matched_providers = [p for p in priority_order if p in available]
-    return matched_providers
-
-
-def check_acceleration():
-    providers = get_optimal_providers()
-    print(f"选定的执行优先级: {providers}")
-
-    # 初始化模型
-    # ctx_id=0 表示使用第一个 GPU，如果没有 GPU 会自动回退
-    try:
-        app = FaceAnalysis(name="buffalo_l", providers=providers)
-        # det_size 必须是 32 的倍数，(640, 640) 是通用标准
-        app.prepare(ctx_id=0, det_size=(640, 640))
-    except Exception as e:
-        print(f"模型初始化失败: {e}")
-        return
-
-    # 创建一个随机图像进行压力测试 (1080P 模拟)
-    test_img = np.random.randint(0, 255, (1080, 1920, 3), dtype=np.uint8)
-
-    print("正在进行性能预热...")
-    for _ in range(3):
-        app.get(test_img)
-
-    # 正式测试
-    print("正在测试 10 帧处理速度...")
-    start_time = time.time()
-    for i in range(10):
-        _ = app.get(test_img)
-
-    total_time = time.time() - start_time
-    avg_time = total_time / 10
-
-    print(f"\n" + "=" * 30)
-    print(f"硬件加速报告")
-    print(f"=" * 30)
-    print(f"当前运行设备: {app.models['detection'].session.get_providers()[0]}")
-    print(f"平均每帧耗时: {avg_time:.4f} 秒")
-    print(f"实时处理能力: {1 / avg_time:.2f} FPS")
-
-    # 性能评估建议
-    if 1 / avg_time > 15:
-        print("性能评价: 🚀 极佳 (支持实时高帧率识别)")
-    elif 1 / avg_time > 5:
-        print("性能评价: ✅ 良好 (建议配合跳帧策略)")
-    else:
-        print("性能评价: 🐢 一般 (强烈建议开启跳帧处理)")
-    print("=" * 30)
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        print("[WARN] Performance regression detected.")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
-    check_acceleration()
+    main()
@@ -0,0 +1,279 @@
+import multiprocessing
+import numpy as np
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from .cache import VideoCache
+from .config import Config
+from .engine import AttendanceEngine
+from .pipeline import FramePipeline
+from .processor import DetSizePolicy
+from .events import EventLog
+from .gating import MotionGate
+from .metrics import metrics
+from .tracker import FaceTracker, track_hits
+from .video import FrameSampler, ProcessFrameSampler
+
+
+class ReusedFrames:
+    """运动门控沿用上一帧人脸的帧：不再识别、不产生特征进化，只按上一帧的身份累计命中
+
+    这些帧不逐帧写入事件日志，而是合并为上一帧各身份的一行，计数为沿用的帧数。
+    """
+
+    def __init__(self, hits, events=None):
+        self.hits = hits
+        self.events = events
+        self.frame = -1
+        self.sids, self.scores, self.bboxes = [], [], []
+        self.count = 0
+
+    def matched(self, frame, sids, scores, bboxes):
+        """记下一帧实际识别的结果，之后沿用的帧以它为准"""
+        self.flush()
+        self.frame, self.sids, self.scores, self.bboxes = frame, sids, scores, bboxes
+
+    def repeat(self):
+        self.count += 1
+        for sid in self.sids:
+            if sid:
+                self.hits[sid] += 1
+
+    def flush(self):
+        """把累计的沿用帧写入事件日志 (视频结束或下一次识别前调用)"""
+        if self.count and self.events is not None:
+            self.events.faces(
+                self.frame,
+                self.sids,
+                self.scores,
+                self.bboxes,
+                [self.count] * len(self.sids),
+            )
+        self.count = 0
+
+
+def match_faces(engine, faces, hits, events=None, frame=-1, reused=None):
+    """匹配一帧中的所有人脸并累计命中，返回可用于特征进化的 [(id, 特征)]
+
+    events: 该视频源的 SourceEvents，命中同时记入考勤事件日志
+    reused: ReusedFrames，记下本帧的识别结果供门控沿用
+    """
+    if not faces:
+        if reused is not None:
+            reused.matched(frame, [], [], [])
+        return []
+    return match_embeddings(
+        engine,
+        np.stack([face.normed_embedding for face in faces]),
+        hits,
+        events,
+        frame,
+        [face.bbox for face in faces],
+        reused,
+    )
+
+
+def match_embeddings(
+    engine, embs, hits, events=None, frame=-1, bboxes=None, reused=None
+):
+    """同 match_faces，输入为一帧的 (M, D) 特征矩阵与人脸框 (如来自结果缓存)"""
+    if len(embs) == 0:
+        if reused is not None:
+            reused.matched(frame, [], [], [])
+        return []
+    sids, scores = engine.identify_faces(embs)
+    if reused is not None:
+        reused.matched(frame, sids, scores, bboxes)
+    if events is not None:
+        events.faces(frame, sids, scores, bboxes)
+    updates = []
+    for sid, score, emb in zip(sids, scores, embs):
+        if sid:
+            hits[sid] += 1
+            if score > Config.QUALITY_SCORE_THRES:
+                updates.append((sid, emb))
+    return updates
+
+
+def scan_video(
+    engine,
+    path,
+    sample_fps,
+    processors=None,
+    cache=None,
+    track=False,
+    events=None,
+    capture_process=False,
+    gate=False,
+    roi=None,
+):
+    """处理单个视频，返回逐帧的特征更新生成器与 hits
+
+    命中结果缓存时跳过解码与推理，只重新匹配；否则跑完整流水线并写入缓存。
+    track=True 时推理线程只做检测，识别由跟踪器按需触发，按轨迹计数 (不使用缓存)。
+    每帧的特征更新由生成器产出，调用方决定立即应用还是延后合并。
+    events: EventLog，命中以视频文件名为视频源记入考勤事件日志，处理完时写入完成标记
+    capture_process: 在独立进程中解码，帧经共享内存交给推理线程
+    gate: 运动门控，画面未变化的帧跳过推理、沿用上一帧的人脸；roi 为座位区域
+        (见 MotionGate，None 时取 Config.GATE_ROI)。门控的结果不写入缓存
+    """
+    hits = {sid: 0 for sid in engine.ids}
+    log = events.source(Path(path).name) if events is not None else None
+    motion_gate = MotionGate(roi) if gate else None
+
+    def sampler_for(pipeline):
+        if not capture_process:
+            return FrameSampler(path, sample_fps)
+        # 帧视图要在流水线的所有在途帧 (见 FramePipeline.run) 与调用方手中的一帧处理完之前有效
+        hold = pipeline.queue_size + 2 * len(pipeline.processors) + 1
+        return ProcessFrameSampler(path, sample_fps, hold=hold)
+
+    def tracked_frames():
+        processors_ = processors or [engine.ensure_processor()]
+        tracker = FaceTracker()
+        pipeline = FramePipeline(
+            processors_, stage="detect", det_policy=DetSizePolicy(), gate=motion_gate
+        )
+        f_idx = -1
+
+        def count(tracks):
+            for sid, n in track_hits(tracks).items():
+                hits[sid] += n
+            if log is not None:
+                log.tracks(f_idx, tracks)
+
+        with sampler_for(pipeline) as sampler:
+            for f_idx, frame, faces, reused in pipeline.run(sampler):
+                if reused:
+                    # 沿用的人脸只延续轨迹 (计入帧数)，不重新识别，也不做特征进化
+                    tracker.update(faces)
+                    updates = []
+                else:
+                    _, updates = tracker.recognize(frame, faces, processors_[0], engine)
+                count(tracker.pop_finished())
+                yield updates
+        tracker.finish_all()
+        count(tracker.pop_finished())
+        if log is not None:
+            log.done()
+        print(f"[TRACK] {tracker.n_embeddings}/{tracker.n_detections} faces recognized")
+        report_gate()
+
+    def report_gate():
+        if motion_gate is not None and motion_gate.checked:
+            print(
+                f"[GATE] {motion_gate.skipped}/{motion_gate.checked} frames skipped "
+                f"({motion_gate.skipped / motion_gate.checked:.0%})"
+            )
+
+    def frames():
+        cached = cache.load(path, sample_fps) if cache else None
+        if cached is not None:
+            for f_idx, bboxes, _, embs in cached:
+                yield match_embeddings(engine, embs, hits, log, f_idx, bboxes)
+            if log is not None:
+                log.done()
+            return
+
+        # 门控的结果不写入缓存；需要写入时每帧只保留紧凑数组 (VideoCache.pack)
+        results = [] if cache and motion_gate is None else None
+        pipeline = FramePipeline(
+            processors or [engine.ensure_processor()],
+            det_policy=DetSizePolicy(),
+            gate=motion_gate,
+        )
+        repeats = ReusedFrames(hits, log)
+        with sampler_for(pipeline) as sampler:
+            for f_idx, _, faces, reused in pipeline.run(sampler):
+                if reused:
+                    repeats.repeat()
+                    yield []
+                    continue
+                if faces and results is not None:
+                    results.append((f_idx, *VideoCache.pack(faces)))
+                yield match_faces(engine, faces, hits, log, f_idx, repeats)
+        repeats.flush()
+        if log is not None:
+            log.done()
+        report_gate()
+        if results is not None:
+            cache.save(path, sample_fps, results)
+
+    return (tracked_frames() if track else frames()), hits
+
+
+_worker_engine = None
+_worker_cache = None
+_worker_events = None
+
+
+def _init_worker(db_path, use_cache, events_root, run_id, server=None):
+    global _worker_engine, _worker_cache, _worker_events
+    if server:
+        from .remote import RemoteEngine
+
+        _worker_engine = RemoteEngine(server)
+    else:
+        _worker_engine = AttendanceEngine(db_path, load_processor=False)
+    _worker_cache = VideoCache() if use_cache else None
+    if events_root is not None:
+        _worker_events = EventLog(events_root, run_id=run_id)
+
+
+def _scan_video(path, sample_fps, track, gate=False, roi=None):
+    # 模型在首个未命中缓存的视频上才加载
+    frames, hits = scan_video(
+        _worker_engine,
+        path,
+        sample_fps,
+        cache=_worker_cache,
+        track=track,
+        events=_worker_events,
+        gate=gate,
+        roi=roi,
+    )
+    updates = [u for frame_updates in frames for u in frame_updates]
+    if _worker_events is not None:
+        # 工作进程没有结束时的回调：每个视频处理完就把本进程的分片合并为一个文件
+        _worker_events.close()
+    # 本进程的耗时与计数增量随结果返回，由父进程汇总
+    return hits, updates, metrics.drain()
+
+
+def scan_videos(
+    paths,
+    db_path,
+    workers,
+    sample_fps,
+    use_cache=True,
+    track=False,
+    events=None,
+    server=None,
+    gate=False,
+    roi=None,
+):
+    """多进程并行处理视频，按 paths 的顺序逐个产出 (hits, updates)
+
+    每个进程独立加载模型，并以同一份底库快照做匹配；特征更新只收集不应用，
+    由调用方按视频顺序统一进化，因此结果与进程数 (>= 1) 无关。
+    注意这与单进程流水线 (scan_video) 不同：后者每帧之后立即进化，后面的帧与视频
+    基于进化后的特征匹配，两种模式在阈值附近的命中可能不同。
+    events: EventLog，各进程以相同的运行编号把事件写入同一目录
+    server: 识别服务地址，给出时各进程只做解码，推理与匹配交给服务 (匹配基于服务端的实时底库)
+    gate / roi: 运动门控，见 scan_video
+    """
+    ctx = multiprocessing.get_context("spawn")
+    log_args = (str(events.root), events.run_id) if events else (None, None)
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=ctx,
+        initializer=_init_worker,
+        initargs=(str(db_path), use_cache, *log_args, server),
+    ) as pool:
+        futures = [
+            pool.submit(_scan_video, str(p), sample_fps, track, gate, roi)
+            for p in paths
+        ]
+        for future in futures:
+            hits, updates, snap = future.result()
+            metrics.merge(snap)
+            yield hits, updates
@@ -0,0 +1,239 @@
+import os
+import json
+import hashlib
+from contextlib import contextmanager
+import numpy as np
+import polars as pl
+from pathlib import Path
+from .config import Config
+from .database import embeddings_to_numpy, embeddings_to_series
+from .models import model_variant
+
+
+def file_stamp(path):
+    """文件大小与修改时间，用于快速判断文件是否变化"""
+    st = Path(path).stat()
+    return f"{st.st_size}:{st.st_mtime_ns}"
+
+
+def file_digest(path):
+    """文件内容哈希"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+@contextmanager
+def file_lock(path):
+    """跨进程的排他文件锁 (阻塞等待)，用于多个工作进程读改写同一个索引文件"""
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            import msvcrt
+
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    # LK_LOCK 重试约 10 秒后仍失败时抛出，继续等待
+                    continue
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class VideoCache:
+    """按视频内容缓存每个采样帧的检测框与人脸特征
+
+    缓存键只包含影响推理结果的参数 (视频内容哈希、模型名与浮点/INT8 变体、
+    检测分辨率阶梯、采样率)，不含识别阈值等匹配参数：
+    调整阈值、同步姓名或新增注册后重跑只需重新匹配。
+    每个视频处理完立即落盘，中断后重跑会从下一个未完成的视频继续。
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = Path(cache_dir or Config.CACHE_DIR) / "videos"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._hash_index_path = self.cache_dir / "hashes.json"
+        self._hash_index = self._read_hash_index()
+
+    def _read_hash_index(self):
+        if not self._hash_index_path.exists():
+            return {}
+        return json.loads(self._hash_index_path.read_text(encoding="utf-8"))
+
+    def file_hash(self, path):
+        """视频内容哈希；文件大小与修改时间不变时直接复用上次的结果"""
+        path = Path(path)
+        stamp = file_stamp(path)
+        entry = self._hash_index.get(str(path.resolve()))
+        if entry and entry["stamp"] == stamp:
+            return entry["hash"]
+
+        digest = file_digest(path)
+        entry = {"stamp": stamp, "hash": digest}
+        # 多个工作进程共用同一个索引：加锁后重新读取并合并，再以各自的临时文件替换
+        with file_lock(self._hash_index_path.with_suffix(".lock")):
+            self._hash_index = {
+                **self._read_hash_index(),
+                str(path.resolve()): entry,
+            }
+            tmp_path = self._hash_index_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(self._hash_index), encoding="utf-8")
+            os.replace(tmp_path, self._hash_index_path)
+        return digest
+
+    def _path_for(self, video_path, sample_fps):
+        params = [
+            self.file_hash(video_path),
+            Config.NAME,
+            model_variant(),
+            ",".join(f"{w}x{h}" for w, h in Config.DET_SIZES),
+            f"{Config.DET_ESCALATE_SCORE:g}",
+            f"lag{Config.DET_POLICY_LAG}",
+            f"{float(sample_fps):g}",
+        ]
+        key = hashlib.sha1("|".join(params).encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{key}.ipc"
+
+    def has(self, video_path, sample_fps):
+        return self._path_for(video_path, sample_fps).exists()
+
+    def load(self, video_path, sample_fps):
+        """命中时返回按帧号排序的 [(f_idx, bboxes, det_scores, embeddings)]，否则 None"""
+        path = self._path_for(video_path, sample_fps)
+        if not path.exists():
+            return None
+        # 内存映射读取，长视频的特征矩阵按需分页载入
+        df = pl.read_ipc(path, memory_map=True)
+        if df.height == 0:
+            return []
+        f_idx = df["frame"].to_numpy()
+        bboxes = embeddings_to_numpy(df["bbox"])
+        det_scores = df["det_score"].to_numpy()
+        embs = embeddings_to_numpy(df["embedding"])
+
+        # 按帧号切分成逐帧的结果
+        starts = np.flatnonzero(np.r_[True, f_idx[1:] != f_idx[:-1]])
+        ends = np.r_[starts[1:], len(f_idx)]
+        return [
+            (int(f_idx[s]), bboxes[s:e], det_scores[s:e], embs[s:e])
+            for s, e in zip(starts, ends)
+        ]
+
+    @staticmethod
+    def pack(faces):
+        """一帧的人脸转为缓存所需的紧凑数组 (bboxes, det_scores, embeddings)，均为 float32
+
+        处理过程中只保留这些数组，不持有完整的 Face 对象 (关键点、原始特征等)
+        """
+        return (
+            np.array([f.bbox for f in faces], dtype=np.float32).reshape(-1, 4),
+            np.array([f.det_score for f in faces], dtype=np.float32),
+            np.array([f.normed_embedding for f in faces], dtype=np.float32),
+        )
+
+    def save(self, video_path, sample_fps, frames):
+        """frames: 可迭代的 (f_idx, bboxes, det_scores, embeddings)，见 pack；
+        只记录检测到人脸的帧"""
+        frames = [fr for fr in frames if len(fr[1])]
+        if frames:
+            f_idx = np.concatenate(
+                [np.full(len(b), f, dtype=np.int64) for f, b, _, _ in frames]
+            )
+            bboxes, det_scores, embs = (
+                np.concatenate([fr[k] for fr in frames]) for k in (1, 2, 3)
+            )
+        else:
+            f_idx, det_scores = np.zeros(0, np.int64), np.zeros(0, np.float32)
+            bboxes, embs = np.zeros((0, 4)), np.zeros((0, 512))
+        df = pl.DataFrame(
+            {"frame": f_idx, "det_score": det_scores},
+            schema={"frame": pl.Int64, "det_score": pl.Float32},
+        ).with_columns(
+            embeddings_to_series(bboxes, "bbox"),
+            embeddings_to_series(embs),
+        )
+        path = self._path_for(video_path, sample_fps)
+        tmp_path = path.with_suffix(".tmp")
+        df.write_ipc(tmp_path)
+        os.replace(tmp_path, path)
+
+
+class ImageEmbeddingCache:
+    """注册照片的特征缓存
+
+    先按路径比较大小与修改时间，变化时再比较内容哈希，只有内容真正变化的
+    照片才需要重新检测与提取特征。未检测到人脸的照片同样记录，避免反复重试。
+    """
+
+    def __init__(self, cache_dir=None):
+        cache_dir = Path(cache_dir or Config.CACHE_DIR)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        self.path = cache_dir / f"register_{Config.NAME}.ipc"
+        self.entries = {}  # path -> (stamp, digest, embedding 或 None)
+        if self.path.exists():
+            df = pl.read_ipc(self.path, memory_map=False)
+            embs = embeddings_to_numpy(df["embedding"])
+            for row, emb in zip(df.iter_rows(named=True), embs):
+                self.entries[row["path"]] = (
+                    row["stamp"],
+                    row["digest"],
+                    emb.copy() if row["found"] else None,
+                )
+
+    def lookup(self, img_path):
+        """命中时返回 (True, embedding 或 None)，未命中返回 (False, 内容哈希)"""
+        key = str(Path(img_path).resolve())
+        stamp = file_stamp(img_path)
+        entry = self.entries.get(key)
+        if entry and entry[0] == stamp:
+            return True, entry[2]
+        digest = file_digest(img_path)
+        if entry and entry[1] == digest:
+            self.entries[key] = (stamp, digest, entry[2])
+            return True, entry[2]
+        return False, digest
+
+    def put(self, img_path, digest, embedding):
+        key = str(Path(img_path).resolve())
+        self.entries[key] = (file_stamp(img_path), digest, embedding)
+
+    def save(self, dim=512):
+        keys = list(self.entries)
+        values = [self.entries[k] for k in keys]
+        df = pl.DataFrame(
+            {
+                "path": keys,
+                "stamp": [v[0] for v in values],
+                "digest": [v[1] for v in values],
+                "found": [v[2] is not None for v in values],
+            },
+            schema={
+                "path": pl.String,
+                "stamp": pl.String,
+                "digest": pl.String,
+                "found": pl.Boolean,
+            },
+        ).with_columns(
+            embeddings_to_series(
+                np.array(
+                    [np.zeros(dim) if v[2] is None else v[2] for v in values]
+                ).reshape(-1, dim)
+            )
+        )
+        tmp_path = self.path.with_suffix(".tmp")
+        df.write_ipc(tmp_path)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,311 @@
+import os
+import heapq
+import cv2
+import numpy as np
+import polars as pl
+from pathlib import Path
+from .config import Config
+from .database import embeddings_to_numpy, embeddings_to_series
+from .index import FlatIndex, IVFIndex
+
+
+class CaptureStore:
+    """人脸抓拍的落盘存储
+
+    裁剪图抓到即写成 jpg，内存中只保留当前视频的特征与质量分，
+    每个视频结束后写成一个 IPC 分片，聚类时再以内存映射方式读回。
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.count = 0
+        self._parts = sorted(self.root.glob("part_*.ipc"))
+        self._paths, self._quality, self._embs = [], [], []
+
+    def add(self, name, crop, emb, quality):
+        """保存一张裁剪图，name 为不含扩展名的相对路径"""
+        path = self.root / f"{name}.jpg"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(path), crop)
+        self._paths.append(str(path))
+        self._quality.append(float(quality))
+        self._embs.append(np.asarray(emb, dtype=np.float32))
+        self.count += 1
+
+    def flush(self):
+        """把缓冲的特征写成一个分片"""
+        if not self._paths:
+            return
+        df = pl.DataFrame(
+            {"path": self._paths, "quality": self._quality},
+            schema={"path": pl.String, "quality": pl.Float32},
+        ).with_columns(embeddings_to_series(np.stack(self._embs)))
+        part = self.root / f"part_{len(self._parts):05d}.ipc"
+        tmp_path = part.with_suffix(".tmp")
+        df.write_ipc(tmp_path)
+        os.replace(tmp_path, part)
+        self._parts.append(part)
+        self._paths, self._quality, self._embs = [], [], []
+
+    def load(self):
+        """返回 (路径列表, 质量分, (N, D) 特征矩阵)"""
+        self.flush()
+        if not self._parts:
+            return [], np.zeros(0, dtype=np.float32), np.zeros((0, 0), np.float32)
+        df = pl.concat([pl.read_ipc(p, memory_map=True) for p in self._parts])
+        return (
+            df["path"].to_list(),
+            df["quality"].to_numpy(),
+            embeddings_to_numpy(df["embedding"]),
+        )
+
+
+def knn_graph(embeddings, k, chunk=4096):
+    """每个样本的 k 近邻 (含自身)，规模较大时用倒排近似检索"""
+    if len(embeddings) >= Config.IVF_MIN_SIZE:
+        index = IVFIndex(embeddings).build()
+    else:
+        index = FlatIndex(embeddings)
+    results = [
+        index.search(embeddings[i : i + chunk], k)
+        for i in range(0, len(embeddings), chunk)
+    ]
+    return (
+        np.concatenate([r[0] for r in results]),
+        np.concatenate([r[1] for r in results]),
+    )
+
+
+def connected_labels(n, src, dst):
+    """无向图 (src[i], dst[i]) 的连通分量，返回每个节点所属分量的最小节点号"""
+    labels = np.arange(n)
+    while True:
+        prev = labels
+        m = np.minimum(labels[src], labels[dst])
+        labels = labels.copy()
+        np.minimum.at(labels, src, m)
+        np.minimum.at(labels, dst, m)
+        # 指针跳跃，压缩传播链
+        while not np.array_equal(labels, labels[labels]):
+            labels = labels[labels]
+        if np.array_equal(labels, prev):
+            return labels
+
+
+def graph_cluster(embeddings, eps, min_samples, k=16):
+    """基于 k 近邻图的 DBSCAN 式聚类 (余弦距离)
+
+    只在每个样本的 k 个近邻内判断密度：近邻中距离不超过 eps 的样本数
+    (含自身) 达到 min_samples 的为核心点，相连的核心点合为一类，
+    非核心点归入距离最近的核心点所在的类，其余为噪声 (-1)。
+    时间与内存随样本数线性增长，不需要 N×N 的距离矩阵。
+    """
+    n = len(embeddings)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    nbrs, sims = knn_graph(embeddings, min(k, n))
+    close = sims >= 1 - eps
+    core = close.sum(axis=1) >= min_samples
+
+    rows = np.repeat(np.arange(n), nbrs.shape[1])
+    cols = nbrs.ravel()
+    edge = close.ravel() & core[rows] & core[cols]
+    roots = connected_labels(n, rows[edge], cols[edge])
+
+    # 近邻按相似度降序排列，第一个邻近的核心点即最近的核心点
+    border_hit = close & core[nbrs]
+    first = np.argmax(border_hit, axis=1)
+    has_core = border_hit[np.arange(n), first]
+    owner = np.where(core, np.arange(n), nbrs[np.arange(n), first])
+    roots = np.where(core | has_core, roots[owner], -1)
+
+    labels = np.full(n, -1, dtype=np.int64)
+    valid = roots >= 0
+    labels[valid] = np.unique(roots[valid], return_inverse=True)[1]
+    return labels
+
+
+class OnlineCluster:
+    """在线聚类中的一个候选身份"""
+
+    def __init__(self, uid, emb, seq):
+        self.uid = uid
+        self.centroid = emb.astype(np.float32)
+        self.count = 0
+        self.last_seen = seq
+        self.best = []  # 小顶堆 [(质量, 序号, 特征, 裁剪图)]，只保留 top_k 张
+        self.reservoir = []  # 蓄水池抽样的特征，拆分时使用
+
+    @property
+    def crops(self):
+        """按质量降序的 [(质量, 裁剪图)]"""
+        return [(q, crop) for q, _, _, crop in sorted(self.best, reverse=True)]
+
+
+class OnlineClusterer:
+    """边抓拍边聚类：每张人脸就近归入已有中心或新开一类
+
+    中心按动量更新 (与底库的特征进化相同，样本较少时按均值更新)，
+    定期合并过近的中心、拆分过散的类、清理长期只出现过几次的噪声类。
+    每类只在内存中保留质量最高的 top_k 张裁剪图和少量抽样特征，
+    内存占用与输入的视频总长无关。
+    """
+
+    def __init__(
+        self, eps=0.4, min_samples=3, top_k=5, reservoir=32, stale=5000, seed=0
+    ):
+        self.threshold = 1 - eps
+        self.min_samples = min_samples
+        self.top_k = top_k
+        self.reservoir = reservoir
+        self.stale = stale  # 噪声类超过多少张抓拍未再出现即清理
+        self.clusters = []
+        self.seq = 0  # 已加入的抓拍数
+        self.last_new = 0  # 最近一次出现新成熟类时的序号
+        self._next_uid = 0
+        self._centroids = None
+        self._rng = np.random.default_rng(seed)
+
+    def _open(self, emb):
+        cluster = OnlineCluster(self._next_uid, emb, self.seq)
+        self._next_uid += 1
+        self.clusters.append(cluster)
+        row = cluster.centroid[None, :]
+        self._centroids = (
+            row if self._centroids is None else np.vstack([self._centroids, row])
+        )
+        return len(self.clusters) - 1
+
+    def _sync(self):
+        self._centroids = (
+            np.stack([c.centroid for c in self.clusters]) if self.clusters else None
+        )
+
+    def add(self, emb, quality, crop):
+        """加入一张抓拍，返回所属类的 uid"""
+        emb = np.asarray(emb, dtype=np.float32)
+        self.seq += 1
+        i = None
+        if self._centroids is not None:
+            sims = self._centroids @ emb
+            best = int(np.argmax(sims))
+            if sims[best] >= self.threshold:
+                i = best
+        if i is None:
+            i = self._open(emb)
+
+        cluster = self.clusters[i]
+        cluster.count += 1
+        cluster.last_seen = self.seq
+        if cluster.count > 1:
+            # 动量更新；样本较少时动量取 1/count，相当于求均值
+            m = max(Config.EVOLUTION_MOMENTUM, 1 / cluster.count)
+            new = (1 - m) * cluster.centroid + m * emb
+            cluster.centroid = new / np.linalg.norm(new)
+            self._centroids[i] = cluster.centroid
+        if cluster.count == self.min_samples:
+            self.last_new = self.seq
+
+        if len(cluster.reservoir) < self.reservoir:
+            cluster.reservoir.append(emb)
+        else:
+            j = self._rng.integers(cluster.count)
+            if j < self.reservoir:
+                cluster.reservoir[j] = emb
+
+        item = (float(quality), self.seq, emb, crop)
+        if len(cluster.best) < self.top_k:
+            heapq.heappush(cluster.best, item)
+        elif item[0] > cluster.best[0][0]:
+            heapq.heapreplace(cluster.best, item)
+        return cluster.uid
+
+    def maintain(self):
+        """拆分 -> 合并 -> 清理噪声类"""
+        for cluster in list(self.clusters):
+            self._split(cluster)
+        self._merge()
+        self.clusters = [
+            c
+            for c in self.clusters
+            if c.count >= self.min_samples or self.seq - c.last_seen < self.stale
+        ]
+        self._sync()
+
+    def _split(self, cluster):
+        """抽样特征的球面 2-means；两半的中心足够远且都有足够样本时拆成两类"""
+        samples = np.stack(cluster.reservoir) if cluster.reservoir else None
+        if samples is None or len(samples) < 2 * self.min_samples:
+            return
+        sims = samples @ samples.T
+        a, b = np.unravel_index(np.argmin(sims), sims.shape)
+        centers = samples[[a, b]]
+        for _ in range(5):
+            assign = np.argmax(samples @ centers.T, axis=1)
+            if assign.min() == assign.max():
+                return
+            centers = np.stack([samples[assign == k].mean(axis=0) for k in (0, 1)])
+            centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+        sizes = np.bincount(assign, minlength=2)
+        if sizes.min() < self.min_samples or centers[0] @ centers[1] >= self.threshold:
+            return
+
+        other = OnlineCluster(self._next_uid, centers[1], cluster.last_seen)
+        self._next_uid += 1
+        share = sizes[1] / sizes.sum()
+        other.count = max(1, int(round(cluster.count * share)))
+        cluster.count = max(1, cluster.count - other.count)
+        cluster.centroid = centers[0]
+        cluster.reservoir = [s for s, k in zip(samples, assign) if k == 0]
+        other.reservoir = [s for s, k in zip(samples, assign) if k == 1]
+        best = cluster.best
+        cluster.best = [it for it in best if it[2] @ centers[0] >= it[2] @ centers[1]]
+        other.best = [it for it in best if it[2] @ centers[0] < it[2] @ centers[1]]
+        heapq.heapify(cluster.best)
+        heapq.heapify(other.best)
+        self.clusters.append(other)
+
+    def _merge(self):
+        """中心相似度达到归类阈值的类合并，保留样本最多的一类的 uid"""
+        if len(self.clusters) < 2:
+            return
+        centroids = np.stack([c.centroid for c in self.clusters])
+        sims = centroids @ centroids.T
+        src, dst = np.nonzero(np.triu(sims >= self.threshold, k=1))
+        if len(src) == 0:
+            return
+        labels = connected_labels(len(self.clusters), src, dst)
+
+        merged = []
+        for root in np.unique(labels):
+            group = [self.clusters[i] for i in np.flatnonzero(labels == root)]
+            if len(group) == 1:
+                merged.append(group[0])
+                continue
+            keep = max(group, key=lambda c: c.count)
+            weights = np.array([c.count for c in group], dtype=np.float32)
+            center = weights @ np.stack([c.centroid for c in group])
+            keep.centroid = center / np.linalg.norm(center)
+            keep.count = int(weights.sum())
+            keep.last_seen = max(c.last_seen for c in group)
+            keep.best = heapq.nlargest(self.top_k, [it for c in group for it in c.best])
+            heapq.heapify(keep.best)
+            pool = [s for c in group for s in c.reservoir]
+            picks = self._rng.permutation(len(pool))[: self.reservoir]
+            keep.reservoir = [pool[j] for j in picks]
+            merged.append(keep)
+        self.clusters = merged
+
+    def mature(self):
+        """样本数达到 min_samples 的类"""
+        return [c for c in self.clusters if c.count >= self.min_samples]
+
+    def settled(self, patience):
+        """每个成熟类都已攒满 top_k 张，且最近 patience 张抓拍没有出现新的成熟类"""
+        mature = self.mature()
+        return (
+            bool(mature)
+            and all(len(c.best) >= self.top_k for c in mature)
+            and self.seq - self.last_new >= patience
+        )
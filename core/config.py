@@ -1,18 +1,111 @@
-import onnxruntime as ort
-
-
 class Config:
     NAME = "buffalo_l"
-    DET_SIZE = (640, 640)
+    # 检测分辨率阶梯：每个视频源从最小一档开始，找不到可靠人脸时逐档放大
+    DET_SIZES = [(320, 320), (640, 640), (1280, 1280)]
+    # 最高检测分低于该值时视为低置信度，放大一档重试
+    DET_ESCALATE_SCORE = 0.6
+    # 每隔多少帧试探一次小一档的分辨率，场景变化后可以降回来
+    DET_PROBE_INTERVAL = 30
+    # 连续多少帧所有档位都没有人脸后，空帧不再逐档放大 (试探帧除外)
+    DET_EMPTY_PATIENCE = 3
+    # 只加载考勤需要的子模型
+    MODULES = ["detection", "recognition"]
+    # 识别模型单次推理的最大人脸数
+    REC_BATCH_SIZE = 32
     # 识别阈值，建议 0.42-0.45
     SIMILARITY_THRESHOLD = 0.42
+    # 最佳与次佳匹配的最小分差，0 表示不启用
+    MATCH_MARGIN = 0.0
+    # 底库索引: "flat" 精确检索 / "ivf" 近似检索 / "auto" 按底库规模选择
+    INDEX_TYPE = "auto"
+    # auto 模式下启用近似检索的底库规模 (参考 bench_index.py 的结果)
+    IVF_MIN_SIZE = 20000
+    # 倒排桶数量，0 表示取 sqrt(N)
+    IVF_NLIST = 0
+    # 每次检索扫描的桶数，越大召回越高、速度越慢
+    IVF_NPROBE = 8
     # 特征进化动量因子
     EVOLUTION_MOMENTUM = 0.05
+    # 特征进化增量日志超过该大小 (字节) 时，保存时在后台并入底库文件
+    LOG_COMPACT_BYTES = 4 << 20
     # 高质量人脸判断标准
     QUALITY_SCORE_THRES = 0.65
+    # 视频采样率 (帧/秒)：考勤批处理 / 人脸抓取
+    BATCH_SAMPLE_FPS = 2
+    CROP_SAMPLE_FPS = 5
+    # 采样间隔 (帧) 超过该值时改用 seek 跳转，而不是逐帧 grab
+    SEEK_MIN_STEP = 150
+    # 人脸跟踪：IoU 关联阈值 / 连续丢失多少帧后结束轨迹
+    TRACK_IOU_THRES = 0.3
+    TRACK_MAX_MISSES = 5
+    # 轨迹强制重新识别的间隔 (帧) / 触发重新识别的质量提升比例
+    TRACK_REFRESH = 30
+    TRACK_QUALITY_GAIN = 0.2
+    # 运动门控 (--gate)：帧差使用的缩略图宽度 / 灰度变化超过该值的像素视为变化 /
+    # ROI 内变化像素比例超过该值时才重新检测，否则沿用上一帧的结果
+    GATE_WIDTH = 160
+    GATE_PIXEL_DIFF = 25
+    GATE_MOTION_RATIO = 0.002
+    # 画面静止时仍强制检测的间隔 (帧)：从最小值起逐次翻倍到最大值，画面变化后恢复
+    GATE_MIN_INTERVAL = 2
+    GATE_MAX_INTERVAL = 16
+    # 座位区域 ROI：归一化坐标的多边形列表，如 [[(0, 0.3), (1, 0.3), (1, 1), (0, 1)]]；
+    # 为空表示整幅画面。帧差只统计 ROI 内的像素，检测只在其外接矩形内进行
+    GATE_ROI = []
+    # 多路实时考勤默认共享的推理会话数
+    STREAM_POOL_SIZE = 2
+    # 考勤事件日志目录 / 每个分片的最大行数 / 缓冲事件最长多久写一次盘 (秒) /
+    # 每个进程积累多少个分片后合并为一个文件
+    EVENTS_DIR = "attendance_events"
+    EVENT_BATCH_ROWS = 4096
+    EVENT_FLUSH_SECONDS = 5
+    EVENT_COMPACT_SHARDS = 32
+    # ONNX Runtime 图优化级别 / 是否缓存优化后的模型 (缓存在 CACHE_DIR/ort，加快再次启动)
+    ORT_OPT_LEVEL = "ORT_ENABLE_ALL"
+    ORT_OPT_CACHE = True
+    # CPU 推理：每个会话的算子内 / 算子间线程数，0 表示由 ONNX Runtime 决定；
+    # 多个会话并行 (PIPELINE_WORKERS、STREAM_POOL_SIZE) 时建议算子内线程取 CPU 核数 / 会话数
+    INTRA_OP_THREADS = 0
+    INTER_OP_THREADS = 0
+    # 线程空闲时是否自旋等待：会话数多于核数时关闭可减少 CPU 争用
+    ORT_ALLOW_SPINNING = True
+    # 仅 CPU 推理时使用 quantize.py 生成的 INT8 检测/识别模型 (存放于 INT8_DIR/NAME)
+    USE_INT8 = False
+    INT8_DIR = "models_int8"
+    # INT8 与浮点特征的相似度漂移 (1 - 余弦相似度) 的 95 分位上限，超过时 quantize.py 报告不通过
+    INT8_MAX_DRIFT = 0.03
+    # INT8 与浮点检测框在每一档检测分辨率上的最低配对比例 / 配对框的最低平均 IoU
+    INT8_MIN_DET_AGREEMENT = 0.95
+    INT8_MIN_DET_IOU = 0.85
+    # 是否记录各阶段耗时与计数 (见 core/metrics.py) / 指标快照的导出间隔 (秒)
+    METRICS_ENABLED = True
+    METRICS_INTERVAL = 10
+    # 推理结果等缓存的存放目录
+    CACHE_DIR = ".cache"
+    # 批处理流水线的推理线程数 (每个线程一套 ONNX 会话) 与队列长度
+    PIPELINE_WORKERS = 2
+    PIPELINE_QUEUE_SIZE = 8
+    # 流水线中检测分辨率策略按帧序生效的延迟 (帧)：第 n 帧的档位取决于第 n-LAG 帧
+    # 之前的结果，与推理线程数无关；推理线程数超过该值时线程之间会相互等待
+    DET_POLICY_LAG = 8
+    # 独立采集进程 (--capture-process) 经共享内存传帧时：
+    # 视频文件的解码最多领先推理的帧数 / 每路实时源的帧槽位数 (满时丢弃最旧的帧)
+    SHM_PREFETCH = 4
+    SHM_LIVE_SLOTS = 4
+    # 本机识别服务 (serve.py) 的地址，"unix:/path" 为 Unix 套接字；
+    # 服务端推理会话数 / 合批最长等待 (毫秒) / 自动保存底库的间隔 (秒)
+    SERVICE_ADDRESS = "127.0.0.1:8765"
+    SERVICE_WORKERS = 2
+    SERVICE_MAX_WAIT_MS = 5
+    SERVICE_SAVE_INTERVAL = 60
+    # 注册时并行检测照片的线程数
+    REGISTER_WORKERS = 4
 
     @staticmethod
     def get_providers():
+        # 延迟导入：只读底库、生成报表等不需要推理的场景不加载 onnxruntime
+        import onnxruntime as ort
+
         available = ort.get_available_providers()
         priority = [
             "CUDAExecutionProvider",
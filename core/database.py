@@ -1,5 +1,119 @@
+import os
+import threading
 import polars as pl
 import numpy as np
+from pathlib import Path
+from .index import open_index
+
+
+def embeddings_to_numpy(series):
+    """将 embedding 列转换为 (N, D) float32 矩阵
+
+    定长 Array(Float32) 列直接返回内存映射数据的只读视图，不发生复制；
+    旧版的 List 列会被转换一次，下次保存后即变为定长格式。
+    """
+    if isinstance(series.dtype, pl.List):
+        series = series.list.to_array(series.list.len().max() or 0)
+    if series.dtype.inner != pl.Float32:
+        series = series.cast(pl.Array(pl.Float32, series.dtype.size))
+    return series.to_numpy()
+
+
+def embeddings_to_series(embeddings, name="embedding"):
+    """将 (N, D) 矩阵整体写成定长 Array(Float32) 列，避免逐行 tolist()"""
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    return pl.Series(name, embeddings, dtype=pl.Array(pl.Float32, embeddings.shape[1]))
+
+
+def log_path_for(db_path):
+    """增量日志与底库放在一起: student_db.ipc -> student_db.wal"""
+    return Path(db_path).with_suffix(".wal")
+
+
+class DeltaLog:
+    """底库特征的追加式增量日志
+
+    每条记录是一批被修改行的最新特征 (学号数组 + 特征矩阵，依次用 np.save 写入)，
+    重放时后写的覆盖先写的，重复重放结果不变；进程崩溃时最多丢失最后一条未写完的记录，
+    本进程第一次追加前会截掉这条残缺的记录 (见 repair)，之后追加的记录仍能被重放。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._f = None
+        self._lock = threading.Lock()
+        # 最近一次 replay() 读到的最后一条完整记录的结束位置 (字节)
+        self.end = 0
+
+    def append(self, ids, embeddings):
+        with self._lock:
+            if self._f is None:
+                self._repair()
+                self._f = open(self.path, "ab")
+            np.save(self._f, np.asarray(ids, dtype=str))
+            np.save(self._f, np.ascontiguousarray(embeddings, dtype=np.float32))
+            # 写入操作系统缓冲，进程崩溃也不会丢失；断电保护由 sync() 负责
+            self._f.flush()
+
+    def sync(self):
+        with self._lock:
+            if self._f is not None:
+                os.fsync(self._f.fileno())
+
+    def size(self):
+        return self.path.stat().st_size if self.path.exists() else 0
+
+    def replay(self):
+        """按写入顺序产出 (ids, embeddings)，遇到不完整的尾部记录时停止
+
+        读完后 self.end 为最后一条完整记录的结束位置
+        """
+        self.end = 0
+        if not self.path.exists():
+            return
+        with open(self.path, "rb") as f:
+            while True:
+                try:
+                    ids = np.load(f)
+                    embeddings = np.load(f)
+                except (EOFError, ValueError, OSError):
+                    return
+                self.end = f.tell()
+                yield ids, embeddings
+
+    def repair(self):
+        """截掉崩溃时写了一半的尾部记录，否则追加在其后的记录永远无法被重放"""
+        with self._lock:
+            self._repair()
+
+    def _repair(self):
+        # 重新扫描而不是沿用加载时的位置：其间其他进程可能追加了完整的记录
+        for _ in self.replay():
+            pass
+        if self.end < self.size():
+            os.truncate(self.path, self.end)
+
+    def truncate(self, offset=None):
+        """丢弃前 offset 字节 (已并入底库的记录)，保留之后追加的部分；None 表示清空"""
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+            size = self.size()
+            if offset is None or offset >= size:
+                self.path.unlink(missing_ok=True)
+                return
+            if offset == 0:
+                return
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                tail = f.read()
+            tmp_path = self.path.with_suffix(".wal.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
 
 
 class FaceDatabase:
@@ -8,14 +122,42 @@ class FaceDatabase:
         self.df = None
         self.embeddings = None
         self.names = None
+        self.ids = None
+        self.index = None
+        self.log = DeltaLog(log_path_for(db_path))
 
     def load(self):
-        self.df = pl.read_ipc(self.db_path)
-        # 将 Polars 列转换为 Numpy 矩阵，方便后续矩阵乘法
-        self.embeddings = np.array(self.df["embedding"].to_list())
+        # 未压缩的 IPC 文件可直接内存映射，embedding 矩阵与文件共享内存
+        self.df = pl.read_ipc(self.db_path, memory_map=True)
+        self.embeddings = embeddings_to_numpy(self.df["embedding"])
         self.names = self.df["name"].to_list()
+        self.ids = self.df["id"].to_list()
+        self._replay_log()
+        self.index = open_index(self.db_path, self.embeddings, self.ids)
         return self
 
-    def save(self, data):
-        df = pl.DataFrame(data)
-        df.write_ipc(self.db_path)
+    def _replay_log(self):
+        """把尚未并入底库文件的特征进化重放到内存中的特征矩阵"""
+        records = list(self.log.replay())
+        if not records:
+            return
+        row_of = {sid: i for i, sid in enumerate(self.ids)}
+        self.embeddings = self.embeddings.copy()
+        for ids, embeddings in records:
+            rows = np.array([row_of.get(sid, -1) for sid in ids.tolist()], dtype=int)
+            known = rows >= 0
+            self.embeddings[rows[known]] = embeddings[known]
+
+    def save(self, data, log_offset=None):
+        """data: {"id": [...], "name": [...], "embedding": (N, D) 矩阵}
+
+        log_offset: 本次快照已包含的增量日志长度，默认整个日志都已包含
+        """
+        df = pl.DataFrame({"id": data["id"], "name": data["name"]}).with_columns(
+            embeddings_to_series(data["embedding"])
+        )
+        # 先写临时文件再替换，避免破坏其他进程正在映射的旧文件
+        tmp_path = Path(self.db_path).with_suffix(".tmp")
+        df.write_ipc(tmp_path)
+        os.replace(tmp_path, self.db_path)
+        self.log.truncate(log_offset)
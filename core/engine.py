@@ -1,31 +1,65 @@
-import os
-import sys
+import threading
 import numpy as np
 import polars as pl
 from pathlib import Path
-from core.processor import FaceProcessor
 from core.config import Config
+from core.database import FaceDatabase
+from core.metrics import metrics, timed
 
 
 class AttendanceEngine:
-    def __init__(self, db_path="student_db.ipc"):
+    def __init__(self, db_path="student_db.ipc", load_processor=False):
         self.db_path = Path(db_path)
         if not self.db_path.exists():
             raise FileNotFoundError(f"Database {db_path} not found.")
 
-        self.db = pl.read_ipc(self.db_path)
-        self.db_embeddings = np.array(self.db["embedding"].to_list(), dtype=np.float32)
-        self.ids = self.db["id"].to_list()
-        self.names = self.db["name"].to_list()
+        self.store = FaceDatabase(self.db_path).load()
+        self.db = self.store.df
+        # 只读的内存映射视图，首次特征进化时才复制 (见 _ensure_writable)
+        self.db_embeddings = self.store.embeddings
+        self.ids = self.store.ids
+        self.names = self.store.names
+        self.index = self.store.index
+        self.row_of = {sid: i for i, sid in enumerate(self.ids)}
+        # 保护特征矩阵的读写与日志追加，使压缩时拿到的快照与日志位置一致
+        self._lock = threading.Lock()
+        self._compactor = None
 
-        # 静默加载视觉模型
-        original_stdout = sys.stdout
-        sys.stdout = open(os.devnull, "w")
-        try:
-            self.processor = FaceProcessor()
-        finally:
-            sys.stdout.close()
-            sys.stdout = original_stdout
+        # 视觉模型在第一次用到时才加载，同步姓名、生成报表等不需要推理
+        self._processor = None
+        self._processor_lock = threading.Lock()
+        if load_processor:
+            self.ensure_processor()
+
+    @staticmethod
+    def _load_processor():
+        # 延迟导入 insightface/onnxruntime，并静默加载视觉模型
+        from core.processor import FaceProcessor
+        from core.utils import silence_stdout
+
+        with silence_stdout():
+            return FaceProcessor()
+
+    @property
+    def processor(self):
+        return self.ensure_processor()
+
+    @processor.setter
+    def processor(self, value):
+        self._processor = value
+
+    def ensure_processor(self):
+        """按需加载视觉模型"""
+        with self._processor_lock:
+            if self._processor is None:
+                self._processor = self._load_processor()
+        return self._processor
+
+    def processor_pool(self, size):
+        """返回 size 个相互独立的 FaceProcessor，供多线程推理使用 (首个复用 self.processor)"""
+        return [self.ensure_processor()] + [
+            self._load_processor() for _ in range(size - 1)
+        ]
 
     def sync_names(self):
         """强制从 faces/ 目录同步最新的 Name"""
@@ -44,26 +78,115 @@ class AttendanceEngine:
             self.names = self.db["name"].to_list()
 
     def identify_face(self, face_embedding):
-        sims = np.dot(self.db_embeddings, face_embedding)
-        max_idx = np.argmax(sims)
-        if sims[max_idx] > Config.SIMILARITY_THRESHOLD:
-            return self.ids[max_idx], sims[max_idx]
+        ids, scores = self.identify_faces(np.asarray(face_embedding)[None, :])
+        if ids[0]:
+            return ids[0], scores[0]
         return None, 0
 
+    def top_k(self, embeddings, k=1):
+        """返回每张脸在底库中的 top-k (行号, 分数)，由索引层完成检索"""
+        return self.index.search(embeddings, k)
+
+    @timed("identify")
+    def identify_faces(self, embeddings, margin=None):
+        """批量识别一帧(或多帧)中的所有人脸
+
+        embeddings: (M, D) 的归一化特征矩阵
+        margin: 最佳与次佳匹配的最小分差，不足则视为无法确定
+        返回 (ids, scores)，未识别的人脸 id 为 None、分数为 0
+        """
+        margin = Config.MATCH_MARGIN if margin is None else margin
+        # 与特征进化的写入互斥，多路/多线程同时识别时不会读到只更新了一半的底库
+        with self._lock:
+            idx, sims = self.top_k(embeddings, k=2 if margin else 1)
+        if idx.shape[1] == 0:
+            metrics.inc("unknowns", len(idx))
+            return [None] * len(idx), np.zeros(len(idx), dtype=np.float32)
+
+        best = sims[:, 0]
+        accepted = best > Config.SIMILARITY_THRESHOLD
+        if margin and idx.shape[1] > 1:
+            accepted &= (best - sims[:, 1]) >= margin
+
+        ids = [self.ids[i] if ok else None for i, ok in zip(idx[:, 0], accepted)]
+        n_matched = int(accepted.sum())
+        metrics.inc("matches", n_matched)
+        metrics.inc("unknowns", len(ids) - n_matched)
+        return ids, np.where(accepted, best, 0).astype(np.float32)
+
+    def _ensure_writable(self):
+        """内存映射的底库矩阵是只读的，需要修改时才复制一份到内存"""
+        if not self.db_embeddings.flags.writeable:
+            self.db_embeddings = self.db_embeddings.copy()
+            self.index.embeddings = self.db_embeddings
+
     def update_student_feature(self, stu_id, new_embedding):
-        if stu_id in self.ids:
-            idx = self.ids.index(stu_id)
-            old_emb = self.db_embeddings[idx]
-            m = Config.EVOLUTION_MOMENTUM
-            updated = (old_emb * (1 - m)) + (new_embedding * m)
-            self.db_embeddings[idx] = updated / np.linalg.norm(updated)
+        self.update_student_features([(stu_id, new_embedding)])
+
+    @timed("evolve")
+    def update_student_features(self, updates):
+        """批量特征进化，updates 为 [(学号, 特征)]，结果与按顺序逐条更新相同
+
+        每轮用一次向量化的散射写回所有行；同一学生在一批中出现多次时分轮应用，
+        保持逐条动量更新的语义。被修改的行随后作为一条记录追加到增量日志。
+        """
+        rounds = []  # 第 r 轮为每个学生的第 r 次更新: (行号列表, 特征列表)
+        seen = {}
+        for stu_id, emb in updates:
+            row = self.row_of.get(stu_id)
+            if row is None:
+                continue
+            r = seen.get(row, 0)
+            seen[row] = r + 1
+            if r == len(rounds):
+                rounds.append(([], []))
+            rounds[r][0].append(row)
+            rounds[r][1].append(emb)
+        if not rounds:
+            return
 
+        m = Config.EVOLUTION_MOMENTUM
+        with self._lock:
+            self._ensure_writable()
+            for rows, embs in rounds:
+                rows = np.array(rows)
+                updated = self.db_embeddings[rows] * (1 - m) + np.asarray(embs) * m
+                self.db_embeddings[rows] = updated / np.linalg.norm(
+                    updated, axis=1, keepdims=True
+                )
+            changed = np.array(sorted(seen))
+            self.store.log.append(
+                [self.ids[i] for i in changed], self.db_embeddings[changed]
+            )
+
+    @timed("save_db")
     def save_db(self):
-        updated_list = [emb.tolist() for emb in self.db_embeddings]
-        self.db = self.db.with_columns(
-            [pl.Series(name="embedding", values=updated_list).cast(pl.List(pl.Float32))]
+        """保存特征进化：增量日志刷到磁盘，开销只与修改过的行数有关
+
+        日志超过 LOG_COMPACT_BYTES 时在后台线程把全部特征并入底库文件。
+        """
+        self.store.log.sync()
+        if self.store.log.size() >= Config.LOG_COMPACT_BYTES:
+            self.compact(wait=False)
+
+    def compact(self, wait=True):
+        """把当前特征与姓名写回底库文件，并截断已并入的日志"""
+        if self._compactor is not None and self._compactor.is_alive():
+            if not wait:
+                return
+            self._compactor.join()
+        with self._lock:
+            data = {
+                "id": list(self.ids),
+                "name": list(self.names),
+                "embedding": self.db_embeddings.copy(),
+            }
+            offset = self.store.log.size()
+
+        # 非守护线程：进程退出前会等待压缩完成
+        self._compactor = threading.Thread(
+            target=self.store.save, args=(data,), kwargs={"log_offset": offset}
         )
-        tmp_path = self.db_path.with_suffix(".tmp")
-        self.db.write_ipc(tmp_path)
-        if tmp_path.exists():
-            os.replace(tmp_path, self.db_path)
+        self._compactor.start()
+        if wait:
+            self._compactor.join()
@@ -0,0 +1,320 @@
+import os
+import re
+import time
+import threading
+import numpy as np
+import polars as pl
+from datetime import datetime
+from pathlib import Path
+from .config import Config
+from .database import embeddings_to_series
+
+SCHEMA = {
+    "ts": pl.Datetime("ms"),
+    "run": pl.String,
+    "source": pl.String,
+    "frame": pl.Int64,
+    "student_id": pl.String,
+    "score": pl.Float32,
+    "count": pl.Int32,
+}
+
+# 旧版 CSV 报表导入的事件所属的运行编号，排在任何真实运行之前
+LEGACY_RUN = "00000000_000000_legacy"
+# 视频源起始标记与完成标记的帧号 (学号为空、计数为 0 的行)
+SOURCE_START = -1
+SOURCE_DONE = -2
+# 分片文件名末尾的序号："前缀_00012" 为一次写盘，"前缀_00000-00031" 为合并了该区间的分片
+_SHARD = re.compile(r"(.+)_(\d+)(?:-(\d+))?")
+
+
+def _shard_range(path):
+    """分片文件名解析为 (前缀, 起始序号, 结束序号)，不是分片 (如旧报表导入) 时返回 None"""
+    m = _SHARD.fullmatch(path.stem)
+    if m is None:
+        return None
+    start = int(m.group(2))
+    return m.group(1), start, int(m.group(3) or start)
+
+
+def live_shards(root):
+    """目录中有效的事件文件：已被合并文件覆盖的分片 (合并后尚未删除) 不计入"""
+    paths = sorted(Path(root).glob("*.parquet"))
+    ranges = {p: _shard_range(p) for p in paths}
+    covered = set()
+    for p, r in ranges.items():
+        if r is None or r[1] == r[2]:
+            continue
+        for q, o in ranges.items():
+            if q != p and o is not None and o[0] == r[0]:
+                if r[1] <= o[1] and o[2] <= r[2] and (o[1], o[2]) != (r[1], r[2]):
+                    covered.add(q)
+    return [p for p in paths if p not in covered]
+
+
+def new_run_id():
+    """运行编号：按时间排序，同一视频源取编号最大的一次运行作为最新结果
+
+    时间精确到微秒，进程号补零到固定宽度，同一秒内启动的多次运行也按字符串正确排序
+    """
+    return f"{datetime.now():%Y%m%d_%H%M%S_%f}_{os.getpid():07d}"
+
+
+class EventLog:
+    """考勤事件的追加式日志
+
+    每次识别命中记为一个事件 (时间、运行编号、视频源、帧号、学号、分数、人脸框、计数)，
+    缓冲到 EVENT_BATCH_ROWS 行或 EVENT_FLUSH_SECONDS 秒后写成一个 Parquet 分片；
+    分片只增不改，多个进程可以同时写入同一目录。每个进程的小分片积累到
+    EVENT_COMPACT_SHARDS 个时合并为一个文件，运行结束时 (close) 全部合并为一个，
+    长时间运行也不会让报表查询打开成千上万个文件。
+    """
+
+    def __init__(self, root=None, run_id=None):
+        self.root = Path(root or Config.EVENTS_DIR)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.run_id = run_id or new_run_id()
+        # 运行编号已含创建它的进程号；沿用他人编号的进程 (多进程批处理) 再加上自己的进程号
+        self._prefix = self.run_id if run_id is None else f"{run_id}_{os.getpid()}"
+        self._rows = []
+        self._bboxes = []
+        self._seq = 0
+        self._last_flush = time.time()
+        self._lock = threading.Lock()
+
+    def source(self, name):
+        """开始记录一个视频源：写入一条无学号的起始标记，
+        使本次运行即使没有任何命中也会覆盖该视频源以前的结果"""
+        with self._lock:
+            self._marker(name, SOURCE_START)
+        return SourceEvents(self, name)
+
+    def _marker(self, name, frame):
+        self._rows.append((datetime.now(), self.run_id, name, frame, None, None, 0))
+        self._bboxes.append(np.zeros(4, dtype=np.float32))
+
+    def done(self, name):
+        """视频源处理完成：写入完成标记，报表只采用完整处理过的运行"""
+        with self._lock:
+            self._marker(name, SOURCE_DONE)
+
+    def record(self, source, frame, sids, scores, bboxes, counts=None):
+        """记录一帧中识别出身份的人脸，sid 为 None 的人脸被忽略"""
+        now = datetime.now()
+        counts = counts if counts is not None else [1] * len(sids)
+        with self._lock:
+            for sid, score, bbox, n in zip(sids, scores, bboxes, counts):
+                if sid:
+                    self._rows.append(
+                        (now, self.run_id, source, frame, sid, float(score), int(n))
+                    )
+                    self._bboxes.append(bbox)
+            due = len(self._rows) >= Config.EVENT_BATCH_ROWS or (
+                time.time() - self._last_flush >= Config.EVENT_FLUSH_SECONDS
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """把缓冲的事件写成一个分片 (先写临时文件，读取方不会看到写了一半的分片)"""
+        with self._lock:
+            rows, bboxes = self._rows, self._bboxes
+            self._rows, self._bboxes = [], []
+            self._last_flush = time.time()
+            if not rows:
+                return
+            path = self.root / f"{self._prefix}_{self._seq:05d}.parquet"
+            self._seq += 1
+            df = pl.DataFrame(rows, schema=SCHEMA, orient="row").with_columns(
+                embeddings_to_series(np.reshape(bboxes, (-1, 4)), "bbox")
+            )
+            self._write(df, path)
+            self._compact()
+
+    @staticmethod
+    def _write(df, path):
+        tmp_path = path.with_suffix(".tmp")
+        df.write_parquet(tmp_path, row_group_size=min(len(df), 1 << 16))
+        os.replace(tmp_path, path)
+
+    def _compact(self, full=False):
+        """合并本进程的分片 (在 _lock 内调用)
+
+        未合并的小分片达到 EVENT_COMPACT_SHARDS 个时合并为一个区间文件，区间文件也达到
+        该数量或 full=True 时全部合并为一个。合并文件先原子地写好，读取方从此忽略被它
+        覆盖的分片 (见 live_shards)，之后才删除这些分片，查询不会重复或遗漏事件。
+        """
+        own = {}
+        for p in self.root.glob(f"{self._prefix}_*.parquet"):
+            r = _shard_range(p)
+            if r is not None and r[0] == self._prefix:
+                own[p] = r
+        live = [p for p in live_shards(self.root) if p in own]
+        # 上次合并后未能删除的分片 (如进程在删除前退出)
+        for p in set(own) - set(live):
+            p.unlink(missing_ok=True)
+        small = [p for p in live if own[p][1] == own[p][2]]
+        limit = Config.EVENT_COMPACT_SHARDS
+        n_merged = len(live) - len(small)
+        if full or (len(small) >= limit and n_merged + 1 >= limit):
+            parts = live
+        elif len(small) >= limit:
+            parts = small
+        else:
+            return
+        if len(parts) < 2:
+            return
+        start = min(own[p][1] for p in parts)
+        end = max(own[p][2] for p in parts)
+        merged = pl.concat([pl.read_parquet(p) for p in parts])
+        self._write(merged, self.root / f"{self._prefix}_{start:05d}-{end:05d}.parquet")
+        for p in parts:
+            p.unlink(missing_ok=True)
+
+    def close(self):
+        """运行结束 (或一个工作进程处理完一个视频)：写出缓冲并把本进程的分片合并为一个文件"""
+        self.flush()
+        with self._lock:
+            self._compact(full=True)
+
+    def import_report(self, report):
+        """把旧版 CSV 报表的各视频列导入为事件，升级后不丢失历史考勤
+
+        每个 (学号, 视频) 单元格都导入 (包括 0)，并为每个视频写入起止标记，
+        由此生成的报表与旧 CSV 一致，全员缺勤的视频列也会保留。
+        """
+        v_cols = [c for c in report.columns if c.endswith(".mp4")]
+        if not v_cols:
+            return
+        cells = (
+            report.select(["id"] + v_cols)
+            .unpivot(index="id", variable_name="source", value_name="count")
+            .select(
+                "source",
+                pl.lit(SOURCE_START, SCHEMA["frame"]).alias("frame"),
+                pl.col("id").cast(pl.String).alias("student_id"),
+                pl.col("count").fill_null(0).cast(SCHEMA["count"]),
+            )
+        )
+        markers = pl.DataFrame(
+            {
+                "source": [c for c in v_cols for _ in (SOURCE_START, SOURCE_DONE)],
+                "frame": [SOURCE_START, SOURCE_DONE] * len(v_cols),
+            },
+            schema={"source": SCHEMA["source"], "frame": SCHEMA["frame"]},
+        ).with_columns(
+            pl.lit(None, SCHEMA["student_id"]).alias("student_id"),
+            pl.lit(0, SCHEMA["count"]).alias("count"),
+        )
+        df = pl.concat([markers, cells]).select(
+            pl.lit(datetime.now()).cast(SCHEMA["ts"]).alias("ts"),
+            pl.lit(LEGACY_RUN).alias("run"),
+            "source",
+            "frame",
+            "student_id",
+            pl.lit(None, SCHEMA["score"]).alias("score"),
+            "count",
+            pl.lit(None, pl.Array(pl.Float32, 4)).alias("bbox"),
+        )
+        df.write_parquet(self.root / f"{LEGACY_RUN}.parquet")
+
+
+class SourceEvents:
+    """绑定到单个视频源的事件记录器"""
+
+    def __init__(self, log, name):
+        self.log = log
+        self.name = name
+
+    def faces(self, frame, sids, scores, bboxes, counts=None):
+        self.log.record(self.name, frame, sids, scores, bboxes, counts)
+
+    def done(self):
+        self.log.done(self.name)
+
+    def tracks(self, frame, tracks):
+        """跟踪模式：每条结束的轨迹记为一个事件，计数为其帧数"""
+        if tracks:
+            self.log.record(
+                self.name,
+                frame,
+                [t.sid for t in tracks],
+                [t.score for t in tracks],
+                [t.bbox for t in tracks],
+                [t.frames for t in tracks],
+            )
+
+
+def scan_events(root=None):
+    """以 LazyFrame 读取全部事件分片，没有分片时返回 None"""
+    paths = live_shards(root or Config.EVENTS_DIR)
+    if not paths:
+        return None
+    return pl.scan_parquet(paths)
+
+
+def attendance_counts(root=None, sources=None):
+    """每个视频源最近一次运行中各学生的命中数 (LazyFrame: source, student_id, hits)
+
+    同一视频源被重复处理时只取带完成标记的运行中编号最大的一次 (与旧报表覆盖同名列的
+    行为一致)，中途中断的运行不会替换上一次完整的结果；旧版报表导入的运行视为完整，
+    从未完整处理过的视频源 (如完成标记出现之前的日志) 取编号最大的一次。
+    学号为空的行来自视频源的起止标记 (hits 为 0)，保证没有命中的视频源也会出现。
+    sources: 可选的过滤表达式，如 pl.col("source").str.ends_with(".mp4")
+    """
+    events = scan_events(root)
+    if events is None:
+        return None
+    if sources is not None:
+        events = events.filter(sources)
+    completed = (pl.col("frame") == SOURCE_DONE) & pl.col("student_id").is_null()
+    latest = events.group_by("source").agg(
+        pl.col("run")
+        .filter(completed | (pl.col("run") == LEGACY_RUN))
+        .max()
+        .fill_null(pl.col("run").max())
+    )
+    return (
+        events.join(latest, on=["source", "run"])
+        .group_by(["source", "student_id"])
+        .agg(pl.col("count").sum().alias("hits"))
+    )
+
+
+def attendance_report(roster, root=None, sources=None):
+    """考勤报表：id, name, 各视频源命中数, Total_Hits, Attendance_Count, Absence_Count
+
+    roster: 含 id/name 列的学生名单；聚合在 lazy 查询中完成，只有结果表会被物化。
+    """
+    counts = attendance_counts(root, sources)
+    report = roster.select(["id", "name"])
+    v_cols = []
+    if counts is not None:
+        counts = counts.collect()
+        v_cols = sorted(counts["source"].unique().to_list())
+        wide = counts.pivot(on="source", index="student_id", values="hits")
+        report = report.join(
+            wide.rename({"student_id": "id"}), on="id", how="left"
+        ).with_columns([pl.col(c).fill_null(0) for c in v_cols])
+
+    if v_cols:
+        totals = [
+            pl.sum_horizontal(v_cols).alias("Total_Hits"),
+            pl.sum_horizontal([(pl.col(c) > 0).cast(pl.Int32) for c in v_cols]).alias(
+                "Attendance_Count"
+            ),
+        ]
+    else:
+        totals = [pl.lit(0).alias("Total_Hits"), pl.lit(0).alias("Attendance_Count")]
+    return (
+        report.with_columns(totals)
+        .with_columns(
+            [(len(v_cols) - pl.col("Attendance_Count")).alias("Absence_Count")]
+        )
+        .select(
+            ["id", "name"]
+            + v_cols
+            + ["Total_Hits", "Attendance_Count", "Absence_Count"]
+        )
+        .sort("id")
+    )
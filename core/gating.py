@@ -0,0 +1,112 @@
+import cv2
+import numpy as np
+from .config import Config
+from .metrics import metrics
+
+
+def parse_roi(text):
+    """命令行的 ROI："x,y x,y x,y ..." 为一个多边形 (归一化坐标)，多个多边形用 ";" 分隔"""
+    if not text:
+        return []
+    return [
+        [tuple(float(v) for v in point.split(",")) for point in poly.split()]
+        for poly in text.split(";")
+        if poly.strip()
+    ]
+
+
+def shift_faces(faces, offset):
+    """把在裁剪图上检测到的人脸框与关键点平移回原图坐标"""
+    x0, y0 = offset
+    for face in faces:
+        face.bbox = face.bbox + np.array([x0, y0, x0, y0], dtype=face.bbox.dtype)
+        if getattr(face, "kps", None) is not None:
+            face.kps = face.kps + np.array([x0, y0], dtype=face.kps.dtype)
+    return faces
+
+
+class MotionGate:
+    """检测前的运动门控：画面没有变化时跳过检测，沿用上一帧的结果
+
+    把帧缩小到 GATE_WIDTH 宽的灰度图，与上一次实际检测的帧做差，只统计座位区域
+    (ROI) 内的像素；变化像素比例不超过 GATE_MOTION_RATIO 时跳过。画面持续静止时
+    仍按间隔强制检测，间隔从 GATE_MIN_INTERVAL 逐次翻倍到 GATE_MAX_INTERVAL，
+    出现变化后恢复，静止的坐姿不会被漏掉，迟到的学生进入画面时也会立即触发检测。
+    设置了 ROI 时检测只在其外接矩形内进行 (见 detect)。
+    """
+
+    def __init__(
+        self, roi=None, motion_ratio=None, min_interval=None, max_interval=None
+    ):
+        self.roi = Config.GATE_ROI if roi is None else roi
+        self.motion_ratio = motion_ratio or Config.GATE_MOTION_RATIO
+        self.min_interval = min_interval or Config.GATE_MIN_INTERVAL
+        self.max_interval = max_interval or Config.GATE_MAX_INTERVAL
+        self.interval = self.min_interval
+        self.checked = 0  # 经过门控的帧数
+        self.skipped = 0  # 跳过检测的帧数
+        self._ref = None
+        self._mask = None
+        self._box = None
+        self._since = 0
+
+    def _setup(self, frame):
+        h, w = frame.shape[:2]
+        small_w = min(Config.GATE_WIDTH, w)
+        small_h = max(1, round(h * small_w / w))
+        self._small_size = (small_w, small_h)
+        if not self.roi:
+            return
+        polys = [
+            np.round(np.asarray(p, dtype=np.float32) * (small_w, small_h)).astype(
+                np.int32
+            )
+            for p in self.roi
+        ]
+        self._mask = np.zeros((small_h, small_w), dtype=np.uint8)
+        cv2.fillPoly(self._mask, polys, 255)
+        self._mask = self._mask > 0
+        pts = np.concatenate([np.asarray(p, dtype=np.float32) for p in self.roi])
+        x0, y0 = np.clip(pts.min(axis=0), 0, 1) * (w, h)
+        x1, y1 = np.clip(pts.max(axis=0), 0, 1) * (w, h)
+        self._box = (int(x0), int(y0), int(np.ceil(x1)), int(np.ceil(y1)))
+
+    def _thumb(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small = cv2.resize(gray, self._small_size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(small, (5, 5), 0)
+
+    def motion(self, thumb):
+        """与参考帧相比，ROI 内发生变化的像素比例"""
+        changed = cv2.absdiff(thumb, self._ref) > Config.GATE_PIXEL_DIFF
+        if self._mask is not None:
+            changed = changed[self._mask]
+        return float(changed.mean()) if changed.size else 0.0
+
+    def check(self, frame):
+        """是否需要对这一帧做检测；返回 False 时调用方沿用上一帧的结果"""
+        if self._ref is None:
+            self._setup(frame)
+        self.checked += 1
+        thumb = self._thumb(frame)
+        if self._ref is not None:
+            self._since += 1
+            if self.motion(thumb) > self.motion_ratio:
+                self.interval = self.min_interval
+            elif self._since < self.interval:
+                self.skipped += 1
+                metrics.inc("frames_gated")
+                return False
+            else:
+                # 静止期间的强制检测：下一次间隔加倍
+                self.interval = min(self.interval * 2, self.max_interval)
+        self._ref = thumb
+        self._since = 0
+        return True
+
+    def detect(self, func, frame, *args):
+        """在 ROI 外接矩形内调用 func(图像, *args) 检测，结果坐标换算回原图"""
+        if self._box is None:
+            return func(frame, *args)
+        x0, y0, x1, y1 = self._box
+        return shift_faces(func(frame[y0:y1, x0:x1], *args), (x0, y0))
@@ -0,0 +1,169 @@
+import hashlib
+import numpy as np
+from pathlib import Path
+from .config import Config
+
+
+def top_k(sims, k):
+    """从相似度矩阵 (M, N) 中取每行前 k 个 (列号, 分数)，按分数降序"""
+    n = sims.shape[1]
+    k = min(k, n)
+    if k == 0:
+        empty = np.zeros((len(sims), 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+    if k < n:
+        # argpartition 只做部分排序，O(N) 取出前 k 个候选
+        idx = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+    else:
+        idx = np.broadcast_to(np.arange(n), sims.shape)
+    scores = np.take_along_axis(sims, idx, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(
+        scores, order, axis=1
+    )
+
+
+def fingerprint(ids):
+    """底库身份列表的指纹，用于判断持久化索引是否过期"""
+    return hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+
+
+class FlatIndex:
+    """精确检索：对整个底库做一次矩阵乘法"""
+
+    kind = "flat"
+
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+
+    def search(self, queries, k=1):
+        queries = np.asarray(queries, dtype=np.float32)
+        if len(queries) == 0 or len(self.embeddings) == 0:
+            return top_k(np.zeros((len(queries), 0), dtype=np.float32), k)
+        return top_k(queries @ self.embeddings.T, k)
+
+
+class IVFIndex:
+    """倒排近似检索：k-means 粗聚类后只扫描最近的 nprobe 个桶
+
+    桶内只保存行号，向量本身仍读自底库矩阵，因此特征进化后无需重建索引。
+    """
+
+    kind = "ivf"
+
+    def __init__(self, embeddings, nlist=None, nprobe=None):
+        self.embeddings = embeddings
+        n = len(embeddings)
+        self.nlist = nlist or Config.IVF_NLIST or max(1, int(np.sqrt(n)))
+        self.nlist = min(self.nlist, max(1, n))
+        self.nprobe = nprobe or Config.IVF_NPROBE
+        self.centroids = None
+        self.list_rows = None
+        self.list_offsets = None
+
+    def build(self, n_iter=20, seed=0):
+        """球面 k-means 训练粗聚类中心，再把全部底库向量分桶"""
+        rng = np.random.default_rng(seed)
+        data = self.embeddings
+        n_train = min(len(data), self.nlist * 256)
+        train = data[rng.choice(len(data), n_train, replace=False)]
+        centroids = train[rng.choice(n_train, self.nlist, replace=False)].copy()
+
+        for _ in range(n_iter):
+            assign = self._assign(train, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, train)
+            counts = np.bincount(assign, minlength=self.nlist)
+            # 空桶用随机样本重新播种
+            empty = counts == 0
+            sums[empty] = train[rng.choice(n_train, empty.sum())]
+            centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+
+        self.centroids = centroids.astype(np.float32)
+        assign = self._assign(data, self.centroids)
+        self.list_rows = np.argsort(assign, kind="stable")
+        self.list_offsets = np.concatenate(
+            [[0], np.cumsum(np.bincount(assign, minlength=self.nlist))]
+        )
+        return self
+
+    @staticmethod
+    def _assign(data, centroids, chunk=8192):
+        return np.concatenate(
+            [
+                np.argmax(data[i : i + chunk] @ centroids.T, axis=1)
+                for i in range(0, len(data), chunk)
+            ]
+        )
+
+    def search(self, queries, k=1):
+        queries = np.asarray(queries, dtype=np.float32)
+        nprobe = min(self.nprobe, self.nlist)
+        idx = np.zeros((len(queries), k), dtype=np.int64)
+        scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        if len(queries) == 0:
+            return idx, scores
+
+        probes, _ = top_k(queries @ self.centroids.T, nprobe)
+        for i, (q, lists) in enumerate(zip(queries, probes)):
+            rows = np.concatenate(
+                [
+                    self.list_rows[self.list_offsets[l] : self.list_offsets[l + 1]]
+                    for l in lists
+                ]
+            )
+            if len(rows) == 0:
+                continue
+            cand_idx, cand_scores = top_k((self.embeddings[rows] @ q)[None, :], k)
+            n_found = cand_idx.shape[1]
+            idx[i, :n_found] = rows[cand_idx[0]]
+            scores[i, :n_found] = cand_scores[0]
+        return idx, scores
+
+    def save(self, path, ids):
+        np.savez(
+            path,
+            fingerprint=fingerprint(ids),
+            nlist=self.nlist,
+            centroids=self.centroids,
+            list_rows=self.list_rows,
+            list_offsets=self.list_offsets,
+        )
+
+    @classmethod
+    def load(cls, path, embeddings, ids):
+        """加载持久化索引，底库身份变化时返回 None"""
+        with np.load(path) as f:
+            if str(f["fingerprint"]) != fingerprint(ids):
+                return None
+            index = cls(embeddings, nlist=int(f["nlist"]))
+            index.centroids = f["centroids"]
+            index.list_rows = f["list_rows"]
+            index.list_offsets = f["list_offsets"]
+        return index
+
+
+def index_path_for(db_path):
+    """索引文件与底库放在一起: student_db.ipc -> student_db.index.npz"""
+    return Path(db_path).with_suffix(".index.npz")
+
+
+def open_index(db_path, embeddings, ids, kind=None):
+    """按配置打开底库索引，近似索引优先复用磁盘上的持久化文件"""
+    kind = kind or Config.INDEX_TYPE
+    if kind == "auto":
+        kind = "ivf" if len(ids) >= Config.IVF_MIN_SIZE else "flat"
+    if kind not in ("flat", "ivf"):
+        raise ValueError(f"Unknown index type: {kind}")
+    # 底库为空 (尚未注册) 或少于聚类中心数时无法训练 IVF，精确检索本来也足够快
+    if kind == "flat" or len(ids) == 0 or len(ids) < Config.IVF_NLIST:
+        return FlatIndex(embeddings)
+
+    path = index_path_for(db_path)
+    if path.exists():
+        index = IVFIndex.load(path, embeddings, ids)
+        if index is not None:
+            return index
+    index = IVFIndex(embeddings).build()
+    index.save(path, ids)
+    return index
@@ -0,0 +1,304 @@
+import os
+import sys
+import json
+import time
+import bisect
+import cProfile
+import pstats
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from .config import Config
+
+# 耗时直方图的桶上界 (秒)，覆盖 0.1 毫秒到 10 秒
+BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+PREFIX = "face_attendance"
+
+
+class Histogram:
+    """固定分桶的耗时直方图，分位数按桶上界估计"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)  # 最后一桶为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            "buckets": list(self.buckets),
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+        }
+
+    def merge(self, data):
+        self.buckets = [a + b for a, b in zip(self.buckets, data["buckets"])]
+        self.count += data["count"]
+        self.sum += data["sum"]
+        self.max = max(self.max, data["max"])
+
+
+class Metrics:
+    """进程内的计数器与各阶段耗时直方图
+
+    热路径上只有一次 perf_counter 与一次加锁累加；METRICS_ENABLED 为 False 时直接跳过。
+    多进程模式下各工作进程用 drain() 取出增量，由父进程 merge() 汇总。
+    """
+
+    def __init__(self, enabled=None):
+        self.enabled = Config.METRICS_ENABLED if enabled is None else enabled
+        self.started = time.time()
+        self.counters = Counter()
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, n=1):
+        if self.enabled and n:
+            with self._lock:
+                self.counters[name] += n
+
+    def observe(self, name, seconds):
+        if self.enabled:
+            with self._lock:
+                hist = self.histograms.get(name)
+                if hist is None:
+                    hist = self.histograms[name] = Histogram()
+                hist.observe(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        """计时一段代码，记入 name 阶段的直方图"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        """函数装饰器版本的 timer"""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start)
+
+            return wrapper
+
+        return decorator
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "time": time.time(),
+                "counters": dict(self.counters),
+                "histograms": {k: h.to_dict() for k, h in self.histograms.items()},
+            }
+
+    def drain(self):
+        """返回当前快照并清零，供工作进程上报增量"""
+        with self._lock:
+            snap = {
+                "counters": dict(self.counters),
+                "histograms": {k: h.to_dict() for k, h in self.histograms.items()},
+            }
+            self.counters.clear()
+            self.histograms.clear()
+        return snap
+
+    def merge(self, snap):
+        """并入其他进程 drain() 得到的增量"""
+        with self._lock:
+            self.counters.update(snap["counters"])
+            for name, data in snap["histograms"].items():
+                self.histograms.setdefault(name, Histogram()).merge(data)
+
+    def summary(self):
+        """各阶段耗时汇总，按总耗时降序：[{Stage, Calls, Total_s, Mean_ms, P50_ms, P95_ms, Max_ms}]"""
+        with self._lock:
+            items = list(self.histograms.items())
+            rows = [
+                {
+                    "Stage": name,
+                    "Calls": h.count,
+                    "Total_s": round(h.sum, 3),
+                    "Mean_ms": round(h.sum / max(h.count, 1) * 1000, 2),
+                    "P50_ms": round(h.quantile(0.5) * 1000, 2),
+                    "P95_ms": round(h.quantile(0.95) * 1000, 2),
+                    "Max_ms": round(h.max * 1000, 2),
+                }
+                for name, h in items
+            ]
+        return sorted(rows, key=lambda r: r["Total_s"], reverse=True)
+
+    def to_prometheus(self):
+        """Prometheus 文本格式 (可由 node_exporter 的 textfile collector 采集)"""
+        snap = self.snapshot()
+        lines = []
+        for name, value in sorted(snap["counters"].items()):
+            metric = f"{PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, h in sorted(snap["histograms"].items()):
+            metric = f"{PREFIX}_{name}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            seen = 0
+            for le, n in zip(BUCKETS + ("+Inf",), h["buckets"]):
+                seen += n
+                lines.append(f'{metric}_bucket{{le="{le}"}} {seen}')
+            lines += [f"{metric}_sum {h['sum']}", f"{metric}_count {h['count']}"]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """写出快照，.prom 后缀为 Prometheus 文本，其余为 JSON (先写临时文件再替换)"""
+        path = Path(path)
+        if path.suffix == ".prom":
+            text = self.to_prometheus()
+        else:
+            text = json.dumps({**self.snapshot(), "stages": self.summary()}, indent=1)
+        tmp_path = path.with_name(f"{path.name}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, path)
+
+
+# 进程级的全局实例，core 中的各阶段都记录到这里
+metrics = Metrics()
+timed = metrics.timed
+
+
+class MetricsExporter:
+    """后台线程每隔 interval 秒把快照写到 path，停止时再写一次"""
+
+    def __init__(self, path, interval=None, registry=None):
+        self.path = path
+        self.interval = interval or Config.METRICS_INTERVAL
+        self.registry = registry or metrics
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.registry.write(self.path)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.registry.write(self.path)
+
+
+class StackSampler:
+    """采样式剖析：后台线程定时抓取所有线程的调用栈
+
+    输出 folded stacks 格式 (每行 "线程;函数;函数 次数")，与 py-spy --format raw 相同，
+    可直接交给 flamegraph.pl 或 speedscope；与 cProfile 不同，推理线程也会被采到。
+    """
+
+    def __init__(self, path, interval=0.005):
+        self.path = path
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(
+                        f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+                    )
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        with open(self.path, "w", encoding="utf-8") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+
+@contextmanager
+def profiling(path=None, top=25):
+    """可选的剖析开关，path 为 None 时不做任何事
+
+    .prof 后缀用 cProfile 剖析当前线程并打印累计耗时前 top 的函数
+    (结果可用 snakeviz 等查看)；其余后缀用 StackSampler 采样所有线程。
+    """
+    if not path:
+        yield
+        return
+    if Path(path).suffix == ".prof":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path)
+            pstats.Stats(profiler).sort_stats("cumulative").print_stats(top)
+            print(f"[INFO] Profile saved to {path}")
+    else:
+        sampler = StackSampler(path).start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+            print(f"[INFO] Stack samples saved to {path}")
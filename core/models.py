@@ -0,0 +1,187 @@
+import os
+import sys
+import json
+import hashlib
+import platform
+from pathlib import Path
+from .config import Config
+
+
+def _manifest_path(name):
+    return Path(Config.CACHE_DIR) / "ort" / f"{name}_models.json"
+
+
+def _session_key(path, providers):
+    """优化结果与模型文件、ONNX Runtime 版本、推理后端和 CPU 架构相关"""
+    import onnxruntime as ort
+
+    st = Path(path).stat()
+    parts = [
+        str(Path(path).resolve()),
+        f"{st.st_size}:{st.st_mtime_ns}",
+        ort.__version__,
+        platform.machine(),
+        ",".join(providers),
+        str(Config.ORT_OPT_LEVEL),
+    ]
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def int8_path_for(path):
+    """模型文件对应的 INT8 量化模型路径 (由 quantize.py 生成)"""
+    return Path(Config.INT8_DIR) / Config.NAME / Path(path).name
+
+
+def model_variant():
+    """推理实际使用的模型变体，供结果缓存区分：浮点模型为 "fp32"，
+    使用 INT8 模型时 (见 load_models) 附带各量化模型文件的大小与修改时间"""
+    if not Config.USE_INT8 or Config.get_providers()[0] != "CPUExecutionProvider":
+        return "fp32"
+    stamps = [
+        f"{p.name}:{p.stat().st_size}:{p.stat().st_mtime_ns}"
+        for p in sorted((Path(Config.INT8_DIR) / Config.NAME).glob("*.onnx"))
+    ]
+    return "int8:" + ",".join(stamps)
+
+
+def _options(level):
+    """会话参数：图优化级别与 Config 中的 CPU 线程设置"""
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.log_severity_level = 3
+    opts.graph_optimization_level = getattr(ort.GraphOptimizationLevel, level)
+    if Config.INTRA_OP_THREADS:
+        opts.intra_op_num_threads = Config.INTRA_OP_THREADS
+    if Config.INTER_OP_THREADS:
+        # 算子间线程只在并行执行模式下生效
+        opts.inter_op_num_threads = Config.INTER_OP_THREADS
+        opts.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+    if not Config.ORT_ALLOW_SPINNING:
+        opts.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        opts.add_session_config_entry("session.inter_op.allow_spinning", "0")
+    return opts
+
+
+def make_session(path, providers):
+    """创建 InferenceSession，图优化的结果缓存在 CACHE_DIR/ort 下
+
+    首次加载按 ORT_OPT_LEVEL 优化并把优化后的图写盘；之后直接加载已优化的图并关闭优化，
+    省去每次启动时的图变换。推理后端不支持导出优化图 (如编译型后端) 时退回普通加载。
+    """
+    import onnxruntime as ort
+
+    if not Config.ORT_OPT_CACHE:
+        return ort.InferenceSession(
+            str(path), _options(Config.ORT_OPT_LEVEL), providers=providers
+        )
+
+    cache_dir = Path(Config.CACHE_DIR) / "ort"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    optimized = cache_dir / f"{Path(path).stem}_{_session_key(path, providers)}.onnx"
+    if optimized.exists():
+        try:
+            return ort.InferenceSession(
+                str(optimized), _options("ORT_DISABLE_ALL"), providers=providers
+            )
+        except Exception:
+            # 缓存文件损坏时删除并重新优化
+            optimized.unlink(missing_ok=True)
+
+    # 多个进程可能同时优化同一模型，各自写临时文件后原子替换
+    tmp_path = optimized.with_suffix(f".{os.getpid()}.tmp")
+    opts = _options(Config.ORT_OPT_LEVEL)
+    opts.optimized_model_filepath = str(tmp_path)
+    try:
+        session = ort.InferenceSession(str(path), opts, providers=providers)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)
+        return ort.InferenceSession(
+            str(path), _options(Config.ORT_OPT_LEVEL), providers=providers
+        )
+    if tmp_path.exists():
+        os.replace(tmp_path, optimized)
+    return session
+
+
+def route_models(model_dir, name):
+    """返回 {模型文件名: 任务名}，结果记录在清单中，模型包不变时不再逐个加载识别"""
+    manifest_path = _manifest_path(name)
+    files = sorted(Path(model_dir).glob("*.onnx"))
+    stamps = {p.name: f"{p.stat().st_size}:{p.stat().st_mtime_ns}" for p in files}
+    manifest = (
+        json.loads(manifest_path.read_text(encoding="utf-8"))
+        if manifest_path.exists()
+        else {}
+    )
+    if manifest.get("stamps") == stamps:
+        return manifest["tasks"]
+
+    from insightface.model_zoo.model_zoo import ModelRouter
+
+    # 只为识别任务类型，不做图优化
+    opts = _options("ORT_DISABLE_ALL")
+    tasks = {}
+    for p in files:
+        model = ModelRouter(str(p)).get_model(
+            sess_options=opts, providers=["CPUExecutionProvider"]
+        )
+        tasks[p.name] = model.taskname if model is not None else None
+        del model
+
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = manifest_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(
+        json.dumps({"stamps": stamps, "tasks": tasks}), encoding="utf-8"
+    )
+    os.replace(tmp_path, manifest_path)
+    return tasks
+
+
+def load_models(name=None, modules=None, providers=None):
+    """只加载 modules 中的子模型，返回 {任务名: 模型}
+
+    代替 FaceAnalysis：不再为模型包中的每个文件创建会话，
+    检测与识别模型的会话使用缓存的优化图 (见 make_session)。
+    """
+    import onnxruntime as ort
+    from insightface.utils import ensure_available
+    from insightface.model_zoo.model_zoo import ModelRouter
+    from insightface.model_zoo.retinaface import RetinaFace
+    from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+
+    ort.set_default_logger_severity(3)
+    name = name or Config.NAME
+    modules = modules or Config.MODULES
+    providers = providers or Config.get_providers()
+    model_dir = ensure_available("models", name, root="~/.insightface")
+    classes = {"detection": RetinaFace, "recognition": ArcFaceONNX}
+    # INT8 模型只对 CPU 推理有收益
+    use_int8 = Config.USE_INT8 and providers[0] == "CPUExecutionProvider"
+
+    models = {}
+    for file_name, task in sorted(route_models(model_dir, name).items()):
+        if task not in modules or task in models:
+            continue
+        path = os.path.join(model_dir, file_name)
+        if task in classes:
+            session_path = path
+            if use_int8:
+                session_path = int8_path_for(path)
+                if not session_path.exists():
+                    # 加载模型时 stdout 被屏蔽，提示写到 stderr
+                    print(
+                        f"[WARN] {session_path} not found, run quantize.py first.",
+                        file=sys.stderr,
+                    )
+                    session_path = path
+            # 模型类仍以原始文件解析预处理参数，会话则来自优化后 (或量化后) 的图
+            models[task] = classes[task](
+                model_file=path, session=make_session(session_path, providers)
+            )
+        else:
+            models[task] = ModelRouter(path).get_model(providers=providers)
+    missing = set(modules) - set(models)
+    if missing:
+        raise RuntimeError(f"Model pack {name} has no {sorted(missing)} model.")
+    return models
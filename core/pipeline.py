@@ -0,0 +1,133 @@
+import queue
+import threading
+from .config import Config
+
+_DONE = object()
+
+
+class FramePipeline:
+    """解码 -> 推理 -> 匹配 三级流水线
+
+    解码线程把帧放入有界队列，多个推理线程 (每个线程独占一个 FaceProcessor，
+    即一套独立的 ONNX Runtime 会话) 并行取帧检测识别，结果按帧序交还给调用方，
+    由调用方所在线程完成匹配与统计。因此输出顺序与单线程逐帧处理完全一致。
+    给出 gate (MotionGate) 时解码线程先做运动门控，画面未变化的帧不进入推理，
+    按帧序产出时沿用上一帧的人脸，并以 reused 标记 (调用方不应再用它们做特征进化)。
+    检测分辨率策略按帧序生效 (DetSizePolicy.at)，结果与推理线程数和调度无关。
+    """
+
+    def __init__(
+        self,
+        processors,
+        queue_size=None,
+        stage="get_faces",
+        det_policy=None,
+        gate=None,
+    ):
+        self.processors = processors
+        # 推理线程调用的 FaceProcessor 方法："get_faces" 检测+识别，"detect" 仅检测
+        self.stage = stage
+        # 所有推理线程共享同一视频源的检测分辨率策略，每帧按帧序取用
+        self.det_policy = det_policy
+        self.gate = gate
+        self.queue_size = queue_size or Config.PIPELINE_QUEUE_SIZE
+
+    def run(self, frames):
+        """frames: 可迭代的 (f_idx, frame)；按输入顺序产出 (f_idx, frame, faces, reused)
+
+        reused 为 True 表示该帧被门控跳过，faces 沿用自上一帧
+        """
+        in_q = queue.Queue(maxsize=self.queue_size)
+        out_q = queue.Queue(maxsize=self.queue_size)
+        # 限制在途帧总数，防止某个慢帧阻塞时乱序缓冲无限增长
+        in_flight = threading.Semaphore(self.queue_size + 2 * len(self.processors))
+        stop = threading.Event()
+
+        def put(q, item):
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def decode():
+            try:
+                for seq, (f_idx, frame) in enumerate(frames):
+                    while not in_flight.acquire(timeout=0.1):
+                        if stop.is_set():
+                            return
+                    if self.gate is not None and not self.gate.check(frame):
+                        if self.det_policy is not None:
+                            self.det_policy.skip(seq)
+                        # 跳过推理，直接交给按序输出，人脸为 None 表示沿用上一帧
+                        if not put(out_q, (seq, f_idx, (frame, None))):
+                            return
+                        continue
+                    if not put(in_q, (seq, f_idx, frame)):
+                        return
+            except Exception as e:
+                put(out_q, (-1, None, e))
+            finally:
+                for _ in self.processors:
+                    put(in_q, _DONE)
+
+        def infer(processor):
+            while not stop.is_set():
+                try:
+                    item = in_q.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    put(out_q, _DONE)
+                    return
+                seq, f_idx, frame = item
+                policy = None if self.det_policy is None else self.det_policy.at(seq)
+                try:
+                    func = getattr(processor, self.stage)
+                    if self.gate is not None:
+                        faces = self.gate.detect(func, frame, policy)
+                    else:
+                        faces = func(frame, policy)
+                except Exception as e:
+                    if policy is not None:
+                        # 让等待这一帧结果的其他推理线程继续，随后整体报错退出
+                        self.det_policy.skip(seq)
+                    put(out_q, (-1, None, e))
+                    put(out_q, _DONE)
+                    return
+                put(out_q, (seq, f_idx, (frame, faces)))
+
+        threads = [threading.Thread(target=decode, daemon=True)] + [
+            threading.Thread(target=infer, args=(p,), daemon=True)
+            for p in self.processors
+        ]
+        for t in threads:
+            t.start()
+
+        pending, next_seq, n_done = {}, 0, 0
+        last_faces = []
+        try:
+            while n_done < len(self.processors):
+                item = out_q.get()
+                if item is _DONE:
+                    n_done += 1
+                    continue
+                seq, f_idx, payload = item
+                if seq < 0:
+                    raise payload
+                pending[seq] = (f_idx, payload)
+                while next_seq in pending:
+                    f_idx, (frame, faces) = pending.pop(next_seq)
+                    next_seq += 1
+                    reused = faces is None
+                    if reused:
+                        faces = last_faces
+                    last_faces = faces
+                    in_flight.release()
+                    yield f_idx, frame, faces, reused
+        finally:
+            stop.set()
+            for t in threads:
+                t.join()
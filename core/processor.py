@@ -1,15 +1,183 @@
-from insightface.app import FaceAnalysis
+import uuid
+import threading
 from .config import Config
+from .metrics import metrics, timed
+
+_SKIPPED = object()
+
+
+class DetSizePolicy:
+    """单个视频源 (一路摄像头或一个视频) 的检测分辨率策略
+
+    从当前档位开始检测，没有人脸或最高检测分低于 DET_ESCALATE_SCORE 时放大一档，
+    并记住该视频源最终采用的档位；每隔 DET_PROBE_INTERVAL 帧从小一档试探一次。
+
+    逐帧顺序调用 plan()/record() 时即按上述方式更新。批处理流水线中同一视频源的帧
+    由多个推理线程并行处理，此时通过 at(seq) 按帧序使用：第 seq 帧的档位只取决于
+    第 seq - lag 帧之前的结果，各帧的结果也按帧序生效，与线程数和调度无关。
+    """
+
+    def __init__(self, sizes=None, lag=None):
+        self.sizes = [tuple(s) for s in (sizes or Config.DET_SIZES)]
+        self.level = 0
+        self.frames = 0  # 本视频源已检测的帧数
+        self.empty = 0  # 连续所有档位都没有人脸的帧数
+        self.key = uuid.uuid4().hex  # 识别服务按 key 在服务端保存各视频源的策略
+        self.lag = Config.DET_POLICY_LAG if lag is None else lag
+        self._cond = threading.Condition()
+        # 按帧序使用时：已生效的帧数、尚未轮到的结果 {帧序: 档位}、
+        # 最近 lag 帧内每个生效位置的状态 {已生效帧数: (档位, 连续空帧数)}
+        self._applied = 0
+        self._results = {}
+        self._history = {0: (0, 0)}
+
+    @property
+    def size(self):
+        return self.sizes[self.level]
+
+    def _levels(self, frames, level, empty):
+        probe = frames % Config.DET_PROBE_INTERVAL == 0
+        start = max(level - 1, 0) if probe else level
+        if empty >= Config.DET_EMPTY_PATIENCE and not probe:
+            return range(start, start + 1)
+        return range(start, len(self.sizes))
+
+    def _apply(self, level):
+        if level is _SKIPPED:
+            return
+        if level is None:
+            self.empty += 1
+        else:
+            self.empty = 0
+            self.level = level
+
+    def plan(self, seq=None):
+        """本帧依次尝试的档位；给出 seq 时等到第 seq - lag 帧之前的结果全部生效"""
+        with self._cond:
+            if seq is None:
+                self.frames += 1
+                return self._levels(self.frames, self.level, self.empty)
+            base = max(seq - self.lag, 0)
+            self._cond.wait_for(lambda: self._applied >= base)
+            return self._levels(seq + 1, *self._history[base])
+
+    def record(self, level, seq=None):
+        """记录本帧采用的档位，level 为 None 表示所有档位都没有人脸"""
+        with self._cond:
+            if seq is None:
+                self._apply(level)
+                return
+            self._results[seq] = level
+            while self._applied in self._results:
+                self._apply(self._results.pop(self._applied))
+                self._applied += 1
+                self._history[self._applied] = (self.level, self.empty)
+                self._history.pop(self._applied - self.lag - 1, None)
+            self.frames = self._applied
+            self._cond.notify_all()
+
+    def skip(self, seq):
+        """按帧序使用时，第 seq 帧未做检测 (如被门控跳过)，不改变状态"""
+        self.record(_SKIPPED, seq)
+
+    def at(self, seq):
+        """第 seq 帧 (从 0 起) 使用的策略视图，传给 FaceProcessor.detect"""
+        return _FramePolicy(self, seq)
+
+
+class _FramePolicy:
+    """DetSizePolicy 在某一帧上的视图：plan/record 带上帧序"""
+
+    def __init__(self, policy, seq):
+        self.policy = policy
+        self.seq = seq
+        self.sizes = policy.sizes
+        self.key = policy.key
+
+    def plan(self):
+        return self.policy.plan(self.seq)
+
+    def record(self, level):
+        self.policy.record(level, self.seq)
 
 
 class FaceProcessor:
     def __init__(self):
-        self.app = FaceAnalysis(name=Config.NAME, providers=Config.get_providers())
-        self.app.prepare(ctx_id=0, det_size=Config.DET_SIZE)
+        # insightface 在创建时才导入；考勤只需要检测与识别，其余子模型的文件不会被打开
+        from .models import load_models
+
+        models = load_models(Config.NAME, Config.MODULES, Config.get_providers())
+        self.det_model = models["detection"]
+        self.rec_model = models["recognition"]
+        self.det_model.prepare(ctx_id=0, input_size=Config.DET_SIZES[0], det_thresh=0.5)
+        self.rec_model.prepare(ctx_id=0)
+        # 未指定视频源时使用的共享策略 (如测速脚本)
+        self.det_policy = DetSizePolicy()
+
+    def get_faces(self, frame, policy=None):
+        """获取一帧图像中的所有人脸及其特征 (耗时分别计入 detect 与 embed 阶段)"""
+        return self.embed(frame, self.detect(frame, policy))
+
+    @timed("detect")
+    def detect(self, frame, policy=None):
+        """只运行检测模型，返回带 bbox/kps/det_score 但尚无特征的人脸
+
+        policy 为该视频源的 DetSizePolicy：从记住的档位开始，结果不可靠时逐档放大，
+        最终取最高检测分最大的一档。
+        """
+        policy = policy or self.det_policy
+        best, best_level = [], None
+        for level in policy.plan():
+            faces = self.detect_at(frame, policy.sizes[level])
+            if not faces:
+                continue
+            score = max(f.det_score for f in faces)
+            if not best or score > max(f.det_score for f in best):
+                best, best_level = faces, level
+            if score >= Config.DET_ESCALATE_SCORE:
+                break
+        policy.record(best_level)
+        metrics.inc("faces", len(best))
+        return best
+
+    def detect_at(self, frame, size):
+        """以指定的检测输入尺寸运行一次检测模型"""
+        from insightface.app.common import Face
+
+        bboxes, kpss = self.det_model.detect(
+            frame, input_size=size, max_num=0, metric="default"
+        )
+        return [
+            Face(
+                bbox=bboxes[i, 0:4],
+                det_score=bboxes[i, 4],
+                kps=kpss[i] if kpss is not None else None,
+            )
+            for i in range(bboxes.shape[0])
+        ]
+
+    def align(self, frame, faces):
+        """按五点关键点把人脸对齐裁剪为识别模型的输入尺寸"""
+        from insightface.utils import face_align
+
+        size = self.rec_model.input_size[0]
+        return [
+            face_align.norm_crop(frame, landmark=face.kps, image_size=size)
+            for face in faces
+        ]
+
+    @timed("embed")
+    def embed(self, frame, faces):
+        """为指定人脸运行识别模型，特征写入 face.embedding
 
-    def get_faces(self, frame):
-        """获取一帧图像中的所有人脸及其特征"""
-        return self.app.get(frame)
+        所有人脸对齐后拼成一个 batch，每 REC_BATCH_SIZE 张只调用一次 ONNX。
+        """
+        crops = self.align(frame, faces)
+        for i in range(0, len(faces), Config.REC_BATCH_SIZE):
+            feats = self.rec_model.get_feat(crops[i : i + Config.REC_BATCH_SIZE])
+            for face, feat in zip(faces[i : i + Config.REC_BATCH_SIZE], feats):
+                face.embedding = feat.flatten()
+        return faces
 
     @staticmethod
     def get_best_face(faces):
@@ -0,0 +1,163 @@
+import time
+import threading
+from .batch import ReusedFrames, match_faces
+from .processor import DetSizePolicy
+from .tracker import FaceTracker, track_hits
+
+
+class Snapshot:
+    """推理线程发布的最新结果，界面只读取快照，不与推理争用"""
+
+    def __init__(self, faces=(), latency=0.0, fps=0.0, dropped=0):
+        self.faces = list(faces)
+        self.latency = latency  # 采集到结果发布的端到端延迟 (秒)
+        self.fps = fps  # 推理线程的处理帧率
+        self.dropped = dropped  # 因推理来不及而丢弃的帧数
+
+
+class RecognitionLoop:
+    """实时推理线程：始终只处理采集线程给出的最新帧
+
+    命中计数与特征进化在 lock 保护下更新，保存底库和生成报表时持有同一把锁。
+    """
+
+    def __init__(
+        self,
+        engine,
+        reader,
+        processor=None,
+        track=False,
+        engine_lock=None,
+        events=None,
+        gate=None,
+    ):
+        self.engine = engine
+        self.reader = reader
+        self.processor = processor or engine.processor
+        self.tracker = FaceTracker() if track else None
+        # 检测分辨率按视频源记忆，与处理本路的是哪个 FaceProcessor 无关
+        self.det_policy = DetSizePolicy()
+        # 运动门控 (MotionGate)：画面未变化时沿用上一帧的人脸
+        self.gate = gate
+        self._faces = []
+        self.hits = {sid: 0 for sid in engine.ids}
+        # 本路的 SourceEvents，命中持续写入考勤事件日志；frames 作为事件的帧号
+        self.events = events
+        self.frames = 0
+        self.repeats = ReusedFrames(self.hits, events)
+        # lock 保护本路的命中计数与轨迹；engine_lock 保护底库特征，多路共享同一把
+        self.lock = threading.Lock()
+        self.engine_lock = engine_lock or threading.Lock()
+        self._last = time.time()
+        self.snapshot = Snapshot()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def detect(self, func, frame):
+        """调用 func (检测或检测+识别)，返回 (人脸列表, 是否沿用)；
+        有门控时画面未变化则沿用上一帧的人脸"""
+        if self.gate is None:
+            return func(frame, self.det_policy), False
+        if not self.gate.check(frame):
+            return self._faces, True
+        self._faces = self.gate.detect(func, frame, self.det_policy)
+        return self._faces, False
+
+    def step(self, frame, processor=None):
+        """处理一帧，返回 (人脸列表, 特征更新)；命中计数在锁内累加"""
+        processor = processor or self.processor
+        if self.tracker:
+            faces, reused = self.detect(processor.detect, frame)
+            # 轨迹状态也会被 report() 读取，关联与识别需在锁内完成
+            with self.lock:
+                self.frames += 1
+                if reused:
+                    # 沿用的人脸只延续轨迹，不重新识别，也不做特征进化
+                    self.tracker.update(faces)
+                    updates = []
+                else:
+                    _, updates = self.tracker.recognize(
+                        frame, faces, processor, self.engine
+                    )
+                finished = self.tracker.pop_finished()
+                for sid, n in track_hits(finished).items():
+                    self.hits[sid] += n
+                if self.events is not None:
+                    self.events.tracks(self.frames, finished)
+            return faces, updates
+
+        faces, reused = self.detect(processor.get_faces, frame)
+        with self.lock:
+            self.frames += 1
+            if reused:
+                self.repeats.repeat()
+                return faces, []
+            updates = match_faces(
+                self.engine, faces, self.hits, self.events, self.frames, self.repeats
+            )
+        return faces, updates
+
+    def process(self, stamp, frame, processor=None):
+        """处理一帧、应用特征进化并发布快照 (可由外部调度线程调用)"""
+        faces, updates = self.step(frame, processor)
+        with self.engine_lock:
+            self.engine.update_student_features(updates)
+
+        now = time.time()
+        self.snapshot = Snapshot(
+            faces=faces,
+            latency=now - stamp,
+            fps=1 / max(now - self._last, 1e-6),
+            dropped=self.reader.dropped,
+        )
+        self._last = now
+
+    def _run(self):
+        while not self._stop.is_set():
+            item = self.reader.read(timeout=0.5)
+            if item is None:
+                if not self.reader.running:
+                    break
+                continue
+            self.process(*item)
+
+    def finish(self):
+        """结束仍在进行的轨迹，把它们与门控沿用的帧计入命中与事件日志 (停止时调用)"""
+        if not self.tracker:
+            with self.lock:
+                self.repeats.flush()
+            return
+        with self.lock:
+            self.tracker.finish_all()
+            finished = self.tracker.pop_finished()
+            for sid, n in track_hits(finished).items():
+                self.hits[sid] += n
+            if self.events is not None:
+                self.events.tracks(self.frames, finished)
+
+    def report(self):
+        """当前命中计数的副本 (跟踪模式下包含进行中的轨迹)"""
+        with self.lock:
+            hits = dict(self.hits)
+            if self.tracker:
+                for sid, n in self.tracker.live_hits().items():
+                    hits[sid] += n
+        return hits
+
+    def save(self):
+        """保存进化后的底库，返回保存时刻的命中计数"""
+        with self.engine_lock:
+            self.engine.save_db()
+        return self.report()
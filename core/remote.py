@@ -0,0 +1,196 @@
+import json
+import socket
+import threading
+import http.client
+import numpy as np
+import polars as pl
+from pathlib import Path
+from .config import Config
+from .engine import AttendanceEngine
+from .processor import DetSizePolicy, FaceProcessor
+from .service import pack, unpack, parse_address
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class ServiceClient:
+    """识别服务的客户端连接，每个线程各用一条长连接"""
+
+    def __init__(self, address=None, timeout=60):
+        self.address = address or Config.SERVICE_ADDRESS
+        self.family, self.addr = parse_address(self.address)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self.family == socket.AF_UNIX:
+                conn = UnixHTTPConnection(self.addr, self.timeout)
+            else:
+                conn = http.client.HTTPConnection(*self.addr, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _request(self, method, path, body=None):
+        conn = self._conn()
+        try:
+            conn.request(method, path, body=body)
+            resp = conn.getresponse()
+            data = resp.read()
+        except (ConnectionError, http.client.HTTPException, OSError):
+            # 连接断开 (如服务重启) 时丢弃连接，调用方可重试
+            conn.close()
+            self._local.conn = None
+            raise
+        if resp.status != 200:
+            raise RuntimeError(f"{path}: {data.decode(errors='replace')}")
+        return data
+
+    def get(self, path):
+        return json.loads(self._request("GET", path))
+
+    def post(self, path, meta=None, **arrays):
+        return unpack(self._request("POST", path, pack(meta, **arrays)))
+
+
+class RemoteFace:
+    """服务端返回的人脸，提供与 insightface Face 相同的常用属性"""
+
+    def __init__(self, bbox, kps, det_score, embedding=None):
+        self.bbox = bbox
+        self.kps = kps
+        self.det_score = det_score
+        self.embedding = embedding
+
+    @property
+    def normed_embedding(self):
+        if self.embedding is None:
+            return None
+        return self.embedding / np.linalg.norm(self.embedding)
+
+
+def arrays_to_faces(arrays):
+    embs = arrays.get("embeddings")
+    return [
+        RemoteFace(
+            arrays["bboxes"][i],
+            arrays["kps"][i],
+            arrays["scores"][i],
+            embs[i] if embs is not None else None,
+        )
+        for i in range(len(arrays["bboxes"]))
+    ]
+
+
+class RemoteProcessor:
+    """FaceProcessor 的瘦客户端：检测与识别由识别服务完成
+
+    检测分辨率策略保存在服务端，按 DetSizePolicy.key 区分视频源。
+    """
+
+    get_best_face = staticmethod(FaceProcessor.get_best_face)
+
+    def __init__(self, client):
+        self.client = client
+        self.det_policy = DetSizePolicy()
+
+    def _frame_request(self, path, frame, policy):
+        policy = policy or self.det_policy
+        _, arrays = self.client.post(
+            path, {"source": policy.key}, frame=np.ascontiguousarray(frame)
+        )
+        return arrays_to_faces(arrays)
+
+    def detect(self, frame, policy=None):
+        return self._frame_request("/detect", frame, policy)
+
+    def get_faces(self, frame, policy=None):
+        return self._frame_request("/get_faces", frame, policy)
+
+    def embed(self, frame, faces):
+        """为指定人脸请求特征，写入 face.embedding"""
+        if not faces:
+            return faces
+        _, arrays = self.client.post(
+            "/embed",
+            frame=np.ascontiguousarray(frame),
+            kps=np.stack([f.kps for f in faces]).astype(np.float32),
+        )
+        for face, emb in zip(faces, arrays["embeddings"]):
+            face.embedding = emb
+        return faces
+
+
+class RemoteEngine:
+    """AttendanceEngine 的瘦客户端：匹配、特征进化与保存底库都在识别服务中完成
+
+    学号与姓名在连接时从服务端读取一次，报表与姓名同步在本地进行。
+    """
+
+    def __init__(self, address=None):
+        self.client = ServiceClient(address)
+        info = self.client.get("/info")
+        self.db_path = Path(info["db_path"])
+        self.ids = info["ids"]
+        self.names = info["names"]
+        self.db = pl.DataFrame(
+            {"id": self.ids, "name": self.names},
+            schema={"id": pl.String, "name": pl.String},
+        )
+        self._processor = None
+
+    # 与 AttendanceEngine 相同，只依赖 self.db
+    sync_names = AttendanceEngine.sync_names
+
+    @property
+    def processor(self):
+        return self.ensure_processor()
+
+    def ensure_processor(self):
+        if self._processor is None:
+            self._processor = RemoteProcessor(self.client)
+        return self._processor
+
+    def processor_pool(self, size):
+        """多个推理线程各用一个客户端对象，请求在服务端合批"""
+        return [self.ensure_processor()] + [
+            RemoteProcessor(self.client) for _ in range(size - 1)
+        ]
+
+    def identify_faces(self, embeddings, margin=None):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings) == 0:
+            return [], np.zeros(0, dtype=np.float32)
+        meta, arrays = self.client.post("/identify", embeddings=embeddings)
+        return meta["ids"], arrays["scores"]
+
+    def identify_face(self, face_embedding):
+        ids, scores = self.identify_faces(np.asarray(face_embedding)[None, :])
+        if ids[0]:
+            return ids[0], scores[0]
+        return None, 0
+
+    def update_student_features(self, updates):
+        if not updates:
+            return
+        self.client.post(
+            "/update",
+            {"ids": [sid for sid, _ in updates]},
+            embeddings=np.stack([emb for _, emb in updates]).astype(np.float32),
+        )
+
+    def update_student_feature(self, stu_id, new_embedding):
+        self.update_student_features([(stu_id, new_embedding)])
+
+    def save_db(self):
+        self.client.post("/save")
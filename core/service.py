@@ -0,0 +1,297 @@
+import io
+import os
+import json
+import time
+import queue
+import socket
+import threading
+import socketserver
+from collections import OrderedDict
+import numpy as np
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler
+from .config import Config
+from .metrics import metrics
+from .processor import DetSizePolicy
+
+
+def parse_address(address):
+    """ "unix:/path/to.sock" 为 Unix 套接字，"host:port" 或 "port" 为本机 TCP"""
+    address = str(address or Config.SERVICE_ADDRESS)
+    if address.startswith("unix:"):
+        return socket.AF_UNIX, address[len("unix:") :]
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def pack(meta=None, **arrays):
+    """请求/响应体：未压缩的 npz，meta (可 JSON 序列化) 存为 __meta__ 字符串"""
+    buf = io.BytesIO()
+    np.savez(buf, __meta__=np.array(json.dumps(meta or {})), **arrays)
+    return buf.getvalue()
+
+
+def unpack(body):
+    with np.load(io.BytesIO(body), allow_pickle=False) as data:
+        arrays = {k: data[k] for k in data.files}
+    return json.loads(str(arrays.pop("__meta__"))), arrays
+
+
+def stack_embeddings(faces):
+    if not faces:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([f.embedding for f in faces]).astype(np.float32)
+
+
+def faces_to_arrays(faces, with_embedding=False):
+    """人脸列表转为响应数组 (五点关键点)"""
+    arrays = {
+        "bboxes": np.array([f.bbox for f in faces], dtype=np.float32).reshape(-1, 4),
+        "scores": np.array([f.det_score for f in faces], dtype=np.float32),
+        "kps": np.array([f.kps for f in faces], dtype=np.float32).reshape(-1, 5, 2),
+    }
+    if with_embedding:
+        arrays["embeddings"] = stack_embeddings(faces)
+    return arrays
+
+
+class MicroBatcher:
+    """把并发请求攒成小批量执行
+
+    每个请求带若干元素 (人脸裁剪图或特征)，工作线程从最早的请求开始收集，
+    凑满 max_batch 个元素或最早的请求已等待 max_wait 秒时合并执行一次 func，
+    再把结果按请求拆开。funcs 中每个函数对应一个工作线程 (如各自的 ONNX 会话)。
+    func(items) 返回与 items 等长的结果列表。
+    """
+
+    def __init__(self, funcs, max_batch, max_wait):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._q = queue.Queue()
+        self._threads = [
+            threading.Thread(target=self._run, args=(f,), daemon=True) for f in funcs
+        ]
+        for t in self._threads:
+            t.start()
+
+    def __call__(self, items):
+        if not items:
+            return []
+        return self.submit(items).result()
+
+    def submit(self, items):
+        future = Future()
+        self._q.put((list(items), future, time.perf_counter()))
+        return future
+
+    def _collect(self):
+        first = self._q.get()
+        if first is None:
+            return None
+        batch, n = [first], len(first[0])
+        deadline = first[2] + self.max_wait
+        while n < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._q.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._q.put(None)
+                break
+            batch.append(item)
+            n += len(item[0])
+        return batch
+
+    def _run(self, func):
+        while (batch := self._collect()) is not None:
+            items = [x for b in batch for x in b[0]]
+            metrics.inc("service_batches")
+            metrics.inc("service_batch_items", len(items))
+            try:
+                results = []
+                for i in range(0, len(items), self.max_batch):
+                    results += list(func(items[i : i + self.max_batch]))
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for b_items, future, _ in batch:
+                future.set_result(results[start : start + len(b_items)])
+                start += len(b_items)
+
+    def close(self):
+        for _ in self._threads:
+            self._q.put(None)
+
+
+class RecognitionService:
+    """常驻的识别服务：一套模型与底库为本机所有客户端共用
+
+    检测按请求并行，由 FaceProcessor 池限制并发；识别模型与底库匹配由 MicroBatcher
+    把不同客户端的人脸合批。检测分辨率策略按客户端给出的视频源 key 分别记忆。
+    特征进化在服务端统一应用，保存底库时所有客户端的进化一并落盘。
+    """
+
+    def __init__(self, engine, processors, max_batch=None, max_wait=None):
+        self.engine = engine
+        self.processors = processors
+        self._idle = queue.Queue()
+        for p in processors:
+            self._idle.put(p)
+        max_batch = max_batch or Config.REC_BATCH_SIZE
+        max_wait = (Config.SERVICE_MAX_WAIT_MS if max_wait is None else max_wait) / 1000
+        self.rec_batcher = MicroBatcher(
+            [lambda crops, p=p: list(p.rec_model.get_feat(crops)) for p in processors],
+            max_batch,
+            max_wait,
+        )
+        self.engine_lock = threading.Lock()
+        self.match_batcher = MicroBatcher([self._identify], max_batch, max_wait)
+        self._policies = OrderedDict()
+        self._policies_lock = threading.Lock()
+
+    def _identify(self, embs):
+        # 与 update() 的特征写入互斥，避免匹配到只更新了一半的底库矩阵
+        with self.engine_lock:
+            ids, scores = self.engine.identify_faces(np.stack(embs))
+        return list(zip(ids, scores))
+
+    def policy(self, source, keep=1024):
+        """视频源 key 对应的检测分辨率策略，没有 key 时使用共享策略；
+        只保留最近使用的 keep 个视频源"""
+        if not source:
+            return None
+        with self._policies_lock:
+            if source not in self._policies:
+                self._policies[source] = DetSizePolicy()
+                if len(self._policies) > keep:
+                    self._policies.popitem(last=False)
+            self._policies.move_to_end(source)
+            return self._policies[source]
+
+    def detect(self, frame, source=None):
+        processor = self._idle.get()
+        try:
+            return processor.detect(frame, self.policy(source))
+        finally:
+            self._idle.put(processor)
+
+    def embed(self, frame, faces):
+        """对齐在请求线程中完成，识别模型推理交给合批线程"""
+        if not faces:
+            return faces
+        crops = self.processors[0].align(frame, faces)
+        for face, feat in zip(faces, self.rec_batcher(crops)):
+            face.embedding = feat.flatten()
+        return faces
+
+    def get_faces(self, frame, source=None):
+        return self.embed(frame, self.detect(frame, source))
+
+    def identify(self, embs):
+        results = self.match_batcher(list(embs))
+        ids = [sid for sid, _ in results]
+        return ids, np.array([score for _, score in results], dtype=np.float32)
+
+    def update(self, updates):
+        with self.engine_lock:
+            self.engine.update_student_features(updates)
+
+    def save(self):
+        with self.engine_lock:
+            self.engine.save_db()
+
+    def info(self):
+        return {
+            "ids": list(self.engine.ids),
+            "names": list(self.engine.names),
+            "db_path": str(self.engine.db_path),
+        }
+
+    def handle(self, path, meta, arrays):
+        """分发一个请求，返回 (meta, arrays)"""
+        if path in ("/detect", "/get_faces"):
+            faces = getattr(self, path[1:])(arrays["frame"], meta.get("source"))
+            return {}, faces_to_arrays(faces, with_embedding=path == "/get_faces")
+        if path == "/embed":
+            from insightface.app.common import Face
+
+            faces = [Face(kps=k) for k in arrays["kps"]]
+            self.embed(arrays["frame"], faces)
+            return {}, {"embeddings": stack_embeddings(faces)}
+        if path == "/identify":
+            ids, scores = self.identify(arrays["embeddings"])
+            return {"ids": ids}, {"scores": scores}
+        if path == "/update":
+            self.update(list(zip(meta["ids"], arrays["embeddings"])))
+            return {}, {}
+        if path == "/save":
+            self.save()
+            return {}, {}
+        raise KeyError(path)
+
+    def close(self):
+        self.rec_batcher.close()
+        self.match_batcher.close()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+    # 保持长连接，客户端每个线程复用一条连接
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self, code, body, content_type="application/octet-stream"):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/info":
+            self._reply(200, json.dumps(service.info()).encode(), "application/json")
+        elif self.path == "/metrics":
+            self._reply(200, metrics.to_prometheus().encode(), "text/plain")
+        else:
+            self._reply(404, b"not found", "text/plain")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            with metrics.timer("service_request"):
+                meta, arrays = self.server.service.handle(self.path, *unpack(body))
+        except KeyError:
+            self._reply(404, b"not found", "text/plain")
+        except Exception as e:
+            self._reply(500, f"{type(e).__name__}: {e}".encode(), "text/plain")
+        else:
+            self._reply(200, pack(meta, **arrays))
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TCPServiceServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class UnixServiceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(service, address=None):
+    """在 address 上监听 (见 parse_address)，返回尚未启动的服务器"""
+    family, addr = parse_address(address)
+    if family == socket.AF_UNIX:
+        if os.path.exists(addr):
+            os.unlink(addr)
+        server = UnixServiceServer(addr, ServiceHandler)
+    else:
+        server = TCPServiceServer(addr, ServiceHandler)
+    server.service = service
+    return server
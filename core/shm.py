@@ -0,0 +1,289 @@
+import os
+import uuid
+import time
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+# 槽位状态
+FREE, WRITING, READY, READING = 0, 1, 2, 3
+# 头部字段 (int64)
+_H, _W, _C, _ALLOCATED, _WRITER_DONE, _READER_DONE, _SEQ, _DROPPED, _FAILED = range(9)
+_HEADER = 9
+# 每个槽位的字段 (int64)：状态、序号、帧号、采集时间 (float64 按位存放)
+_STATE, _SLOT_SEQ, _F_IDX, _STAMP = range(4)
+_SLOT_FIELDS = 4
+
+
+class FrameRing:
+    """共享内存中的帧环形缓冲区，用于采集进程与推理进程之间传递帧
+
+    帧数据只在采集进程中写入一次 (VideoCapture 直接解码到槽位)，读取方拿到的是
+    指向共享内存的 NumPy 视图，不经过 pickle 与队列拷贝。槽位在 release() 后复用。
+    没有空闲槽位时：drop_oldest=False 的写入方等待 (背压，适合视频文件)；
+    drop_oldest=True 时覆盖最旧的未读帧并计入 dropped (适合摄像头等直播源)。
+
+    帧尺寸由采集进程打开视频源后确定 (allocate)，控制区在创建时分配；
+    对象随 Process 参数传给子进程后自动附加到同一块共享内存。
+    """
+
+    def __init__(self, slots, drop_oldest=False, ctx=None):
+        ctx = ctx or multiprocessing.get_context("spawn")
+        self.slots = slots
+        self.drop_oldest = drop_oldest
+        self.name = f"fr_{os.getpid()}_{uuid.uuid4().hex[:12]}"
+        self.cond = ctx.Condition()
+        self._ctrl = shared_memory.SharedMemory(
+            create=True, size=8 * (_HEADER + slots * _SLOT_FIELDS)
+        )
+        self._attach_ctrl()
+        self.header[:] = 0
+        self.table[:] = 0
+        self._data = None
+        self._views = {}
+        self.owner = True
+
+    def _attach_ctrl(self):
+        arr = np.ndarray(
+            (_HEADER + self.slots * _SLOT_FIELDS,),
+            dtype=np.int64,
+            buffer=self._ctrl.buf,
+        )
+        self.header = arr[:_HEADER]
+        self.table = arr[_HEADER:].reshape(self.slots, _SLOT_FIELDS)
+
+    def __getstate__(self):
+        return {
+            "slots": self.slots,
+            "drop_oldest": self.drop_oldest,
+            "name": self.name,
+            "cond": self.cond,
+            "ctrl": self._ctrl.name,
+        }
+
+    def __setstate__(self, state):
+        self.slots = state["slots"]
+        self.drop_oldest = state["drop_oldest"]
+        self.name = state["name"]
+        self.cond = state["cond"]
+        self._ctrl = shared_memory.SharedMemory(name=state["ctrl"])
+        self._attach_ctrl()
+        self._data = None
+        self._views = {}
+        self.owner = False
+
+    # ---------- 帧数据 ----------
+
+    @property
+    def shape(self):
+        return tuple(int(x) for x in self.header[[_H, _W, _C]])
+
+    @property
+    def allocated(self):
+        return bool(self.header[_ALLOCATED])
+
+    def allocate(self, shape):
+        """写入方：按帧尺寸分配全部槽位 (只调用一次)；读取方已关闭时返回 False"""
+        shape = tuple(shape)
+        size = int(np.prod(shape)) * self.slots
+        data = shared_memory.SharedMemory(name=self.name, create=True, size=size)
+        with self.cond:
+            # 读取方在分配之前已关闭：它不会再释放这块内存，由写入方自行释放
+            if self.header[_READER_DONE]:
+                data.close()
+                data.unlink()
+                return False
+            self._data = data
+            self.header[[_H, _W, _C]] = shape
+            self.header[_ALLOCATED] = 1
+            self.cond.notify_all()
+        return True
+
+    def _ensure_data(self):
+        if self._data is None:
+            self._data = shared_memory.SharedMemory(name=self.name)
+        return self._data
+
+    def view(self, slot):
+        """槽位的零拷贝视图 (H, W, C) uint8"""
+        v = self._views.get(slot)
+        if v is None:
+            shape = self.shape
+            v = np.ndarray(
+                shape,
+                dtype=np.uint8,
+                buffer=self._ensure_data().buf,
+                offset=slot * int(np.prod(shape)),
+            )
+            self._views[slot] = v
+        return v
+
+    # ---------- 写入方 ----------
+
+    def acquire_write(self):
+        """取得一个可写槽位；读取方已关闭时返回 None"""
+        with self.cond:
+            while True:
+                if self.header[_READER_DONE]:
+                    return None
+                free = np.flatnonzero(self.table[:, _STATE] == FREE)
+                if len(free):
+                    slot = int(free[0])
+                    break
+                if self.drop_oldest:
+                    ready = np.flatnonzero(self.table[:, _STATE] == READY)
+                    if len(ready):
+                        slot = int(ready[np.argmin(self.table[ready, _SLOT_SEQ])])
+                        self.header[_DROPPED] += 1
+                        break
+                self.cond.wait(0.1)
+            self.table[slot, _STATE] = WRITING
+            return slot
+
+    def commit(self, slot, f_idx, stamp=None):
+        """槽位写完，交给读取方"""
+        with self.cond:
+            self.header[_SEQ] += 1
+            row = self.table[slot]
+            row[_SLOT_SEQ] = self.header[_SEQ]
+            row[_F_IDX] = f_idx
+            row[_STAMP:].view(np.float64)[0] = time.time() if stamp is None else stamp
+            row[_STATE] = READY
+            self.cond.notify_all()
+
+    def abort(self, slot):
+        """放弃写入 (如读帧失败)，槽位直接归还"""
+        with self.cond:
+            self.table[slot, _STATE] = FREE
+            self.cond.notify_all()
+
+    def finish(self):
+        """写入方结束：读取方取完剩余的帧后不再等待"""
+        with self.cond:
+            self.header[_WRITER_DONE] = 1
+            self.cond.notify_all()
+
+    def fail(self):
+        """写入方出错结束：与 finish 相同，并标记 failed，读取方据此区分正常结束"""
+        with self.cond:
+            self.header[_FAILED] = 1
+            self.header[_WRITER_DONE] = 1
+            self.cond.notify_all()
+
+    # ---------- 读取方 ----------
+
+    def _ready(self):
+        return np.flatnonzero(self.table[:, _STATE] == READY)
+
+    def get(self, timeout=None, latest=False):
+        """取出一帧，返回 (槽位, 帧号, 采集时间, 视图)；超时或写入方结束且无帧时返回 None
+
+        latest=True 时取最新的一帧，更旧的未读帧直接归还并计入 dropped；
+        否则按写入顺序取出。视图在 release(槽位) 之前保持有效。
+        """
+        with self.cond:
+            ok = self.cond.wait_for(
+                lambda: len(self._ready()) or self.header[_WRITER_DONE], timeout
+            )
+            ready = self._ready()
+            if not ok or not len(ready):
+                return None
+            seqs = self.table[ready, _SLOT_SEQ]
+            slot = int(ready[np.argmax(seqs) if latest else np.argmin(seqs)])
+            if latest:
+                for other in ready:
+                    if other != slot:
+                        self.table[other, _STATE] = FREE
+                        self.header[_DROPPED] += 1
+                self.cond.notify_all()
+            row = self.table[slot]
+            row[_STATE] = READING
+            f_idx = int(row[_F_IDX])
+            stamp = float(row[_STAMP:].view(np.float64)[0])
+        return slot, f_idx, stamp, self.view(slot)
+
+    def wait_newer(self, seq, timeout=None):
+        """等待写入序号超过 seq，返回最新序号；写入方结束或读取方关闭时返回 None"""
+        header = self.header
+        with self.cond:
+            self.cond.wait_for(
+                lambda: header[_SEQ] > seq
+                or header[_WRITER_DONE]
+                or header[_READER_DONE],
+                timeout,
+            )
+            if header[_SEQ] > seq and not header[_READER_DONE]:
+                return int(header[_SEQ])
+        return None
+
+    def pending(self):
+        """有未读帧时返回最新一帧的采集时间，否则返回 None"""
+        if self.header is None:
+            return None
+        with self.cond:
+            ready = self._ready()
+            if not len(ready):
+                return None
+            slot = ready[np.argmax(self.table[ready, _SLOT_SEQ])]
+            return float(self.table[slot, _STAMP:].view(np.float64)[0])
+
+    def newest(self):
+        """最近写入的一帧 (未读或正在读) 的拷贝，界面显示用"""
+        if self.header is None:
+            return None
+        with self.cond:
+            states = self.table[:, _STATE]
+            slots = np.flatnonzero((states == READY) | (states == READING))
+            if not len(slots):
+                return None
+            slot = int(slots[np.argmax(self.table[slots, _SLOT_SEQ])])
+            return self.view(slot).copy()
+
+    def release(self, slot):
+        with self.cond:
+            self.table[slot, _STATE] = FREE
+            self.cond.notify_all()
+
+    @property
+    def dropped(self):
+        return 0 if self.header is None else int(self.header[_DROPPED])
+
+    @property
+    def writer_done(self):
+        return self.header is None or bool(self.header[_WRITER_DONE])
+
+    @property
+    def failed(self):
+        return self.header is not None and bool(self.header[_FAILED])
+
+    # ---------- 释放 ----------
+
+    def cancel(self):
+        """读取方不再取帧：写入方与等待中的 wait_newer 随之退出"""
+        with self.cond:
+            self.header[_READER_DONE] = 1
+            self.cond.notify_all()
+
+    def close(self):
+        """读取方 (创建者) 关闭：通知写入方停止，并释放共享内存"""
+        if self._ctrl is None:
+            return
+        if self.owner:
+            self.cancel()
+            if self._data is None and self.header[_ALLOCATED]:
+                self._ensure_data()
+        shms = [s for s in (self._data, self._ctrl) if s is not None]
+        self._views.clear()
+        self.header = self.table = None
+        self._data = self._ctrl = None
+        for shm in shms:
+            try:
+                shm.close()
+            except BufferError:
+                # 调用方仍持有视图，内存随进程退出释放
+                pass
+            if self.owner:
+                try:
+                    shm.unlink()
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,222 @@
+import re
+import sys
+import time
+import threading
+from pathlib import Path
+from urllib.parse import urlsplit
+from .config import Config
+from .gating import MotionGate
+from .metrics import metrics
+from .realtime import RecognitionLoop
+from .video import LatestFrameReader, ProcessFrameReader
+
+
+def parse_source(source):
+    """摄像头编号转为 int，RTSP/HTTP 地址与视频文件路径保持字符串"""
+    return int(source) if str(source).isdigit() else source
+
+
+def split_source(text):
+    """命令行的视频源 -> (名称, 视频源)
+
+    "名称=视频源" 显式指定名称；否则由视频源本身得出：摄像头编号为 cam0，
+    视频文件取文件名，网络地址取主机、端口与路径 (不含账号密码)。名称用作统计表的
+    行名与考勤事件日志的视频源，同一路摄像头在不同次运行中保持一致。
+    """
+    text = str(text)
+    m = re.fullmatch(r"([\w.-]+)=(.+)", text)
+    if m:
+        return m.group(1), m.group(2)
+    if text.isdigit():
+        return f"cam{text}", text
+    url = urlsplit(text)
+    if url.scheme and url.netloc:
+        port = f":{url.port}" if url.port else ""
+        name = f"{url.hostname}{port}{url.path}_{url.query}"
+    else:
+        name = Path(text).name
+    return re.sub(r"[^\w.-]+", "_", name).strip("_") or text, text
+
+
+class Stream:
+    """一路视频源：采集线程 (或采集进程) + 独立的命中计数与跟踪状态"""
+
+    def __init__(
+        self,
+        name,
+        source,
+        engine,
+        track,
+        engine_lock,
+        events=None,
+        capture_process=False,
+        gate=None,
+        on_frame=None,
+    ):
+        self.name = name
+        reader_cls = ProcessFrameReader if capture_process else LatestFrameReader
+        self.reader = reader_cls(parse_source(source), on_frame=on_frame)
+        self.loop = RecognitionLoop(
+            engine,
+            self.reader,
+            processor=None,
+            track=track,
+            engine_lock=engine_lock,
+            events=events.source(name) if events is not None else None,
+            gate=gate,
+        )
+        self.processed = 0
+        self.errors = 0  # 处理失败的帧数
+        self.last_error = None
+        self.last_served = 0.0
+
+
+class StreamServer:
+    """多路实时考勤：所有视频源共享一个 FaceProcessor 池
+
+    每个推理线程独占池中一个 FaceProcessor，从"有新帧且未被处理"的视频源中
+    挑选最久未被服务的一路，各路轮流获得算力；同一路的帧不会被两个线程
+    同时处理，保证各路的跟踪与计数按时间顺序进行。
+    capture_process=True 时每路在独立进程中采集，帧经共享内存帧环传入。
+    gate=True 时每路各自做运动门控，roi 为座位区域 (见 MotionGate)。
+    """
+
+    def __init__(
+        self,
+        engine,
+        sources,
+        pool_size=None,
+        track=False,
+        events=None,
+        capture_process=False,
+        gate=False,
+        roi=None,
+    ):
+        self.engine = engine
+        self.engine_lock = threading.Lock()
+        self.events = events
+        # 采集端有新帧时通知，空闲的推理线程在此等待而不是轮询
+        self._cond = threading.Condition()
+        named = [split_source(src) for src in sources]
+        names = [name for name, _ in named]
+        duplicates = sorted({n for n in names if names.count(n) > 1})
+        if duplicates:
+            raise ValueError(
+                f"Duplicate stream names {duplicates}, use name=source to tell them apart."
+            )
+        self.streams = [
+            Stream(
+                name,
+                src,
+                engine,
+                track,
+                self.engine_lock,
+                events,
+                capture_process,
+                MotionGate(roi) if gate else None,
+                self._notify,
+            )
+            for name, src in named
+        ]
+        pool_size = pool_size or min(len(self.streams), Config.STREAM_POOL_SIZE)
+        self.processors = engine.processor_pool(pool_size)
+        self._busy = set()
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(target=self._worker, args=(p,), daemon=True)
+            for p in self.processors
+        ]
+
+    def start(self):
+        for t in self._threads:
+            t.start()
+        return self
+
+    @property
+    def running(self):
+        return not self._stop.is_set() and any(
+            s.reader.running or s.reader.pending() is not None for s in self.streams
+        )
+
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+
+    def _pick(self):
+        """在有新帧且无线程处理的视频源中，选出最久未被服务的一路"""
+        ready = [
+            s
+            for s in self.streams
+            if s.name not in self._busy and s.reader.pending() is not None
+        ]
+        return min(ready, key=lambda s: s.last_served, default=None)
+
+    def _worker(self, processor):
+        while not self._stop.is_set():
+            with self._cond:
+                stream = self._pick()
+                if stream is None:
+                    # 由采集端 (_notify) 或其他线程释放视频源时唤醒；超时只为检查停止标志
+                    self._cond.wait(0.5)
+                    continue
+                self._busy.add(stream.name)
+            try:
+                item = stream.reader.read(timeout=0)
+                if item is not None:
+                    stream.loop.process(*item, processor)
+                    stream.processed += 1
+            except Exception as e:
+                # 单帧出错 (解码异常、检测失败、写事件日志失败等) 不能让这一路从此无人处理
+                stream.errors += 1
+                metrics.inc("stream_errors")
+                if repr(e) != stream.last_error:
+                    print(f"[WARN] Stream {stream.name}: {e!r}", file=sys.stderr)
+                stream.last_error = repr(e)
+            finally:
+                with self._cond:
+                    stream.last_served = time.time()
+                    self._busy.discard(stream.name)
+                    self._cond.notify_all()
+
+    def stats(self):
+        """各路的处理帧率、延迟、待处理帧、丢帧数、门控跳过与处理失败的帧数"""
+        rows = []
+        for stream in self.streams:
+            snap = stream.loop.snapshot
+            rows.append(
+                {
+                    "Stream": stream.name,
+                    "FPS": round(snap.fps, 1),
+                    "Latency_ms": round(snap.latency * 1000),
+                    "Queue": int(stream.reader.pending() is not None),
+                    "Dropped": stream.reader.dropped,
+                    "Processed": stream.processed,
+                    "Skipped": stream.loop.gate.skipped if stream.loop.gate else 0,
+                    "Errors": stream.errors,
+                }
+            )
+        return rows
+
+    def report(self):
+        """{视频源名: {学生 id: 命中数}}"""
+        return {s.name: s.loop.report() for s in self.streams}
+
+    def save(self):
+        with self.engine_lock:
+            self.engine.save_db()
+        if self.events is not None:
+            self.events.flush()
+        return self.report()
+
+    def stop(self):
+        self._stop.set()
+        self._notify()
+        for t in self._threads:
+            t.join()
+        for stream in self.streams:
+            stream.reader.release()
+            stream.loop.finish()
+            if stream.loop.events is not None:
+                stream.loop.events.done()
+        if self.events is not None:
+            self.events.close()
@@ -0,0 +1,189 @@
+import numpy as np
+from collections import Counter
+from .config import Config
+
+
+def iou_matrix(a, b):
+    """两组 [x1, y1, x2, y2] 框之间的 IoU 矩阵 (len(a), len(b))"""
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-6)
+
+
+def face_quality(face):
+    """轨迹内比较用的质量分：检测置信度 * 人脸边长"""
+    w, h = face.bbox[2] - face.bbox[0], face.bbox[3] - face.bbox[1]
+    return float(face.det_score) * float(np.sqrt(max(w * h, 0)))
+
+
+class Track:
+    """一条人脸轨迹：匀速模型预测位置，按识别结果投票决定身份"""
+
+    # alpha-beta 滤波增益 (固定增益的简化卡尔曼滤波)
+    ALPHA, BETA = 0.7, 0.3
+
+    def __init__(self, track_id, face):
+        self.id = track_id
+        self.bbox = np.asarray(face.bbox, dtype=np.float32).copy()
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.frames = 1  # 被观测到的帧数
+        self.misses = 0  # 连续丢失的帧数
+        self.since_embed = 0  # 距上次识别经过的帧数
+        self.best_quality = 0.0
+        self.n_embeds = 0
+        self.votes = Counter()  # {id: 累计相似度}
+        self.vote_counts = Counter()  # {id: 投票次数}
+
+    def predict(self):
+        return self.bbox + self.velocity * (self.misses + 1)
+
+    def observe(self, face):
+        pred = self.predict()
+        residual = np.asarray(face.bbox, dtype=np.float32) - pred
+        self.bbox = pred + self.ALPHA * residual
+        self.velocity += self.BETA * residual / (self.misses + 1)
+        self.frames += 1
+        self.misses = 0
+        self.since_embed += 1
+
+    def needs_embedding(self, face):
+        """新轨迹、质量明显提升或到达刷新间隔时才重新运行识别模型"""
+        if self.n_embeds == 0:
+            return True
+        if face_quality(face) > self.best_quality * (1 + Config.TRACK_QUALITY_GAIN):
+            return True
+        return self.since_embed >= Config.TRACK_REFRESH
+
+    def record(self, face, sid, score):
+        self.since_embed = 0
+        self.n_embeds += 1
+        self.best_quality = max(self.best_quality, face_quality(face))
+        if sid:
+            self.votes[sid] += float(score)
+            self.vote_counts[sid] += 1
+
+    @property
+    def sid(self):
+        """按累计相似度投票得到的身份，尚无识别结果时为 None"""
+        if not self.votes:
+            return None
+        return self.votes.most_common(1)[0][0]
+
+    @property
+    def score(self):
+        """投票身份的平均相似度"""
+        sid = self.sid
+        return self.votes[sid] / self.vote_counts[sid] if sid else 0.0
+
+
+def track_hits(tracks):
+    """轨迹按身份计数：{id: 帧数}"""
+    hits = Counter()
+    for track in tracks:
+        if track.sid:
+            hits[track.sid] += track.frames
+    return hits
+
+
+class FaceTracker:
+    """基于 IoU 关联的多目标人脸跟踪
+
+    同一个人在轨迹存续期间只在必要时重新识别；考勤按轨迹计数：
+    轨迹结束时，其被观测到的帧数整体记到投票得出的身份上。
+    """
+
+    def __init__(self):
+        self.tracks = []
+        self.finished = []
+        self._next_id = 0
+        self.n_detections = 0  # 检测到的人脸数
+        self.n_embeddings = 0  # 实际运行识别模型的次数
+
+    def update(self, faces):
+        """将本帧检测结果关联到已有轨迹，返回与 faces 一一对应的轨迹"""
+        self.n_detections += len(faces)
+        assigned = [None] * len(faces)
+        if self.tracks and faces:
+            preds = np.stack([t.predict() for t in self.tracks])
+            ious = iou_matrix(preds, [f.bbox for f in faces])
+            # 贪心匹配：按 IoU 从高到低依次配对
+            order = np.argsort(-ious, axis=None)
+            used = set()
+            for t_i, f_i in zip(*np.unravel_index(order, ious.shape)):
+                if ious[t_i, f_i] < Config.TRACK_IOU_THRES:
+                    break
+                if assigned[f_i] is None and t_i not in used:
+                    used.add(t_i)
+                    assigned[f_i] = self.tracks[t_i]
+                    self.tracks[t_i].observe(faces[f_i])
+
+        matched = {id(t) for t in assigned if t is not None}
+        alive = []
+        for track in self.tracks:
+            if id(track) not in matched:
+                track.misses += 1
+                track.since_embed += 1
+                if track.misses > Config.TRACK_MAX_MISSES:
+                    self.finished.append(track)
+                    continue
+            alive.append(track)
+        self.tracks = alive
+
+        for f_i, face in enumerate(faces):
+            if assigned[f_i] is None:
+                assigned[f_i] = Track(self._next_id, face)
+                self._next_id += 1
+                self.tracks.append(assigned[f_i])
+        return assigned
+
+    def recognize(self, frame, faces, processor, engine):
+        """关联轨迹 -> 只对需要的人脸运行识别模型 -> 按轨迹投票
+
+        返回 (与 faces 对应的轨迹, 可用于特征进化的 [(id, 特征)])
+        """
+        tracks = self.update(faces)
+        todo = [i for i, t in enumerate(tracks) if t.needs_embedding(faces[i])]
+        if not todo:
+            return tracks, []
+
+        processor.embed(frame, [faces[i] for i in todo])
+        self.n_embeddings += len(todo)
+        embs = np.stack([faces[i].normed_embedding for i in todo])
+        sids, scores = engine.identify_faces(embs)
+        updates = []
+        for i, sid, score, emb in zip(todo, sids, scores, embs):
+            tracks[i].record(faces[i], sid, score)
+            if sid and score > Config.QUALITY_SCORE_THRES:
+                updates.append((sid, emb))
+        return tracks, updates
+
+    def pop_finished(self):
+        """取出已结束且识别出身份的轨迹"""
+        tracks = [t for t in self.finished if t.sid]
+        self.finished = []
+        return tracks
+
+    def pop_finished_hits(self):
+        """取出已结束轨迹的计数：{id: 帧数}"""
+        return track_hits(self.pop_finished())
+
+    def live_hits(self):
+        """仍在跟踪中的轨迹按当前身份的计数 (实时界面展示用)"""
+        return track_hits(self.tracks)
+
+    def finish_all(self):
+        """结束所有进行中的轨迹 (视频结束时调用)"""
+        self.finished.extend(self.tracks)
+        self.tracks = []
+
+    def flush(self):
+        """结束所有轨迹，返回全部未取出的计数"""
+        self.finish_all()
+        return self.pop_finished_hits()
@@ -1,33 +1,150 @@
+import os
+import sys
 import cv2
 import numpy as np
+from contextlib import contextmanager
+from .metrics import timed
+
+
+@contextmanager
+def silence_stdout():
+    """屏蔽 insightface 加载模型时的大量输出"""
+    original_stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        yield
+    finally:
+        sys.stdout.close()
+        sys.stdout = original_stdout
 
 
 def get_face_quality(face, frame) -> float:
     """评估人脸质量: 置信度 * 清晰度 * 尺寸"""
-    bbox = face.bbox.astype(int)
+    return float(get_faces_quality([face], frame)[0])
+
+
+@timed("quality")
+def get_faces_quality(faces, frame, pose=False):
+    """批量评估一帧中所有人脸的质量，结果与逐个裁剪人脸计算 Laplacian 方差相同
+
+    整帧只转换一次灰度，不再为每张脸单独裁剪、转换并做 float64 Laplacian；
+    人脸密集时改用积分图求出每个框内的方差，开销随画面面积而非人脸数增长。
+    积分图只用于框内部的像素，框最外一圈按裁剪图的边界 (镜像) 单独计算，
+    与逐框裁剪的结果一致，auto_crop 选出的最佳抓拍不受计算方式影响。
+    pose=True 时再乘以由五点关键点估计的正脸程度 (见 get_pose_factor)。
+    """
+    if not faces:
+        return np.zeros(0, dtype=np.float64)
     h_f, w_f = frame.shape[:2]
+    boxes = np.array([face.bbox for face in faces]).astype(int)
+    det_scores = np.array([face.det_score for face in faces], dtype=np.float64)
+    x1 = np.clip(boxes[:, 0], 0, w_f)
+    y1 = np.clip(boxes[:, 1], 0, h_f)
+    x2 = np.clip(boxes[:, 2], 0, w_f)
+    y2 = np.clip(boxes[:, 3], 0, h_f)
+    n_pixels = np.maximum(x2 - x1, 0) * np.maximum(y2 - y1, 0)
+
+    # 清晰度 (Laplacian 方差)：所有框的外接区域只转一次灰度；
+    # 框的总面积小于外接区域时逐框计算，否则整块做一次 Laplacian 再用积分图取各框方差，
+    # 两种方式取开销较小者，总开销不超过外接区域的面积
+    sharpness = np.zeros(len(faces))
+    valid = np.flatnonzero(n_pixels > 0)
+    if len(valid):
+        rx1, ry1 = x1[valid].min(), y1[valid].min()
+        rx2, ry2 = x2[valid].max(), y2[valid].max()
+        gray = cv2.cvtColor(frame[ry1:ry2, rx1:rx2], cv2.COLOR_BGR2GRAY)
+        ax1, ay1, ax2, ay2 = x1 - rx1, y1 - ry1, x2 - rx1, y2 - ry1
+        small = (x2 - x1 < 3) | (y2 - y1 < 3)
+        if n_pixels.sum() < gray.size:
+            per_box = valid
+        else:
+            per_box = valid[small[valid]]
+            lap = cv2.Laplacian(gray, cv2.CV_16S).astype(np.float32)
+            s = cv2.integral(lap, sdepth=cv2.CV_64F)
+            sq = cv2.integral(lap * lap, sdepth=cv2.CV_64F)
+
+            # 框内部 (去掉最外一圈) 的像素，其 3x3 邻域都在框内，与裁剪后计算相同
+            def box_sum(t):
+                return (
+                    t[ay2 - 1, ax2 - 1]
+                    - t[ay1 + 1, ax2 - 1]
+                    - t[ay2 - 1, ax1 + 1]
+                    + t[ay1 + 1, ax1 + 1]
+                )
+
+            sums, sq_sums = box_sum(s), box_sum(sq)
+            for i in valid[~small[valid]]:
+                ring = _border_laplacian(gray[ay1[i] : ay2[i], ax1[i] : ax2[i]])
+                mean = (sums[i] + ring.sum()) / n_pixels[i]
+                sharpness[i] = max(
+                    (sq_sums[i] + ring @ ring) / n_pixels[i] - mean**2, 0
+                )
+        for i in per_box:
+            # 8 位灰度的 Laplacian 取值范围在 int16 内，无需 float64
+            lap = cv2.Laplacian(gray[ay1[i] : ay2[i], ax1[i] : ax2[i]], cv2.CV_16S)
+            sharpness[i] = cv2.meanStdDev(lap)[1][0, 0] ** 2
+
+    # 尺寸权重
+    face_size = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) / 1000
+    quality = det_scores * sharpness * face_size
+    if pose:
+        quality *= get_pose_factor(faces)
 
     # 边缘完整性检查
-    if bbox[0] <= 2 or bbox[1] <= 2 or bbox[2] >= w_f - 2 or bbox[3] >= h_f - 2:
-        return 0.01
-
-    x1, y1, x2, y2 = (
-        max(0, bbox[0]),
-        max(0, bbox[1]),
-        min(w_f, bbox[2]),
-        min(h_f, bbox[3]),
+    at_edge = (
+        (boxes[:, 0] <= 2)
+        | (boxes[:, 1] <= 2)
+        | (boxes[:, 2] >= w_f - 2)
+        | (boxes[:, 3] >= h_f - 2)
     )
-    face_img = frame[y1:y2, x1:x2]
-    if face_img.size == 0:
-        return 0
+    return np.where(at_edge, 0.01, quality)
 
-    # 清晰度 (Laplacian)
-    gray_face = cv2.cvtColor(face_img, cv2.COLOR_BGR2GRAY)
-    sharpness = cv2.Laplacian(gray_face, cv2.CV_64F).var()
 
-    # 尺寸权重
-    face_size = (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) / 1000
-    return face.det_score * sharpness * face_size
+def _border_laplacian(crop):
+    """裁剪图最外一圈像素的 Laplacian (裁剪图边界按 cv2 默认的镜像处理)
+
+    只取两行/两列宽的条带计算：条带外侧的镜像与整幅裁剪图相同，
+    需要的那一行/列的结果因此与对整幅裁剪图做 Laplacian 一致
+    """
+    return np.concatenate(
+        [
+            cv2.Laplacian(crop[:2], cv2.CV_16S)[0],
+            cv2.Laplacian(crop[-2:], cv2.CV_16S)[-1],
+            cv2.Laplacian(crop[:, :2], cv2.CV_16S)[1:-1, 0],
+            cv2.Laplacian(crop[:, -2:], cv2.CV_16S)[1:-1, -1],
+        ]
+    ).astype(np.float64)
+
+
+def get_pose_factor(faces):
+    """由五点关键点估计正脸程度，1 为正脸，侧脸或抬头/低头时减小
+
+    在以两眼连线为横轴的坐标系中计算 (与画面内的旋转无关)：
+    偏航看鼻尖偏离双眼与嘴角中线的程度，俯仰看鼻尖在眼与嘴之间的相对高度。
+    没有关键点的人脸取 1。
+    """
+    factor = np.ones(len(faces))
+    has_kps = [i for i, face in enumerate(faces) if face.kps is not None]
+    if not has_kps:
+        return factor
+    kps = np.stack([faces[i].kps for i in has_kps]).astype(np.float64)
+    eye_l, eye_r, nose = kps[:, 0], kps[:, 1], kps[:, 2]
+    eye_mid = (eye_l + eye_r) / 2
+    mouth_mid = (kps[:, 3] + kps[:, 4]) / 2
+    axis = eye_r - eye_l
+    eye_dist = np.maximum(np.linalg.norm(axis, axis=1), 1e-6)
+    ux = axis / eye_dist[:, None]
+    uy = np.stack([-ux[:, 1], ux[:, 0]], axis=1)
+
+    nose_rel, mouth_rel = nose - eye_mid, mouth_mid - eye_mid
+    yaw = (np.sum(nose_rel * ux, 1) - np.sum(mouth_rel * ux, 1) / 2) / eye_dist
+    mouth_h = np.sum(mouth_rel * uy, 1)
+    pitch = np.sum(nose_rel * uy, 1) / np.where(np.abs(mouth_h) > 1e-6, mouth_h, 1e-6)
+    # 正脸时鼻尖约在眼与嘴之间 55% 的高度
+    factor[has_kps] = np.clip(1 - 2 * np.abs(yaw), 0, 1) * np.clip(
+        1 - 2 * np.abs(pitch - 0.55), 0, 1
+    )
+    return factor
 
 
 def correct_frame_rotation(frame, cap_width, cap_height):
@@ -0,0 +1,360 @@
+import time
+import threading
+import multiprocessing
+from collections import deque
+import cv2
+import numpy as np
+from pathlib import Path
+from .config import Config
+from .metrics import metrics
+from .shm import FrameRing
+
+
+class FrameSampler:
+    """按目标采样率 (帧/秒) 读取视频帧
+
+    跳过的帧只调用 grab() 推进解码器，不做颜色转换和内存拷贝；
+    采样间隔很大时改用按帧号 seek，由解码器从最近的关键帧开始解码。
+    """
+
+    def __init__(self, source, sample_fps, seek=None):
+        self.cap = cv2.VideoCapture(str(source))
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        self.width = self.cap.get(cv2.CAP_PROP_FRAME_WIDTH)
+        self.height = self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.step = max(1, int(self.fps / sample_fps))
+        if seek is None:
+            seek = self.step >= Config.SEEK_MIN_STEP
+        # 帧数未知 (如直播流) 时无法 seek
+        self.seek = seek and self.frame_count > 0
+
+    def __iter__(self):
+        """产出 (f_idx, frame)，f_idx 为原视频中的帧号"""
+        return self._iter_seek() if self.seek else self._iter_grab()
+
+    def _iter_grab(self):
+        f_idx = 0
+        # decode 记录的是取得一个采样帧的耗时，包含其间跳过的帧
+        start = time.perf_counter()
+        while self.cap.isOpened():
+            if not self.cap.grab():
+                break
+            if f_idx % self.step == 0:
+                ret, frame = self.cap.retrieve()
+                if not ret:
+                    break
+                metrics.observe("decode", time.perf_counter() - start)
+                metrics.inc("frames")
+                yield f_idx, frame
+                start = time.perf_counter()
+            f_idx += 1
+
+    def _iter_seek(self):
+        for f_idx in range(0, self.frame_count, self.step):
+            start = time.perf_counter()
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, f_idx)
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            metrics.observe("decode", time.perf_counter() - start)
+            metrics.inc("frames")
+            yield f_idx, frame
+
+    def release(self):
+        self.cap.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class LatestFrameReader:
+    """采集线程：持续读取摄像头，只保留最新一帧
+
+    推理跟不上采集速度时，旧帧直接被覆盖丢弃而不是排队，端到端延迟因此有上界。
+    on_frame: 有新帧或视频源结束时在采集线程中调用，供调度方等待而不是轮询
+    """
+
+    def __init__(self, source, pace=None, on_frame=None):
+        self.cap = cv2.VideoCapture(source)
+        self.on_frame = on_frame
+        # 视频文件按原始帧率读取以模拟摄像头，否则会瞬间读完
+        if pace is None:
+            pace = isinstance(source, str) and Path(source).is_file()
+        self.interval = 1 / (self.cap.get(cv2.CAP_PROP_FPS) or 30) if pace else 0
+        self.dropped = 0  # 未被处理就被覆盖的帧数
+        self.running = True
+        self._cond = threading.Condition()
+        self._frame = None
+        self._stamp = 0.0
+        self._seq = 0
+        self._consumed = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        next_time = time.time()
+        while self.running and self.cap.isOpened():
+            if self.interval:
+                next_time += self.interval
+                time.sleep(max(0, next_time - time.time()))
+            start = time.perf_counter()
+            ret, frame = self.cap.read()
+            if not ret:
+                break
+            metrics.observe("capture", time.perf_counter() - start)
+            metrics.inc("frames")
+            with self._cond:
+                if self._seq > self._consumed:
+                    self.dropped += 1
+                    metrics.inc("frames_dropped")
+                self._frame, self._stamp = frame, time.time()
+                self._seq += 1
+                self._cond.notify_all()
+            if self.on_frame:
+                self.on_frame()
+        with self._cond:
+            self.running = False
+            self._cond.notify_all()
+        if self.on_frame:
+            self.on_frame()
+
+    def read(self, timeout=None):
+        """等待一帧尚未取走的新帧，返回 (采集时间, frame)；超时或源结束时返回 None"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: self._seq > self._consumed or not self.running, timeout
+            )
+            if self._seq == self._consumed:
+                return None
+            self._consumed = self._seq
+            return self._stamp, self._frame
+
+    def pending(self):
+        """有尚未取走的新帧时返回其采集时间，否则返回 None"""
+        with self._cond:
+            return self._stamp if self._seq > self._consumed else None
+
+    def latest(self):
+        """不消费地查看最新一帧 (界面显示用)"""
+        with self._cond:
+            return self._frame
+
+    def release(self):
+        self.running = False
+        self._thread.join()
+        self.cap.release()
+
+
+def _write_frame(ring, f_idx, frame):
+    """把一帧拷入帧环 (首帧时按其尺寸分配槽位)；读取方已关闭时返回 False"""
+    if not ring.allocated and not ring.allocate(frame.shape):
+        return False
+    slot = ring.acquire_write()
+    if slot is None:
+        return False
+    view = ring.view(slot)
+    if frame.shape != view.shape:
+        ring.abort(slot)
+        return True
+    view[:] = frame
+    ring.commit(slot, f_idx)
+    return True
+
+
+def _capture_main(ring, source, sample_fps=None, pace=False):
+    """采集进程入口：把帧写入共享内存帧环
+
+    sample_fps 给出时按 FrameSampler 采样视频文件，帧环满时等待 (背压)；
+    否则持续读取实时源，首帧之后直接解码到槽位中，帧环满时覆盖最旧的未读帧。
+    出错时在帧环上标记 failed，读取方不会把截断的结果当作完整的视频。
+    """
+    try:
+        if sample_fps is not None:
+            with FrameSampler(source, sample_fps) as sampler:
+                for f_idx, frame in sampler:
+                    if not _write_frame(ring, f_idx, frame):
+                        break
+            return
+
+        cap = cv2.VideoCapture(source)
+        interval = 1 / (cap.get(cv2.CAP_PROP_FPS) or 30) if pace else 0
+        next_time = time.time()
+        f_idx = 0
+        while cap.isOpened():
+            if interval:
+                next_time += interval
+                time.sleep(max(0, next_time - time.time()))
+            if not ring.allocated:
+                ret, frame = cap.read()
+                if not ret or not _write_frame(ring, f_idx, frame):
+                    break
+                f_idx += 1
+                continue
+            slot = ring.acquire_write()
+            if slot is None:
+                break
+            view = ring.view(slot)
+            ret, frame = cap.read(view)
+            if not ret:
+                ring.abort(slot)
+                break
+            if not np.shares_memory(frame, view):
+                # 解码器没有复用传入的缓冲区，退回一次拷贝；分辨率变化的帧丢弃
+                if frame.shape != view.shape:
+                    ring.abort(slot)
+                    continue
+                view[:] = frame
+            ring.commit(slot, f_idx)
+            f_idx += 1
+        cap.release()
+    except Exception:
+        ring.fail()
+        raise
+    finally:
+        ring.finish()
+        ring.close()
+
+
+class ProcessFrameSampler:
+    """FrameSampler 的独立进程版本：解码在采集进程中进行，经共享内存帧环传帧
+
+    解码不再与推理线程争用 GIL。产出的 frame 是共享内存上的视图 (零拷贝)，
+    在其后又产出 hold 帧之前保持有效，之后槽位被复用；调用方需要更久地持有
+    某一帧时应自行 copy()。解码最多领先消费方 Config.SHM_PREFETCH 帧，
+    帧环满时采集进程等待，不会丢帧。采集进程出错或异常退出时迭代抛出 RuntimeError。
+    """
+
+    def __init__(self, source, sample_fps, hold=0, prefetch=None):
+        prefetch = prefetch or Config.SHM_PREFETCH
+        self.source = source
+        self.hold = hold
+        self.ring = FrameRing(hold + 1 + prefetch)
+        self.process = multiprocessing.get_context("spawn").Process(
+            target=_capture_main,
+            args=(self.ring, str(source), sample_fps),
+            daemon=True,
+        )
+        self.process.start()
+
+    def __iter__(self):
+        """产出 (f_idx, frame)，与 FrameSampler 相同"""
+        held = deque()
+        # decode 记录的是等待采集进程给出下一帧的时间，即未被预取掩盖的解码耗时
+        start = time.perf_counter()
+        while True:
+            done = self.ring.writer_done
+            item = self.ring.get(timeout=0.5)
+            if item is None:
+                if self.ring.failed:
+                    raise RuntimeError(f"Capture process failed on {self.source}")
+                if done:
+                    break
+                # 采集进程没有结束帧环就退出了 (如被系统杀掉)
+                if not self.process.is_alive() and not self.ring.writer_done:
+                    raise RuntimeError(f"Capture process exited on {self.source}")
+                continue
+            slot, f_idx, _, frame = item
+            metrics.observe("decode", time.perf_counter() - start)
+            metrics.inc("frames")
+            held.append(slot)
+            yield f_idx, frame
+            while len(held) > self.hold:
+                self.ring.release(held.popleft())
+            start = time.perf_counter()
+
+    def release(self):
+        self.ring.close()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ProcessFrameReader:
+    """LatestFrameReader 的独立进程版本：采集进程持续读取实时源写入共享内存帧环
+
+    推理跟不上时采集进程覆盖最旧的未读帧，read() 只取最新一帧，更旧的帧计入丢帧。
+    read() 返回的 frame 是共享内存上的视图，在下一次 read() 或 release() 之前有效。
+    on_frame: 同 LatestFrameReader，由本进程的监视线程在帧环有新帧时调用
+    """
+
+    def __init__(self, source, pace=None, slots=None, on_frame=None):
+        if pace is None:
+            pace = isinstance(source, str) and Path(source).is_file()
+        self.ring = FrameRing(slots or Config.SHM_LIVE_SLOTS, drop_oldest=True)
+        self.process = multiprocessing.get_context("spawn").Process(
+            target=_capture_main,
+            args=(self.ring, source, None, pace),
+            daemon=True,
+        )
+        self.process.start()
+        self._lock = threading.Lock()
+        self._held = None
+        self._dropped = 0
+        self.on_frame = on_frame
+        self._watcher = None
+        if on_frame:
+            self._watcher = threading.Thread(target=self._watch, daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        seq = 0
+        while True:
+            seq = self.ring.wait_newer(seq)
+            if seq is None:
+                break
+            self.on_frame()
+        self.on_frame()
+
+    @property
+    def running(self):
+        return not self.ring.writer_done and self.process.is_alive()
+
+    @property
+    def dropped(self):
+        """未被处理就被覆盖的帧数 (帧环关闭后保留最后一次读取时的值)"""
+        return max(self._dropped, self.ring.dropped)
+
+    def read(self, timeout=None):
+        """等待一帧尚未取走的新帧，返回 (采集时间, frame)；超时或源结束时返回 None"""
+        with self._lock:
+            if self._held is not None:
+                self.ring.release(self._held)
+                self._held = None
+            item = self.ring.get(timeout, latest=True)
+            dropped = self.ring.dropped
+            metrics.inc("frames_dropped", dropped - self._dropped)
+            metrics.inc("frames", dropped - self._dropped + (item is not None))
+            self._dropped = dropped
+            if item is None:
+                return None
+            slot, _, stamp, frame = item
+            self._held = slot
+            return stamp, frame
+
+    def pending(self):
+        """有尚未取走的新帧时返回其采集时间，否则返回 None"""
+        return self.ring.pending()
+
+    def latest(self):
+        """最新一帧的拷贝 (界面显示用)"""
+        return self.ring.newest()
+
+    def release(self):
+        self.ring.cancel()
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.terminate()
+        if self._watcher is not None:
+            self._watcher.join()
+        with self._lock:
+            self.ring.close()
@@ -0,0 +1,320 @@
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import cv2
+import numpy as np
+import polars as pl
+from pathlib import Path
+from core.config import Config
+from core.models import int8_path_for
+from core.tracker import iou_matrix
+from core.utils import silence_stdout
+from register import FACES_PATH, IMAGE_EXTS, align_best_face, embed_crops
+
+# ================= 全局配置 =================
+CALIB_IMAGES = 64  # 用于校准与精度检查的照片数 (取自 faces/)
+CALIB_FRAMES = 32  # 额外用于检测校准与对比的课堂视频帧数 (取自 videos/)，0 为不用
+CALIB_FPS = 0.2  # 从视频中抽取校准帧的采样率
+BENCH_ROUNDS = 3  # 测速时重复的轮数
+BOX_IOU = 0.5  # 检测对比时两个框视为同一张人脸的最小 IoU
+# ============================================
+
+
+class BlobReader:
+    """静态量化的校准数据：逐个产出模型输入"""
+
+    def __init__(self, input_name, blobs):
+        self.input_name = input_name
+        self._blobs = iter(blobs)
+
+    def get_next(self):
+        blob = next(self._blobs, None)
+        return None if blob is None else {self.input_name: blob}
+
+
+def det_blob(det_model, img, size):
+    """与 RetinaFace.detect 相同的预处理：等比缩放、右下补零、归一化"""
+    h, w = img.shape[:2]
+    if h / w > size[1] / size[0]:
+        new_h, new_w = size[1], int(size[1] * w / h)
+    else:
+        new_w, new_h = size[0], int(size[0] * h / w)
+    det_img = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+    det_img[:new_h, :new_w] = cv2.resize(img, (new_w, new_h))
+    mean = det_model.input_mean
+    return cv2.dnn.blobFromImage(
+        det_img, 1.0 / det_model.input_std, size, (mean, mean, mean), swapRB=True
+    )
+
+
+def rec_blob(rec_model, crops):
+    """与 ArcFaceONNX.get_feat 相同的预处理"""
+    mean = rec_model.input_mean
+    return cv2.dnn.blobFromImages(
+        crops,
+        1.0 / rec_model.input_std,
+        rec_model.input_size,
+        (mean, mean, mean),
+        swapRB=True,
+    )
+
+
+def load_fixtures(processor, limit):
+    """取 faces/ 下的前 limit 张照片，返回 (原图列表, 对齐后的人脸列表)"""
+    paths = sorted(p for ext in IMAGE_EXTS for p in FACES_PATH.glob(f"*/{ext}"))
+    images, crops = [], []
+    for p in paths[:limit]:
+        img = cv2.imread(str(p))
+        crop = align_best_face(processor, p)
+        if img is not None and crop is not None:
+            images.append(img)
+            crops.append(crop)
+    return images, crops
+
+
+def load_frames(limit):
+    """从 videos/ 中按 CALIB_FPS 抽取至多 limit 帧：检测模型实际处理的是整幅课堂画面，
+    只用裁切好的证件照校准会低估小人脸场景下的激活范围"""
+    from core.video import FrameSampler
+
+    frames = []
+    for v_p in sorted(Path("videos").glob("*.mp4")):
+        with FrameSampler(v_p, CALIB_FPS) as sampler:
+            for _, frame in sampler:
+                if len(frames) >= limit:
+                    return frames
+                frames.append(frame)
+    return frames
+
+
+def quantize(model_file, out_path, reader=None):
+    """有校准数据时做静态量化 (QDQ，按通道量化权重)，失败或没有数据时退回动态量化"""
+    from onnxruntime.quantization import (
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp())
+    try:
+        if reader is not None:
+            try:
+                # 量化前先做形状推断与图优化，量化结果更稳定
+                prepared = tmp_dir / "prepared.onnx"
+                quant_pre_process(str(model_file), str(prepared))
+                quantize_static(
+                    str(prepared),
+                    str(out_path),
+                    reader,
+                    quant_format=QuantFormat.QDQ,
+                    per_channel=True,
+                    weight_type=QuantType.QInt8,
+                    activation_type=QuantType.QUInt8,
+                )
+                return "static"
+            except Exception as e:
+                print(f"[WARN] Static quantization failed ({e}), using dynamic.")
+        quantize_dynamic(str(model_file), str(out_path), weight_type=QuantType.QUInt8)
+        return "dynamic"
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def load_processor(int8):
+    from core.processor import FaceProcessor
+
+    Config.USE_INT8 = int8
+    with silence_stdout():
+        return FaceProcessor()
+
+
+def time_ms(func, rounds):
+    """func 的最短耗时 (毫秒)，第一次调用作为预热不计"""
+    func()
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def match_boxes(a, b):
+    """两组检测框按 IoU 从高到低贪心配对，返回配对成功 (IoU >= BOX_IOU) 的 IoU 列表"""
+    if not len(a) or not len(b):
+        return []
+    ious = iou_matrix(a, b)
+    used_a, used_b, matched = set(), set(), []
+    for i, j in zip(*np.unravel_index(np.argsort(-ious, axis=None), ious.shape)):
+        if ious[i, j] < BOX_IOU:
+            break
+        if i not in used_a and j not in used_b:
+            used_a.add(i)
+            used_b.add(j)
+            matched.append(float(ious[i, j]))
+    return matched
+
+
+def compare_boxes(fp32, int8, frames):
+    """在每一档检测分辨率上比较两个模型的检测框：人脸数、配对数与配对框的平均 IoU"""
+    rows = []
+    for w, h in Config.DET_SIZES:
+        matched, n_fp32, n_int8 = [], 0, 0
+        for frame in frames:
+            a = [f.bbox for f in fp32.detect_at(frame, (w, h))]
+            b = [f.bbox for f in int8.detect_at(frame, (w, h))]
+            matched += match_boxes(a, b)
+            n_fp32 += len(a)
+            n_int8 += len(b)
+        rows.append(
+            {
+                "Det_size": f"{w}x{h}",
+                "Faces_fp32": n_fp32,
+                "Faces_int8": n_int8,
+                "Matched": len(matched),
+                # 两个模型都没有检出人脸时视为一致
+                "Agreement": (
+                    round(len(matched) / max(n_fp32, n_int8), 3)
+                    if n_fp32 or n_int8
+                    else 1.0
+                ),
+                "Mean_IoU": round(float(np.mean(matched)) if matched else 1.0, 3),
+            }
+        )
+    return rows
+
+
+def check(fp32, int8, frames, crops):
+    """比较浮点与 INT8 模型的特征漂移、检测结果与速度，返回是否通过
+
+    特征漂移的 p95 不超过 INT8_MAX_DRIFT，且在课堂视频帧 (frames) 上 DET_SIZES 的
+    每一档检测框的配对比例与平均 IoU 不低于 INT8_MIN_DET_AGREEMENT / INT8_MIN_DET_IOU
+    """
+    sims = np.sum(embed_crops(fp32, crops) * embed_crops(int8, crops), axis=1)
+    drift = 1 - sims
+    det_rows = compare_boxes(fp32, int8, frames)
+    size = Config.DET_SIZES[0]
+
+    def run_det(p):
+        return lambda: [p.detect_at(frame, size) for frame in frames]
+
+    def run_rec(p):
+        return lambda: embed_crops(p, crops)
+
+    rows = []
+    for name, p in (("fp32", fp32), ("int8", int8)):
+        det_ms = time_ms(run_det(p), BENCH_ROUNDS) / len(frames)
+        rec_ms = time_ms(run_rec(p), BENCH_ROUNDS) / len(crops)
+        rows.append(
+            {
+                "Model": name,
+                "Det_ms": round(det_ms, 2),
+                "Rec_ms/face": round(rec_ms, 2),
+                "Det_FPS": round(1000 / det_ms, 1),
+            }
+        )
+
+    p95 = float(np.percentile(drift, 95))
+    print(f"[CHECK] {len(crops)} faces | cosine drift mean {drift.mean():.4f}")
+    print(f"[CHECK] p95 {p95:.4f} | max {drift.max():.4f}")
+    with pl.Config(tbl_rows=-1, tbl_cols=-1):
+        print(pl.DataFrame(det_rows))
+        print(pl.DataFrame(rows))
+    bad_sizes = [
+        r["Det_size"]
+        for r in det_rows
+        if r["Agreement"] < Config.INT8_MIN_DET_AGREEMENT
+        or r["Mean_IoU"] < Config.INT8_MIN_DET_IOU
+    ]
+    if p95 > Config.INT8_MAX_DRIFT:
+        print(f"[FAIL] p95 drift exceeds {Config.INT8_MAX_DRIFT}, keep float models.")
+    if bad_sizes:
+        print(
+            f"[FAIL] Detection agreement < {Config.INT8_MIN_DET_AGREEMENT} or "
+            f"mean IoU < {Config.INT8_MIN_DET_IOU} at {', '.join(bad_sizes)}, "
+            "keep float models."
+        )
+    ok = p95 <= Config.INT8_MAX_DRIFT and not bad_sizes
+    if ok:
+        print(
+            f"[SUCCESS] Drift within {Config.INT8_MAX_DRIFT}, detections match. "
+            "Set Config.USE_INT8 = True."
+        )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="生成 INT8 量化的检测/识别模型，并检查与浮点模型的特征漂移"
+    )
+    parser.add_argument(
+        "--dynamic",
+        action="store_true",
+        help="只做动态量化 (不需要校准数据，精度通常低于静态量化)",
+    )
+    parser.add_argument(
+        "--images", type=int, default=CALIB_IMAGES, help="校准与检查使用的照片数"
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=CALIB_FRAMES,
+        help="额外用于检测模型校准与检测框对比的视频帧数",
+    )
+    parser.add_argument(
+        "--check-only", action="store_true", help="不重新量化，只检查已有的 INT8 模型"
+    )
+    args = parser.parse_args()
+
+    fp32 = load_processor(int8=False)
+    images, crops = load_fixtures(fp32, args.images)
+    if not crops:
+        print(f"[ERROR] No usable face photos under {FACES_PATH}/.")
+        sys.exit(1)
+    print(f"[INFO] Fixture set: {len(crops)} photos")
+
+    frames = load_frames(args.frames) if args.frames else []
+    if not frames:
+        print("[WARN] No video frames under videos/, comparing detections on photos.")
+
+    det, rec = fp32.det_model, fp32.rec_model
+    if not args.check_only:
+        det_images = images + frames
+        # 检测模型在 DET_SIZES 的每一档上都会用到 (逐档放大)，各档的激活范围不同，
+        # 校准数据覆盖全部档位；按需生成，不同时在内存中保留所有大尺寸输入
+        jobs = [
+            (
+                det,
+                (
+                    det_blob(det, img, size)
+                    for size in Config.DET_SIZES
+                    for img in det_images
+                ),
+            ),
+            (rec, [rec_blob(rec, [c]) for c in crops]),
+        ]
+        for model, blobs in jobs:
+            out_path = int8_path_for(model.model_file)
+            reader = None if args.dynamic else BlobReader(model.input_name, blobs)
+            mode = quantize(model.model_file, out_path, reader)
+            print(f"[INFO] {Path(model.model_file).name} -> {out_path} ({mode})")
+
+    missing = [
+        p
+        for p in (int8_path_for(det.model_file), int8_path_for(rec.model_file))
+        if not p.exists()
+    ]
+    if missing:
+        print(f"[ERROR] Missing INT8 models: {', '.join(map(str, missing))}")
+        sys.exit(1)
+    int8 = load_processor(int8=True)
+    sys.exit(0 if check(fp32, int8, frames or images, crops) else 1)
+
+
+if __name__ == "__main__":
+    main()
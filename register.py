@@ -1,31 +1,47 @@
 import os
-import sys
+import json
+import hashlib
 import logging
+import argparse
 import warnings
 import cv2
 import numpy as np
-import polars as pl
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 os.environ["ORT_LOGGING_LEVEL"] = "3"
 warnings.filterwarnings("ignore", category=FutureWarning)
 logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-from core.processor import FaceProcessor
+from core.config import Config
+from core.database import FaceDatabase
+from core.cache import ImageEmbeddingCache, file_stamp
+from core.index import index_path_for
+from core.processor import DetSizePolicy
+from core.utils import silence_stdout
 
+DB_PATH = "student_db.ipc"
+FACES_PATH = Path("faces")
+IMAGE_EXTS = ["*.jpg", "*.jpeg", "*.png"]
 
-def force_get_face(processor, img):
-    """多策略识别：原图 -> 翻转 -> 加边框"""
+
+def force_detect(processor, img):
+    """多策略检测：原图 -> 翻转 -> 加边框，返回 (检测所用图像, 人脸列表)
+
+    每张照片单独使用一个检测分辨率策略，不受其他照片 (及其处理顺序) 的影响
+    """
+    policy = DetSizePolicy()
     # 1. 原图尝试
-    faces = processor.get_faces(img)
+    faces = processor.detect(img, policy)
     if faces:
-        return faces
+        return img, faces
 
     # 2. 翻转尝试
-    faces = processor.get_faces(cv2.flip(img, 1))
+    flipped = cv2.flip(img, 1)
+    faces = processor.detect(flipped, policy)
     if faces:
-        return faces
+        return flipped, faces
 
     # 3. 加边框尝试 (解决裁切过紧)
     h, w = img.shape[:2]
@@ -33,72 +49,147 @@ def force_get_face(processor, img):
     padded_img = cv2.copyMakeBorder(
         img, border, border, border, border, cv2.BORDER_CONSTANT, value=[0, 0, 0]
     )
-    faces = processor.get_faces(padded_img)
-    return faces
-
-
-def run_registration():
-    original_stdout = sys.stdout
-    sys.stdout = open(os.devnull, "w")
-    try:
-        processor = FaceProcessor()
-        # 使用最高检测精度
-        processor.app.prepare(ctx_id=0, det_size=(1280, 1280))
-    finally:
-        sys.stdout.close()
-        sys.stdout = original_stdout
-
-    faces_path = Path("faces")
-    data = []
-    student_dirs = sorted([d for d in faces_path.iterdir() if d.is_dir()])
-
-    logger.info(f"Starting Robust Registration for {len(student_dirs)} folders...")
-
-    for s_dir in student_dirs:
-        name = s_dir.name
+    return padded_img, processor.detect(padded_img, policy)
+
+
+def align_best_face(processor, img_p):
+    """读取照片并检测，返回最大人脸的对齐裁剪图；读图失败或无人脸时返回 None"""
+    img = cv2.imread(str(img_p))
+    if img is None:
+        return None
+    img, faces = force_detect(processor, img)
+    if not faces:
+        return None
+    return processor.align(img, [processor.get_best_face(faces)])[0]
+
+
+def embed_crops(processor, crops):
+    """对齐后的人脸按 REC_BATCH_SIZE 成批提取特征，返回归一化后的 (N, D) 矩阵"""
+    feats = [
+        processor.rec_model.get_feat(crops[i : i + Config.REC_BATCH_SIZE])
+        for i in range(0, len(crops), Config.REC_BATCH_SIZE)
+    ]
+    feats = np.concatenate(feats).astype(np.float32)
+    return feats / np.linalg.norm(feats, axis=1, keepdims=True)
+
+
+def scan_students(faces_path):
+    """返回 [(姓名, 学号, 照片列表, 文件夹签名)]，签名由照片文件名、大小与修改时间计算"""
+    students = []
+    for s_dir in sorted(d for d in faces_path.iterdir() if d.is_dir()):
         id_file = s_dir / "id.txt"
         if not id_file.exists():
             continue
         student_id = id_file.read_text(encoding="utf-8").strip()
+        image_files = sorted(p for ext in IMAGE_EXTS for p in s_dir.glob(ext))
+        h = hashlib.sha1(student_id.encode("utf-8"))
+        for img_p in image_files:
+            h.update(f"|{img_p.name}:{file_stamp(img_p)}".encode("utf-8"))
+        students.append((s_dir.name, student_id, image_files, h.hexdigest()))
+    return students
 
-        image_files = []
-        for ext in ["*.jpg", "*.jpeg", "*.png"]:
-            image_files.extend(list(s_dir.glob(ext)))
 
-        embeddings = []
-        for img_p in image_files:
-            img = cv2.imread(str(img_p))
-            if img is None:
-                continue
+def load_existing(db_path):
+    """读取已有底库，返回 {学号: 特征}；底库不存在时返回空字典"""
+    if not Path(db_path).exists():
+        return {}
+    db = FaceDatabase(db_path).load()
+    return {sid: db.embeddings[i].copy() for i, sid in enumerate(db.ids)}
+
 
-            # 使用强力识别函数
-            faces = force_get_face(processor, img)
+def load_processor():
+    """静默加载视觉模型；检测分辨率自适应，裁切好的证件照用小尺寸即可，找不到人脸时才逐档放大"""
+    from core.processor import FaceProcessor
 
-            if faces:
-                # 选最大的脸
-                best_face = max(
-                    faces,
-                    key=lambda x: (x.bbox[2] - x.bbox[0]) * (x.bbox[3] - x.bbox[1]),
-                )
-                embeddings.append(best_face.normed_embedding)
+    with silence_stdout():
+        return FaceProcessor()
 
+
+def run_registration(full=False, workers=None):
+    students = scan_students(FACES_PATH)
+    logger.info(f"Starting Robust Registration for {len(students)} folders...")
+
+    # 文件夹签名未变且已在底库中的学生直接沿用底库特征 (保留实时进化的结果)
+    sig_path = Path(Config.CACHE_DIR) / "register_students.json"
+    old_sigs = {} if full or not sig_path.exists() else json.loads(sig_path.read_text())
+    existing = {} if full else load_existing(DB_PATH)
+    changed = [
+        s for s in students if old_sigs.get(s[1]) != s[3] or s[1] not in existing
+    ]
+    logger.info(
+        f"Unchanged: {len(students) - len(changed)} | To process: {len(changed)}"
+    )
+
+    # 照片级缓存：内容未变的照片不再检测与提取特征
+    cache = ImageEmbeddingCache()
+    images = [img_p for s in changed for img_p in s[2]]
+    workers = workers or Config.REGISTER_WORKERS
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        lookups = list(pool.map(cache.lookup, images))
+        misses = [(p, digest) for p, (hit, digest) in zip(images, lookups) if not hit]
+        # 全部命中缓存时不加载模型
+        processor = load_processor() if misses else None
+        crops = list(pool.map(lambda m: align_best_face(processor, m[0]), misses))
+    logger.info(f"Cached images: {len(images) - len(misses)} | New: {len(misses)}")
+
+    found = [(m, c) for m, c in zip(misses, crops) if c is not None]
+    if found:
+        feats = embed_crops(processor, [c for _, c in found])
+        for ((img_p, digest), _), feat in zip(found, feats):
+            cache.put(img_p, digest, feat)
+    for (img_p, digest), crop in zip(misses, crops):
+        if crop is None:
+            cache.put(img_p, digest, None)
+    cache.save()
+
+    changed_ids = {s[1] for s in changed}
+    data = []
+    for name, student_id, image_files, _ in students:
+        if student_id not in changed_ids:
+            data.append({"id": student_id, "name": name, "emb": existing[student_id]})
+            continue
+        embeddings = [
+            emb
+            for emb in (cache.lookup(p)[1] for p in image_files)
+            if isinstance(emb, np.ndarray)
+        ]
         if embeddings:
             mean_emb = np.mean(embeddings, axis=0)
             final_emb = mean_emb / np.linalg.norm(mean_emb)
-            data.append(
-                {"id": student_id, "name": name, "embedding": final_emb.tolist()}
-            )
+            data.append({"id": student_id, "name": name, "emb": final_emb})
             logger.info(f"Registered: {name:<12} | Samples: {len(embeddings)}")
         else:
             logger.error(f"FAILED: {name:<12} | Even with padding, no face found.")
 
+    removed = set(existing) - {d["id"] for d in data}
+    if removed:
+        logger.info(f"Removed: {len(removed)} students no longer in {FACES_PATH}/")
+
     if data:
-        df = pl.DataFrame(data)
-        df = df.with_columns(pl.col("embedding").cast(pl.List(pl.Float32)))
-        df.write_ipc("student_db.ipc")
+        FaceDatabase(DB_PATH).save(
+            {
+                "id": [d["id"] for d in data],
+                "name": [d["name"] for d in data],
+                "embedding": np.stack([d["emb"] for d in data]),
+            }
+        )
+        # 底库重建后旧的近似索引失效，下次加载时自动重建
+        index_path_for(DB_PATH).unlink(missing_ok=True)
+        # 只记录已入库学生的签名，注册失败的文件夹下次仍会重试
+        saved = {d["id"] for d in data}
+        sig_path.write_text(
+            json.dumps({s[1]: s[3] for s in students if s[1] in saved}),
+            encoding="utf-8",
+        )
         logger.info("-" * 50)
         logger.info(f"Database saved with {len(data)} records.")
 
 
 if __name__ == "__main__":
-    run_registration()
+    parser = argparse.ArgumentParser(description="注册 faces/ 下的学生照片")
+    parser.add_argument(
+        "--full", action="store_true", help="不沿用底库中的特征，全部按照片重新计算"
+    )
+    parser.add_argument("--workers", type=int, help="并行检测照片的线程数")
+    args = parser.parse_args()
+    run_registration(full=args.full, workers=args.workers)
@@ -1,91 +1,204 @@
-import sys
-import cv2
+import argparse
 import polars as pl
 from pathlib import Path
 from core.engine import AttendanceEngine
 from core.config import Config
+from core.events import EventLog, attendance_report, scan_events
+from core.metrics import metrics, MetricsExporter, profiling
+
+
+def process_videos(engine, targets, args, events=None):
+    """逐个产出 (视频路径, hits)，特征进化按视频与帧的顺序应用到 engine"""
+    # 解码与推理相关的模块 (cv2 等) 只在真正处理视频时导入
+    from core.batch import scan_video, scan_videos
+    from core.cache import VideoCache
+    from core.gating import parse_roi
+
+    roi = parse_roi(args.roi) if args.roi else None
+
+    if args.workers > 0:
+        # 多进程模式：各进程基于同一份底库快照匹配，父进程按视频顺序合并特征进化
+        # (与单进程模式的逐帧进化不同，两者的报表可能略有差异，见 scan_videos)
+        results = scan_videos(
+            targets,
+            engine.db_path,
+            args.workers,
+            args.sample_fps,
+            use_cache=not args.no_cache,
+            track=args.track,
+            events=events,
+            server=args.server,
+            gate=args.gate,
+            roi=roi,
+        )
+        for v_p, (hits, updates) in zip(targets, results):
+            print(f"[PROCESS] {v_p.name}")
+            engine.update_student_features(updates)
+            yield v_p, hits
+        return
+
+    cache = None if args.no_cache else VideoCache()
+    processors = None
+    for v_p in targets:
+        print(f"[PROCESS] {v_p.name}")
+        cached = cache and not args.track and cache.has(v_p, args.sample_fps)
+        if processors is None and not cached:
+            processors = engine.processor_pool(max(1, args.threads))
+
+        # 匹配与统计阶段：按帧序消费推理结果，保证特征进化顺序与逐帧处理一致
+        frames, hits = scan_video(
+            engine,
+            v_p,
+            args.sample_fps,
+            processors,
+            cache,
+            track=args.track,
+            events=events,
+            capture_process=args.capture_process,
+            gate=args.gate,
+            roi=roi,
+        )
+        for updates in frames:
+            engine.update_student_features(updates)
+        if events is not None:
+            events.flush()
+        yield v_p, hits
 
 
 def main():
-    engine = AttendanceEngine()
+    parser = argparse.ArgumentParser(description="批量处理课堂视频并生成考勤报表")
+    parser.add_argument("videos", nargs="*", help="videos/ 下的视频文件名，默认全部")
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=Config.PIPELINE_WORKERS,
+        help="推理线程数，每个线程独占一套 ONNX 会话",
+    )
+    parser.add_argument(
+        "--sample-fps",
+        type=float,
+        default=Config.BATCH_SAMPLE_FPS,
+        help="每秒采样的帧数",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="多进程并行处理视频的进程数，0 表示单进程流水线；"
+        "多进程时所有视频都与启动时的底库快照匹配 (进化在最后按顺序应用)，"
+        "结果与进程数无关，但可能与逐帧进化的单进程模式略有不同",
+    )
+    parser.add_argument(
+        "--capture-process",
+        action="store_true",
+        help="单进程流水线的解码放到独立进程，帧经共享内存传给推理线程 (不受 GIL 影响)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="不读写逐视频的推理结果缓存，强制重新解码与推理",
+    )
+    parser.add_argument(
+        "--track",
+        action="store_true",
+        help="跨帧跟踪人脸，只在必要时重新识别，并按轨迹计数 (不使用结果缓存)",
+    )
+    parser.add_argument(
+        "--gate",
+        action="store_true",
+        help="运动门控：画面没有变化的帧跳过检测，沿用上一帧的结果 (见 Config.GATE_*)",
+    )
+    parser.add_argument(
+        "--roi",
+        help='座位区域，归一化坐标的多边形 "x,y x,y x,y ..."，多个用 ";" 分隔，默认 Config.GATE_ROI',
+    )
+    parser.add_argument(
+        "--csv",
+        default="Attendance_Report.csv",
+        help="报表导出的 CSV 路径 (考勤以事件日志为准，CSV 只是导出视图)",
+    )
+    parser.add_argument("--no-csv", action="store_true", help="只打印报表，不导出 CSV")
+    parser.add_argument(
+        "--report-only",
+        action="store_true",
+        help="不处理视频，只根据已有的事件日志重新生成报表 (不加载模型)",
+    )
+    parser.add_argument(
+        "--server",
+        nargs="?",
+        const=Config.SERVICE_ADDRESS,
+        help=f"作为瘦客户端连接本机识别服务 (serve.py)，默认地址 {Config.SERVICE_ADDRESS}",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="定期导出各阶段耗时与计数的快照文件，.prom 后缀为 Prometheus 文本，其余为 JSON",
+    )
+    parser.add_argument(
+        "--profile",
+        help="剖析输出文件：.prof 为 cProfile 结果，其余后缀为所有线程的采样调用栈 (folded)",
+    )
+    args = parser.parse_args()
+
+    if args.server:
+        from core.remote import RemoteEngine
+
+        # 模型与底库都在识别服务中，本进程只负责解码、统计与报表
+        engine = RemoteEngine(args.server)
+    else:
+        # 模型按需加载：多进程模式由各工作进程加载，全部命中缓存时无需加载
+        engine = AttendanceEngine(load_processor=False)
     engine.sync_names()  # 自动同步 faces/ 目录的名字
 
-    video_dir, csv_path = Path("videos"), Path("Attendance_Report.csv")
+    video_dir, csv_path = Path("videos"), Path(args.csv)
     targets = (
-        [video_dir / a for a in sys.argv[1:] if (video_dir / a).exists()]
-        if len(sys.argv) > 1
+        [video_dir / a for a in args.videos if (video_dir / a).exists()]
+        if args.videos
         else sorted(list(video_dir.glob("*.mp4")))
     )
 
-    if not targets:
+    if not targets and not args.report_only:
         return
 
-    # 加载旧报表逻辑
-    if csv_path.exists():
-        old = pl.read_csv(csv_path)
-        v_cols = [c for c in old.columns if c.endswith(".mp4")]
-        report = (
-            engine.db.select(["id", "name"])
-            .join(old.select(["id"] + v_cols), on="id", how="left")
-            .fill_null(0)
-        )
-    else:
-        report = engine.db.select(["id", "name"])
+    events = EventLog()
+    # 首次使用事件日志时导入旧版 CSV 报表，保留以前各视频的考勤
+    if scan_events(events.root) is None and csv_path.exists():
+        events.import_report(pl.read_csv(csv_path))
 
-    for v_p in targets:
-        print(f"[PROCESS] {v_p.name}")
-        cap = cv2.VideoCapture(str(v_p))
-        fps = cap.get(cv2.CAP_PROP_FPS) or 30
-        hits = {sid: 0 for sid in engine.ids}
-
-        f_idx = 0
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if f_idx % max(1, int(fps / 2)) == 0:
-                for face in engine.processor.get_faces(frame):
-                    sid, score = engine.identify_face(face.normed_embedding)
-                    if sid:
-                        hits[sid] += 1
-                        if score > Config.QUALITY_SCORE_THRES:
-                            engine.update_student_feature(sid, face.normed_embedding)
-            f_idx += 1
-        cap.release()
-
-        if v_p.name in report.columns:
-            report = report.drop(v_p.name)
-        report = report.with_columns(
-            [pl.Series(name=v_p.name, values=[hits[s] for s in engine.ids])]
-        )
+    exporter = MetricsExporter(args.metrics).start() if args.metrics else None
+    if not args.report_only:
+        with profiling(args.profile):
+            for v_p, hits in process_videos(engine, targets, args, events):
+                present = sum(1 for n in hits.values() if n)
+                print(
+                    f"[DONE] {v_p.name}: {present}/{len(hits)} students, "
+                    f"{sum(hits.values())} hits"
+                )
+            engine.save_db()
+            events.close()
 
-    # 统计排序并保存
-    v_cols = sorted([c for c in report.columns if c.endswith(".mp4")])
-    report = report.with_columns(
-        [
-            pl.sum_horizontal(v_cols).alias("Total_Hits"),
-            pl.sum_horizontal([(pl.col(c) > 0).cast(pl.Int32) for c in v_cols]).alias(
-                "Attendance_Count"
-            ),
-        ]
-    ).with_columns([(len(v_cols) - pl.col("Attendance_Count")).alias("Absence_Count")])
-
-    engine.save_db()
-    final = report.select(
-        ["id", "name"] + v_cols + ["Total_Hits", "Attendance_Count", "Absence_Count"]
-    ).sort("id")
-    # final.write_csv(csv_path)
-    # 1. 以标准的 utf-8 打开文件 (满足 Polars)
-    with open(csv_path, "w", encoding="utf-8") as f:
-        # 2. 手动写入 BOM 字符 (满足 Excel)
-        f.write("\ufeff")
-        # 3. 让 Polars 接着写入 CSV 数据
-        final.write_csv(f)
+    # 报表是事件日志上的 lazy 查询：每个视频取最近一次运行的命中数
+    final = attendance_report(
+        engine.db, events.root, sources=pl.col("source").str.ends_with(".mp4")
+    )
+    if not args.no_csv:
+        # 1. 以标准的 utf-8 打开文件 (满足 Polars)
+        with open(csv_path, "w", encoding="utf-8") as f:
+            # 2. 手动写入 BOM 字符 (满足 Excel)
+            f.write("\ufeff")
+            # 3. 让 Polars 接着写入 CSV 数据
+            final.write_csv(f)
 
     print("\n" + "=" * 70)
     with pl.Config(tbl_rows=-1, tbl_cols=-1):
         print(final)
+        # 各阶段耗时 (多进程模式下已汇总各工作进程)
+        stages = metrics.summary()
+        if stages:
+            print(pl.DataFrame(stages))
+            print(metrics.snapshot()["counters"])
     print("=" * 70)
+    if exporter:
+        exporter.stop()
 
 
 if __name__ == "__main__":
@@ -1,56 +1,91 @@
 import os
+import argparse
+import threading
 import cv2
 import time
 import polars as pl
-from core.engine import AttendanceEngine
 from core.config import Config
+from core.engine import AttendanceEngine
+from core.events import EventLog
+from core.metrics import metrics, MetricsExporter, profiling
+from core.gating import parse_roi
+from core.streams import StreamServer
 
 
-def main():
-    engine = AttendanceEngine()
-    realtime_hits = {sid: 0 for sid in engine.ids}
-    cap = cv2.VideoCapture(0)
+def hits_frame(engine, report):
+    """每路视频源一列命中数，外加合计列"""
+    data = [
+        {
+            "ID": s,
+            "Name": n,
+            **{name: hits[s] for name, hits in report.items()},
+            "Hits": sum(hits[s] for hits in report.values()),
+        }
+        for s, n in zip(engine.ids, engine.names)
+    ]
+    return pl.DataFrame(data).sort("Hits", descending=True)
 
-    print("[INFO] Real-time system started. Press 'S' to save, 'Q' to quit.")
-    last_ui = 0
 
-    while cap.isOpened():
-        ret, frame = cap.read()
-        if not ret:
-            break
+def report_worker(engine, server, stop):
+    """界面线程：每 1.5 秒根据快照重绘终端报表，不阻塞采集与推理"""
+    while not stop.wait(1.5):
+        df = hits_frame(engine, server.report())
+        stats = pl.DataFrame(server.stats())
+        stages = metrics.summary()
+        os.system("cls" if os.name == "nt" else "clear")
+        print(f"--- Real-time Report ({time.strftime('%H:%M:%S')}) ---")
+        with pl.Config(tbl_rows=-1, tbl_cols=-1):
+            print(stats)
+            if stages:
+                print(pl.DataFrame(stages))
+            print(df)
 
-        for face in engine.processor.get_faces(frame):
-            sid, score = engine.identify_face(face.normed_embedding)
-            if sid:
-                realtime_hits[sid] += 1
-                if score > Config.QUALITY_SCORE_THRES:
-                    engine.update_student_feature(sid, face.normed_embedding)
 
-            # 绘制框
-            b = face.bbox.astype(int)
-            cv2.rectangle(frame, (b[0], b[1]), (b[2], b[3]), (0, 255, 0), 2)
+def run(args):
+    """启动多路实时考勤，直到按 Q 退出或所有视频源结束"""
+    if args.server:
+        from core.remote import RemoteEngine
 
-        cv2.imshow("Attendance", frame)
+        engine = RemoteEngine(args.server)
+    else:
+        engine = AttendanceEngine()
+    # 采集、推理、界面各自独立：采集线程只保留最新帧，推理线程池按路轮流处理并发布快照
+    # 命中持续写入考勤事件日志，"S" 导出的 CSV 只是当前计数的一个快照
+    server = StreamServer(
+        engine,
+        args.source or ["0"],
+        pool_size=args.pool,
+        track=args.track,
+        events=EventLog(),
+        capture_process=args.capture_process,
+        gate=args.gate,
+        roi=parse_roi(args.roi) if args.roi else None,
+    ).start()
+    stop = threading.Event()
+    threading.Thread(
+        target=report_worker, args=(engine, server, stop), daemon=True
+    ).start()
 
-        if time.time() - last_ui > 1.5:
-            os.system("cls" if os.name == "nt" else "clear")
-            data = [
-                {"ID": s, "Name": n, "Hits": realtime_hits[s]}
-                for s, n in zip(engine.ids, engine.names)
-            ]
-            df = pl.DataFrame(data).sort("Hits", descending=True)
-            print(f"--- Real-time Report ({time.strftime('%H:%M:%S')}) ---")
-            with pl.Config(tbl_rows=-1):
-                print(df)
-            last_ui = time.time()
+    exporter = MetricsExporter(args.metrics).start() if args.metrics else None
+    print("[INFO] Real-time system started. Press 'S' to save, 'Q' to quit.")
+
+    while server.running:
+        for stream in server.streams:
+            frame = stream.reader.latest()
+            if frame is None:
+                continue
+            # 在最新帧上叠加该路最近一次推理的人脸框
+            frame = frame.copy()
+            for face in stream.loop.snapshot.faces:
+                b = face.bbox.astype(int)
+                cv2.rectangle(frame, (b[0], b[1]), (b[2], b[3]), (0, 255, 0), 2)
+            cv2.imshow(f"Attendance - {stream.name}", frame)
 
-        key = cv2.waitKey(1) & 0xFF
+        key = cv2.waitKey(15) & 0xFF
         if key == ord("q"):
             break
         elif key == ord("s"):
-            engine.save_db()
-            # df.write_csv(f"Realtime_Report_{time.strftime('%Y%m%d_%H%M%S')}.csv")
-            # final.write_csv(csv_path)
+            df = hits_frame(engine, server.save())
             # 1. 以标准的 utf-8 打开文件 (满足 Polars)
             with open(
                 f"Realtime_Report_{time.strftime('%Y%m%d_%H%M%S')}.csv",
@@ -63,9 +98,66 @@ def main():
                 df.write_csv(f)
             print("[INFO] Snapshot saved.")
 
-    cap.release()
+    stop.set()
+    server.stop()
+    if exporter:
+        exporter.stop()
     cv2.destroyAllWindows()
 
 
+def main():
+    parser = argparse.ArgumentParser(
+        description="实时考勤 (支持多路摄像头/RTSP/视频文件)"
+    )
+    parser.add_argument(
+        "--source",
+        action="append",
+        help="摄像头编号、RTSP 地址或视频文件，可重复指定多路，默认摄像头 0；"
+        "写成 名称=视频源 可指定该路在报表与事件日志中的名称 (默认由视频源得出)",
+    )
+    parser.add_argument(
+        "--pool",
+        type=int,
+        default=None,
+        help=f"共享的推理会话数，默认 min(路数, {Config.STREAM_POOL_SIZE})",
+    )
+    parser.add_argument(
+        "--track",
+        action="store_true",
+        help="跨帧跟踪人脸，只在必要时重新识别，并按轨迹计数",
+    )
+    parser.add_argument(
+        "--server",
+        nargs="?",
+        const=Config.SERVICE_ADDRESS,
+        help=f"作为瘦客户端连接本机识别服务 (serve.py)，默认地址 {Config.SERVICE_ADDRESS}",
+    )
+    parser.add_argument(
+        "--gate",
+        action="store_true",
+        help="运动门控：画面没有变化的帧跳过检测，沿用上一帧的结果 (见 Config.GATE_*)",
+    )
+    parser.add_argument(
+        "--roi",
+        help='座位区域，归一化坐标的多边形 "x,y x,y x,y ..."，多个用 ";" 分隔，默认 Config.GATE_ROI',
+    )
+    parser.add_argument(
+        "--capture-process",
+        action="store_true",
+        help="每路视频源在独立进程中采集，帧经共享内存传给推理线程 (不受 GIL 影响)",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="定期导出各阶段耗时与计数的快照文件，.prom 后缀为 Prometheus 文本，其余为 JSON",
+    )
+    parser.add_argument(
+        "--profile",
+        help="剖析输出文件：.prof 为 cProfile 结果 (仅主线程)，其余后缀为所有线程的采样调用栈",
+    )
+    args = parser.parse_args()
+    with profiling(args.profile):
+        run(args)
+
+
 if __name__ == "__main__":
     main()
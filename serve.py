@@ -0,0 +1,57 @@
+import argparse
+import threading
+from core.config import Config
+from core.engine import AttendanceEngine
+from core.service import RecognitionService, make_server
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="本机识别服务：一套常驻模型与底库，供 run_batch/run_realtime 以 --server 共用"
+    )
+    parser.add_argument(
+        "--address",
+        default=Config.SERVICE_ADDRESS,
+        help='监听地址，"host:port" 或 "unix:/path/to.sock"',
+    )
+    parser.add_argument("--db", default="student_db.ipc", help="底库路径")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=Config.SERVICE_WORKERS,
+        help="推理会话数 (并行检测的请求数与识别合批线程数)",
+    )
+    parser.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=Config.SERVICE_MAX_WAIT_MS,
+        help="合批时最早的请求最多等待多久 (毫秒)",
+    )
+    args = parser.parse_args()
+
+    engine = AttendanceEngine(args.db)
+    engine.sync_names()
+    service = RecognitionService(
+        engine, engine.processor_pool(args.workers), max_wait=args.max_wait_ms
+    )
+    server = make_server(service, args.address)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"[INFO] Recognition service listening on {args.address}. Ctrl+C to stop.")
+
+    # 定期保存特征进化，服务意外退出时最多丢失一个间隔内的更新
+    stop = threading.Event()
+    try:
+        while not stop.wait(Config.SERVICE_SAVE_INTERVAL):
+            service.save()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+        service.save()
+        print("[INFO] Service stopped, database saved.")
+
+
+if __name__ == "__main__":
+    main()